@@ -1,4 +1,11 @@
-import pkg_resources
-
 name = 'gpx2dzg'
-__version__ = pkg_resources.require(name)[0].version
+
+try:
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        __version__ = version(name)
+    except PackageNotFoundError: # running from a source tree that has not been installed
+        __version__ = 'unknown'
+except ImportError: # python < 3.8
+    import pkg_resources
+    __version__ = pkg_resources.require(name)[0].version
@@ -0,0 +1,194 @@
+import numpy as np
+import gpx2dzg.functions as fx
+
+
+class Proposal(object):
+    """A proposed set of drops which makes DZX/DZT and GPX mark counts match.
+
+    Attributes
+    ----------
+    dzxdrops : list
+        Indices to drop from the DZX/DZT marks (as would be given to `-r`).
+    gpxdrops : list
+        Indices to drop from the GPX waypoints.
+    confidence : float
+        From 0 to 1. Near 1 when the remaining marks line up closely (the typical mismatch is a small fraction of
+        the spacing between marks), near 0 when the typical mismatch approaches half of the mark spacing.
+        Reduced in proportion to the number of marks dropped beyond those needed to make the counts equal.
+    metric : str
+        The GPX spacing the DZX/DZT scan spacing was matched against, `'distance'` or `'time'`.
+    cost : float
+        The alignment cost (lower is better).
+    """
+    __slots__ = ('dzxdrops', 'gpxdrops', 'confidence', 'metric', 'cost')
+
+    def __init__(self, dzxdrops=[], gpxdrops=[], confidence=0., metric='', cost=np.inf):
+        self.dzxdrops = dzxdrops
+        self.gpxdrops = gpxdrops
+        self.confidence = confidence
+        self.metric = metric
+        self.cost = cost
+
+    def __repr__(self):
+        return 'Proposal(dzxdrops=%s, gpxdrops=%s, confidence=%.2f, metric=%r)' % (
+            self.dzxdrops, self.gpxdrops, self.confidence, self.metric)
+
+
+def _normalize(v):
+    """Scales a sequence so that its first value is 0 and its last is 1."""
+    v = np.asarray(v, dtype=np.float64)
+    span = v[-1] - v[0]
+    return (v - v[0]) / span if span > 0 else np.zeros(len(v))
+
+
+def sequence(x=[], y=[], slack=10, gap=0.5):
+    """Aligns two increasing sequences of mark positions with a banded dynamic-programming algorithm,
+    dropping marks from either sequence so that the remaining marks line up as closely as possible.
+    The first and last marks of each sequence are always kept and matched to each other.
+
+    Both sequences are scaled to run from 0 to 1. Matching mark `i` of `x` to mark `j` of `y` costs
+    `abs(x[i] - y[j])` and dropping a mark costs `gap` times the median mark spacing. Only alignments which drop
+    at most `slack` more marks than necessary from each side are considered, so the work is proportional to
+    `len(x) * (abs(len(x) - len(y)) + 2 * slack)` rather than `len(x) * len(y)`.
+
+    Parameters
+    ----------
+    x : list
+        The first sequence (i.e. DZX/DZT scan numbers).
+    y : list
+        The second sequence (i.e. cumulative GPX distance or time).
+    slack : int
+        The number of extra drops allowed on each side, beyond those needed to make the counts equal.
+    gap : float
+        The cost of dropping a mark, as a fraction of the median mark spacing.
+
+    Returns
+    -------
+    tuple
+        `(xdrops, ydrops, confidence, cost)`: the indices to drop from each sequence, the confidence of the
+        alignment (see `Proposal`), and its total cost.
+    """
+    n, m = len(x), len(y)
+    if (n < 2) or (m < 2):
+        return [], [], 0., np.inf
+    x, y = _normalize(x), _normalize(y)
+    spacing = np.median(np.diff(x if n <= m else y))
+    g = gap * (spacing if spacing > 0 else 1. / (min(n, m) - 1))
+
+    # band of allowed offsets d = i - j, stored so that k = dmax - d and j = i - dmax + k
+    dmin, dmax = min(0, n - m) - slack, max(0, n - m) + slack
+    w = dmax - dmin + 1
+    ks = np.arange(w)
+    D = np.full((n, w), np.inf)
+
+    def row(i, a):
+        """Fills row i from the best way of reaching each cell from the previous row (`a`),
+        then allows runs of GPX drops along the row: D[k] = min over k' <= k of a[k'] + (k - k') * g."""
+        D[i] = np.minimum.accumulate(a - ks * g) + ks * g
+
+    for i in range(0, n - 1):
+        j = i - dmax + ks
+        valid = (j >= 0) & (j <= m - 2) # the last GPX mark is reserved for the last DZX/DZT mark
+        if i == 0: # the first marks are matched to each other
+            a = np.where(j == 0, abs(x[0] - y[0]), np.inf)
+        else:
+            c = np.where(valid & (j >= 1), np.abs(x[i] - y[np.clip(j, 0, m - 1)]), np.inf)
+            diag = D[i-1] + c # match x[i] with y[j]
+            up = np.append(D[i-1][1:], np.inf) + g # drop x[i]
+            a = np.where(valid, np.minimum(diag, up), np.inf)
+        row(i, a)
+        D[i][~valid] = np.inf
+
+    # the last marks are matched to each other
+    kend = dmax - ((n - 2) - (m - 2))
+    cost = D[n-2][kend] + abs(x[-1] - y[-1])
+    if not np.isfinite(cost):
+        return [], [], 0., np.inf
+
+    # backtrack
+    xdrops, ydrops, matched = [], [], [(n - 1, m - 1)]
+    i, k = n - 2, kend
+    while (i > 0) or (i - dmax + k > 0):
+        j = i - dmax + k
+        here = D[i][k]
+        tol = 1e-9 * max(1., abs(here))
+        if (i > 0) and (j > 0) and abs(D[i-1][k] + abs(x[i] - y[j]) - here) <= tol:
+            matched.append((i, j))
+            i -= 1
+        elif (i > 0) and (k + 1 < w) and abs(D[i-1][k+1] + g - here) <= tol:
+            xdrops.append(i)
+            i, k = i - 1, k + 1
+        else:
+            ydrops.append(j)
+            k -= 1
+    matched.append((0, 0))
+
+    # residual mismatch relative to mark spacing, scaled down by the share of marks dropped beyond those needed
+    r = np.array([x[a] - y[b] for a, b in matched])
+    s = 1. / max(len(matched) - 1, 1)
+    confidence = float(np.clip(1 - 2 * np.sqrt(np.mean(r**2)) / s, 0, 1)) * len(matched) / min(n, m)
+    return sorted(xdrops), sorted(ydrops), confidence, float(cost)
+
+
+def propose(dzxmarks=[], gpxmarks=None, slack=10, gap=0.5):
+    """Proposes drops which make DZX/DZT and GPX mark counts match, by aligning the DZX/DZT scan spacing with both
+    the GPX distance spacing (for surveys recorded with a survey wheel) and the GPX time spacing (for surveys
+    recorded by time), and keeping whichever lines up better.
+
+    Parameters
+    ----------
+    dzxmarks : list or gpx2dzg.io.MarkTable
+        DZX/DZT scan numbers of each mark.
+    gpxmarks : gpxpy.GPX or gpx2dzg.io.GPXData
+        The GPX waypoints.
+    slack : int
+        The number of extra drops allowed on each side (see `sequence()`).
+    gap : float
+        The cost of a drop as a fraction of mark spacing (see `sequence()`).
+
+    Returns
+    -------
+    Proposal
+        The best proposal.
+    """
+    times, lats, lons, elevs = fx.columns(gpxmarks)
+    k = fx.kinematics(lats=lats, lons=lons, times=times)
+    x = np.asarray(getattr(dzxmarks, 'scan', dzxmarks), dtype=np.float64)
+    best = Proposal()
+    for metric in ('distance', 'time'):
+        y = k['dist'] if metric == 'distance' else k['time']
+        xdrops, ydrops, confidence, cost = sequence(x=x, y=y, slack=slack, gap=gap)
+        if (confidence > best.confidence) or ((confidence == best.confidence) and (cost < best.cost)):
+            best = Proposal(dzxdrops=xdrops, gpxdrops=ydrops, confidence=confidence, metric=metric, cost=cost)
+    return best
+
+
+def apply(proposal=None, dzxmarks=[], gpxmarks=None, dzxnum=None):
+    """Applies a proposal's drops in place. Rows of `gpx2dzg.io.MarkTable` instances are masked rather than deleted.
+
+    Parameters
+    ----------
+    proposal : Proposal
+        The drops to apply.
+    dzxmarks : list or gpx2dzg.io.MarkTable
+        DZX/DZT scan numbers of each mark.
+    gpxmarks : gpxpy.GPX or gpx2dzg.io.GPXData
+        The GPX waypoints.
+    dzxnum : list
+        If given, the original DZX/DZT mark numbers (as used in the sanity check plot), which are dropped alongside `dzxmarks`.
+        Not needed for a `MarkTable`, which keeps track of them itself.
+    """
+    if hasattr(dzxmarks, 'drop'):
+        dzxmarks.drop(proposal.dzxdrops)
+    else:
+        for i in sorted(proposal.dzxdrops, reverse=True):
+            del dzxmarks[i]
+    if dzxnum is not None:
+        for i in sorted(proposal.dzxdrops, reverse=True):
+            del dzxnum[i]
+    if len(proposal.gpxdrops) > 0:
+        if hasattr(gpxmarks.waypoints, 'drop'):
+            gpxmarks.waypoints = gpxmarks.waypoints.drop(proposal.gpxdrops)
+        else:
+            for i in sorted(proposal.gpxdrops, reverse=True):
+                del gpxmarks.waypoints[i]
@@ -0,0 +1,235 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+import gpx2dzg.functions as fx
+import gpx2dzg.geoid as geoid
+import gpx2dzg.metrics as mc
+
+RADAR = ('.dzx', '.dzt')
+
+
+def findpairs(dir=''):
+    """Finds DZX/DZT and GPX pairs in a directory. Pairs are matched by file name (see `gpx2dzg.functions.findgpx()`).
+    If both a DZX and a DZT exist with the same name (as with SIR-4000 output), the DZX is used.
+
+    Parameters
+    ----------
+    dir : str
+        The directory to search.
+
+    Returns
+    -------
+    list
+        A list of `(dzx, gpx, drops)` tuples, sorted by DZX/DZT name. `drops` is always an empty list.
+    """
+    radar = {}
+    for f in sorted(os.listdir(dir)):
+        stem, ext = os.path.splitext(f)
+        if ext.lower() in RADAR:
+            if (stem not in radar) or (ext.lower() == '.dzx'):
+                radar[stem] = os.path.join(dir, f)
+    return [(radar[stem], fx.findgpx(radar[stem]), []) for stem in sorted(radar)]
+
+
+def readmanifest(manifest=''):
+    """Reads a batch manifest. Each line of the manifest contains a DZX/DZT path, and optionally a GPX path
+    (or `-` to search for an identically named GPX) and a list of drops, separated by whitespace::
+
+        # dzx                  gpx        drops
+        /data/FILE____001.DZX  -          3,4,-2
+        /data/FILE____002.DZT  /gps/2.gpx
+
+    Blank lines and lines starting with `#` are ignored. Relative paths are relative to the manifest's directory.
+
+    Parameters
+    ----------
+    manifest : str
+        The path of the manifest to read.
+
+    Returns
+    -------
+    list
+        A list of `(dzx, gpx, drops)` tuples in manifest order.
+    """
+    base = os.path.dirname(manifest)
+    pairs = []
+    with open(manifest, 'r') as f:
+        for n, line in enumerate(f, start=1):
+            line = line.split('#')[0].split()
+            if len(line) == 0:
+                continue
+            dzx = os.path.join(base, os.path.expanduser(line[0]))
+            gpx = fx.findgpx(dzx)
+            drops = []
+            if (len(line) > 1) and (line[1] != '-'):
+                gpx = os.path.join(base, os.path.expanduser(line[1]))
+            if len(line) > 2:
+                try:
+                    drops = fx.parsedrops(line[2])
+                except ValueError as e:
+                    fx.printmsg('WARNING: could not read drops on manifest line %s (ignoring): %s' % (n, e))
+            pairs.append((dzx, gpx, drops))
+    return pairs
+
+
+def _convertpair(pair, write=False, threshold=20000, every=0, autodrop=False, cache=False, plotdir=None,
+                 pipeline=False):
+    """Converts one pair with the process's `gpx2dzg.session.Converter`, catching errors so that one bad pair does
+    not abort a batch. `pair` is a `(dzx, gpx, drops)` tuple, or `(dzx, gpx, drops, gpxmarks, marks)` to use
+    already-read GPX data and DZX/DZT marks (see `gpx2dzg.project`). If `plotdir` is given, a sanity check plot of each
+    mismatched pair is saved there as `<DZX/DZT name>.png`.
+
+    Returns
+    -------
+    tuple
+        `(dzx, gpx, status, detail, metrics)` where status is one of `'written'`, `'matched'`, `'mismatched'`, or
+        `'failed'`, and metrics is a dict of stage timers and counters (see `gpx2dzg.metrics.Metrics.asdict()`),
+        or None if the conversion failed.
+    """
+    import gpx2dzg.gpx2dzg as g2d
+    dzx, gpx, drops = pair[:3]
+    gpxmarks = pair[3] if len(pair) > 3 else None
+    marks = pair[4] if len(pair) > 4 else None
+    try:
+        r = g2d.converter(cache=cache, pipeline=pipeline).convert(dzx=dzx, gpx=gpx, write=write, drops=list(drops), threshold=threshold,
+                                    every=every, autodrop=autodrop, gpxmarks=gpxmarks, marks=marks)
+        if r.matched:
+            return (dzx, gpx, 'written' if write else 'matched', '', r.metrics.asdict())
+        detail = ''
+        if plotdir:
+            import gpx2dzg.plot as px # matplotlib is only loaded when plotting
+            out = os.path.join(plotdir, os.path.basename(dzx) + '.png')
+            with mc.collect(r.metrics), mc.stage('plot'):
+                px.sanityplot(dzx=r.dzxmarks, dzxnum=r.dzxnum, dzxname=dzx, gpx=r.gpxmarks, gpxname=gpx, out=out)
+            detail = 'plot: %s' % out
+        return (dzx, gpx, 'mismatched', detail, r.metrics.asdict())
+    except Exception as e:
+        return (dzx, gpx, 'failed', '%s: %s' % (type(e).__name__, e), None)
+
+
+def run(batch='', write=False, processes=None, threshold=20000, every=0, autodrop=False, metrics=None, cache=False,
+        plotdir=None, catalog=None, utcoffset=0., pipeline=False):
+    """Converts every DZX/DZT and GPX pair in a directory or manifest, spreading conversions across a process pool.
+    Sanity check plots are never shown in batch mode.
+
+    Parameters
+    ----------
+    batch : str
+        A directory to search for pairs (see `findpairs()`) or a manifest file (see `readmanifest()`).
+    write : bool
+        Whether to write a DZG file for each pair with matching mark counts.
+    processes : int
+        The number of worker processes. Defaults to the number of CPUs. If 1, pairs are converted in this process.
+    threshold : int
+        The DZT mark threshold (see `gpx2dzg.io.readSIR3k()`).
+    every : int
+        If greater than zero, write a position every this many scans (see `gpx2dzg.io.writedense()`).
+    autodrop : bool
+        Whether to apply proposed drops to pairs whose mark counts do not match (see `gpx2dzg.gpx2dzg.convert()`).
+    metrics : str
+        If `'json'`, print each pair's stage timers and counters as a line of JSON after the summary.
+        If `'text'`, print them as tables.
+    cache : bool
+        Whether to use the on-disk cache of parsed inputs (see `gpx2dzg.cache.Cache`). The command line turns this on
+        unless `--no-cache` is given.
+    plotdir : str
+        If given, save a sanity check plot of each mismatched pair to this directory (created if needed).
+    catalog : gpx2dzg.catalog.Catalog
+        If given, pairs without a GPX are given the cataloged GPX covering their acquisition time
+        (see `gpx2dzg.catalog.Catalog.findfor()`).
+    utcoffset : float
+        The radar unit's clock offset from UTC in hours, for catalog lookups.
+    pipeline : bool
+        Whether each conversion reads its inputs at the same time on reader threads (see
+        `gpx2dzg.session.Converter`).
+
+    Returns
+    -------
+    dict
+        A summary of the run, with keys `'matched'`, `'mismatched'`, `'written'`, and `'failed'`, each containing a list of DZX/DZT paths,
+        and `'metrics'`, a dict of stage timers and counters for each converted DZX/DZT path.
+    """
+    if os.path.isdir(batch):
+        pairs = findpairs(dir=batch)
+    else:
+        pairs = readmanifest(manifest=batch)
+    fx.printmsg('batch: found %s DZX/DZT files to convert' % len(pairs))
+    if catalog is not None:
+        pairs = [(dzx, gpx if os.path.exists(gpx) else (catalog.findfor(dzx=dzx, utcoffset=utcoffset) or gpx), drops)
+                 for dzx, gpx, drops in pairs]
+    results = convertpairs(pairs=pairs, write=write, processes=processes, threshold=threshold, every=every,
+                           autodrop=autodrop, cache=cache, plotdir=plotdir, pipeline=pipeline)
+    return summarize(results=results, metrics=metrics)
+
+
+def convertpairs(pairs=[], write=False, processes=None, threshold=20000, every=0, autodrop=False, cache=False,
+                 plotdir=None, pipeline=False):
+    """Converts pairs across a process pool (see `run()` for parameters).
+
+    Parameters
+    ----------
+    pairs : list
+        A list of `(dzx, gpx, drops)` or `(dzx, gpx, drops, gpxmarks, marks)` tuples (see `_convertpair()`).
+
+    Returns
+    -------
+    list
+        A list of `(dzx, gpx, status, detail, metrics)` tuples in the same order as `pairs`.
+    """
+    if plotdir:
+        os.makedirs(plotdir, exist_ok=True)
+    processes = processes or os.cpu_count() or 1
+    if (processes > 1) and (len(pairs) > 1):
+        if write: # load the geoid once here so that forked workers inherit it instead of each building their own
+            geoid.load()
+        with ProcessPoolExecutor(max_workers=min(processes, len(pairs)), initializer=fx.logger.setLevel,
+                                 initargs=(fx.logger.level,)) as pool:
+            return list(pool.map(_convertpair, pairs, [write] * len(pairs), [threshold] * len(pairs),
+                                 [every] * len(pairs), [autodrop] * len(pairs), [cache] * len(pairs),
+                                 [plotdir] * len(pairs), [pipeline] * len(pairs)))
+    return [_convertpair(pair, write=write, threshold=threshold, every=every, autodrop=autodrop, cache=cache,
+                         plotdir=plotdir, pipeline=pipeline) for pair in pairs]
+
+
+def summarize(results=[], metrics=None):
+    """Prints a summary of results from `convertpairs()`, and their metrics if asked (see `run()`).
+
+    Returns
+    -------
+    dict
+        The summary returned by `run()`.
+    """
+    summary = {'matched': [], 'mismatched': [], 'written': [], 'failed': [], 'metrics': {}}
+    for dzx, gpx, status, detail, m in results:
+        if status == 'written':
+            summary['matched'].append(dzx)
+        summary[status].append(dzx)
+        if m is not None:
+            summary['metrics'][dzx] = m
+    printsummary(results=results)
+    if metrics == 'json':
+        for dzx, m in summary['metrics'].items():
+            print(json.dumps(dict(m, dzx=dzx)))
+    elif metrics == 'text':
+        for dzx, m in summary['metrics'].items():
+            mc.report(metrics=m, title='metrics for %s:' % os.path.basename(dzx))
+    return summary
+
+
+def printsummary(results=[]):
+    """Prints a table of batch results followed by totals.
+
+    Parameters
+    ----------
+    results : list
+        A list of `(dzx, gpx, status, detail, metrics)` tuples as returned by `_convertpair()`.
+    """
+    fx.printmsg('batch summary:', level=fx.SUMMARY)
+    for dzx, gpx, status, detail, m in results:
+        fx.printmsg('    %-10s %s %s' % (status, os.path.basename(dzx), detail), level=fx.SUMMARY)
+    counts = {}
+    for r in results:
+        counts[r[2]] = counts.get(r[2], 0) + 1
+    fx.printmsg('matched: %s, mismatched: %s, written: %s, failed: %s' % (
+                counts.get('matched', 0) + counts.get('written', 0), counts.get('mismatched', 0),
+                counts.get('written', 0), counts.get('failed', 0)), level=fx.SUMMARY)
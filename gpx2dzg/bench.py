@@ -0,0 +1,287 @@
+import os, sys
+import getopt
+import json
+import shutil
+import struct
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+import numpy as np
+import gpx2dzg.functions as fx
+import gpx2dzg.io as io
+import gpx2dzg.geoid as geoid
+
+SIZES = [10, 1000, 100000, 1000000]
+SPACING = 20 # scans between marks in generated files
+GPXPYMAX = 100000 # gpxpy is too slow and memory-hungry to include above this many marks
+CHUNK = 100000 # rows formatted at a time when generating files
+
+bench_help = u'''usage:
+python -m gpx2dzg.bench [-s 10,1000,100000,1000000] [-j results.json] [-m] [-k /dir]
+
+options:
+   OPTION    |       ARGUMENT       |       FUNCTIONALITY
+-s, --sizes  | list of ints         | numbers of marks to benchmark (default: 10,1000,100000,1000000)
+-j, --json   | file: /dir/out.json  | also write results to a JSON file, for comparison between versions
+-m, --no-memory | n/a               | skip the (slower) second run of each stage which records peak memory
+-k, --keep   | dir                  | generate inputs in this directory and keep them (default: a temporary directory)
+'''
+
+
+def gendzx(path='', scans=[], schema='TargetGroup'):
+    """Writes a synthetic DZX containing the given marks.
+
+    Parameters
+    ----------
+    path : str
+        The file to write.
+    scans : numpy.ndarray
+        Scan number of each mark.
+    schema : str
+        `'TargetGroup'` for the `<TargetGroup><TargetWayPt>` layout or `'File'` for the `<File><Profile><WayPt>` layout.
+    """
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<DZX xmlns="www.geophysical.com/DZX/1.02">\n')
+        if schema == 'TargetGroup':
+            f.write(' <TargetGroup>\n')
+            row = '  <TargetWayPt><scanSampChanProp>%d,0,0</scanSampChanProp><type>User</type></TargetWayPt>\n'
+        else:
+            f.write(' <File><Profile>\n')
+            row = '  <WayPt><scan>%d</scan><mark>User</mark></WayPt>\n'
+        for i in range(0, len(scans), CHUNK):
+            f.write(''.join(row % s for s in scans[i:i+CHUNK].tolist()))
+        f.write(' </TargetGroup>\n' if schema == 'TargetGroup' else ' </Profile></File>\n')
+        f.write('</DZX>\n')
+
+
+def gendzt(path='', nscans=0, marks=[], nsamp=32):
+    """Writes a synthetic single-channel 16-bit SIR-3000 DZT with marks in the second sample of the given scans.
+
+    Parameters
+    ----------
+    path : str
+        The file to write.
+    nscans : int
+        The number of scans.
+    marks : numpy.ndarray
+        Scan numbers of each mark (excluding the first and last scans, which are always read as marks).
+    nsamp : int
+        Samples per scan.
+    """
+    hdr = bytearray(io.MINHEADSIZE)
+    struct.pack_into('<hhhhH', hdr, 0, 0x00ff, io.MINHEADSIZE, nsamp, 16, 0x8000)
+    struct.pack_into('<f', hdr, 10, 32.)
+    struct.pack_into('<I', hdr, 32, (10 << 11) | (1 << 16) | (6 << 21) | ((2019 - 1980) << 25))
+    struct.pack_into('<h', hdr, 52, 1)
+    hdr[113] = (3 << 3) | 2
+    marks = np.asarray(marks, dtype=np.int64)
+    with open(path, 'wb') as f:
+        f.write(hdr)
+        for start in range(0, nscans, CHUNK):
+            count = min(CHUNK, nscans - start)
+            arr = np.full((count, nsamp), 32768, dtype='<u2')
+            arr[:, 1] = 0
+            inchunk = marks[(marks >= start) & (marks < start + count)] - start
+            arr[inchunk, 1] = 0xE800
+            f.write(arr.tobytes())
+
+
+def gengpx(path='', n=0, trk=0):
+    """Writes a synthetic GPX with `n` waypoints five seconds apart and `trk` track points one second apart.
+
+    Parameters
+    ----------
+    path : str
+        The file to write.
+    n : int
+        The number of waypoints.
+    trk : int
+        The number of track points.
+    """
+    start = np.datetime64('2019-06-01T14:00:00')
+    def times(count, step):
+        return np.datetime_as_string(start + np.arange(count) * np.timedelta64(step, 's')) + 'Z'
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="gpx2dzg.bench">\n')
+        i = np.arange(n)
+        lats, lons, elevs, ts = 44.9 + i * 0.00004, -68.67 + i * 0.00003 * np.sin(i / 7.), 20 + np.sin(i / 3.), times(n, 5)
+        for c in range(0, n, CHUNK):
+            f.write(''.join('  <wpt lat="%.7f" lon="%.7f"><ele>%.2f</ele><time>%s</time><name>%03d</name></wpt>\n' % r
+                            for r in zip(lats[c:c+CHUNK].tolist(), lons[c:c+CHUNK].tolist(),
+                                         elevs[c:c+CHUNK].tolist(), ts[c:c+CHUNK].tolist(), range(c, c + CHUNK))))
+        if trk > 0:
+            i = np.arange(trk)
+            lats, lons, elevs, ts = 44.9 + i * 0.000008, -68.67 + i * 0.000006 * np.sin(i / 35.), 20 + np.sin(i / 15.), times(trk, 1)
+            f.write('  <trk><name>bench</name><trkseg>\n')
+            for c in range(0, trk, CHUNK):
+                f.write(''.join('   <trkpt lat="%.7f" lon="%.7f"><ele>%.2f</ele><time>%s</time></trkpt>\n' % r
+                                for r in zip(lats[c:c+CHUNK].tolist(), lons[c:c+CHUNK].tolist(),
+                                             elevs[c:c+CHUNK].tolist(), ts[c:c+CHUNK].tolist())))
+            f.write('  </trkseg></trk>\n')
+        f.write('</gpx>\n')
+
+
+def generate(dir='', n=10):
+    """Generates a matching set of inputs with `n` marks each: a DZX of each schema, a SIR-3000 DZT, and a GPX with
+    `n` waypoints and `5 * n` track points.
+
+    Parameters
+    ----------
+    dir : str
+        The directory to write inputs to.
+    n : int
+        The number of marks.
+
+    Returns
+    -------
+    dict
+        Paths of the generated files, with keys `'dzx'`, `'dzxfile'` (the `File` schema), `'dzt'`, and `'gpx'`.
+    """
+    stem = os.path.join(dir, 'BENCH%07d' % n)
+    paths = {'dzx': stem + '.DZX', 'dzxfile': stem + '-file.DZX', 'dzt': stem + '.DZT', 'gpx': stem + '.gpx'}
+    scans = np.arange(n, dtype=np.int64) * SPACING
+    if not os.path.exists(paths['gpx']):
+        gendzx(path=paths['dzx'], scans=scans, schema='TargetGroup')
+        gendzx(path=paths['dzxfile'], scans=scans, schema='File')
+        gendzt(path=paths['dzt'], nscans=int(scans[-1]), marks=scans[1:-1])
+        gengpx(path=paths['gpx'], n=n, trk=5 * n)
+    return paths
+
+
+def measure(func, memory=True):
+    """Runs a function (with its messages suppressed) and measures wall time, and optionally peak Python memory
+    allocation in a second run, since tracing allocations slows code down.
+    Memory-mapped file reads are not Python allocations, so they are not counted.
+
+    Parameters
+    ----------
+    func : function
+        The function to run, with no arguments.
+    memory : bool
+        Whether to measure peak memory.
+
+    Returns
+    -------
+    tuple
+        `(seconds, peak)` where peak is in bytes, or None if not measured.
+    """
+    with open(os.devnull, 'w') as null, redirect_stdout(null):
+        t = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - t
+        peak = None
+        if memory:
+            tracemalloc.start()
+            try:
+                func()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return seconds, peak
+
+
+def stages(paths={}, n=10, dir=''):
+    """Returns the benchmarked stages for one input size, as `(name, function)` pairs.
+    The geoid model is loaded first, since it is loaded once per process rather than once per file."""
+    import gpx2dzg.gpx2dzg as g2d
+    dzg = os.path.join(dir, 'BENCH%07d-out.DZG' % n)
+    with open(os.devnull, 'w') as null, redirect_stdout(null):
+        dzxmarks = io.readdzx(dzx=paths['dzx'])
+        gpxmarks = io.readgpx(gpx=paths['gpx'], engine='stream')
+        geoid.load() # one-time per process costs are not counted
+    def convert():
+        for f in (os.path.splitext(paths['dzx'])[0] + '.DZG', os.path.splitext(paths['dzx'])[0] + '-gpx2dzg.DZG'):
+            if os.path.exists(f):
+                os.remove(f)
+        g2d.convert(dzx=paths['dzx'], gpx=paths['gpx'], write=True, autoplot=False, cache=False)
+    s = [
+        ('readdzx TargetGroup', lambda: io.readdzx(dzx=paths['dzx'])),
+        ('readdzx File', lambda: io.readdzx(dzx=paths['dzxfile'])),
+        ('readSIR3k', lambda: io.readSIR3k(dzt=paths['dzt'])),
+        ('readgpx stream', lambda: io.readgpx(gpx=paths['gpx'], engine='stream')),
+        ('readgpx stream+tracks', lambda: io.readgpx(gpx=paths['gpx'], engine='stream', tracks=True)),
+    ]
+    if n <= GPXPYMAX:
+        s.append(('readgpx gpxpy', lambda: io.readgpx(gpx=paths['gpx'], engine='gpxpy')))
+    s += [
+        ('distance_speed_time', lambda: fx.distance_speed_time(gpx=gpxmarks)),
+        ('write', lambda: io.write(dzg=dzg, dzxmarks=dzxmarks, gpxmarks=gpxmarks)),
+        ('convert', convert),
+    ]
+    return s
+
+
+def run(sizes=SIZES, dir=None, memory=True):
+    """Generates inputs at each size and benchmarks each stage, printing a table as it goes.
+
+    Parameters
+    ----------
+    sizes : list
+        Numbers of marks to benchmark.
+    dir : str
+        The directory to generate inputs in. If None, a temporary directory is used and removed afterwards.
+    memory : bool
+        Whether to measure peak memory (see `measure()`).
+
+    Returns
+    -------
+    list
+        One dict per stage and size, with keys `'stage'`, `'marks'`, `'seconds'`, and `'peak'` (bytes or None).
+    """
+    tmp = dir is None
+    if tmp:
+        dir = tempfile.mkdtemp(prefix='gpx2dzg-bench-')
+    results = []
+    try:
+        fx.printmsg('%-22s %9s %10s %10s' % ('stage', 'marks', 'seconds', 'peak MB'))
+        for n in sizes:
+            paths = generate(dir=dir, n=max(int(n), 3))
+            for name, func in stages(paths=paths, n=n, dir=dir):
+                seconds, peak = measure(func, memory=memory)
+                results.append({'stage': name, 'marks': n, 'seconds': seconds, 'peak': peak})
+                fx.printmsg('%-22s %9s %10.4f %10s' % (name, n, seconds, '-' if peak is None else '%.1f' % (peak / 1e6)))
+    finally:
+        if tmp:
+            shutil.rmtree(dir, ignore_errors=True)
+    return results
+
+
+def main():
+    """The argument parsing function for `python -m gpx2dzg.bench`."""
+    sizes, out, memory, dir = SIZES, None, True, None
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'hs:j:mk:', ['help', 'sizes=', 'json=', 'no-memory', 'keep='])
+    except getopt.GetoptError as e:
+        fx.printmsg('ERROR: invalid argument(s) supplied')
+        fx.printmsg('error text: %s' % e)
+        fx.printmsg(bench_help)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ('-h', '--help'):
+            fx.printmsg(bench_help)
+            sys.exit()
+        if opt in ('-s', '--sizes'):
+            try:
+                sizes = [int(s) for s in arg.strip('[]').split(',') if s.strip()]
+            except ValueError as e:
+                fx.printmsg('ERROR: sizes must be a list of integers. try "-s 10,1000"')
+                fx.printmsg('full error text: %s' % e)
+                sys.exit(2)
+        if opt in ('-j', '--json'):
+            out = os.path.expanduser(arg)
+        if opt in ('-m', '--no-memory'):
+            memory = False
+        if opt in ('-k', '--keep'):
+            dir = os.path.expanduser(arg)
+            os.makedirs(dir, exist_ok=True)
+    results = run(sizes=sizes, dir=dir, memory=memory)
+    if out:
+        with open(out, 'w') as f:
+            json.dump({'version': __import__('gpx2dzg').__version__, 'results': results}, f, indent=1)
+        fx.printmsg('results written to %s' % out)
+
+
+if __name__ == '__main__':
+    main()
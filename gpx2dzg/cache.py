@@ -0,0 +1,202 @@
+import os
+import json
+import uuid
+import hashlib
+from array import array
+import numpy as np
+import gpx2dzg.functions as fx
+import gpx2dzg.io as io
+import gpx2dzg.metrics as mc
+
+VERSION = 1 # bump when the cached format or the parsing that produces it changes
+MAXBYTES = 1 << 28 # default cache size limit (256 MB)
+
+
+def cachedir():
+    """Returns the default cache directory: `$GPX2DZG_CACHE` if set, otherwise `gpx2dzg` in the user's cache directory
+    (`$XDG_CACHE_HOME` or `~/.cache`)."""
+    if os.environ.get('GPX2DZG_CACHE'):
+        return os.path.expanduser(os.environ['GPX2DZG_CACHE'])
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'gpx2dzg')
+
+
+def filehash(path='', blocksize=1 << 20):
+    """Returns the BLAKE2b hash of a file's contents as a hex string."""
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Cache(object):
+    """A size-bounded on-disk cache of parsed inputs (DZX/DZT mark arrays and GPX columns), stored as `.npz` files.
+
+    Entries are keyed by the input's absolute path, size, and modification time (or, with `hash=True`, by its size
+    and content hash, so that copies and touched files still hit), the kind of read and its parameters, and the
+    cache format and `gpx2dzg` versions, so entries from other versions are never used. When the cache grows past
+    `maxbytes`, the least recently used entries are removed.
+
+    Parameters
+    ----------
+    dir : str
+        The cache directory. Defaults to `cachedir()`.
+    maxbytes : int
+        The maximum total size of cached entries.
+    hash : bool
+        Key entries by content hash instead of path and modification time. Hashing reads the whole file,
+        which is still much faster than parsing it.
+    """
+    def __init__(self, dir=None, maxbytes=MAXBYTES, hash=False):
+        from gpx2dzg import __version__
+        self.dir = dir or cachedir()
+        self.maxbytes = maxbytes
+        self.hash = hash
+        self.version = '%s-%s' % (VERSION, __version__)
+
+    def key(self, path='', kind=''):
+        """Returns the entry name for a file and kind of read."""
+        st = os.stat(path)
+        if self.hash:
+            parts = [kind, st.st_size, filehash(path)]
+        else:
+            parts = [kind, os.path.abspath(path), st.st_size, st.st_mtime_ns]
+        return hashlib.blake2b(json.dumps([self.version] + parts).encode('utf-8'), digest_size=16).hexdigest()
+
+    def _path(self, key=''):
+        return os.path.join(self.dir, key + '.npz')
+
+    def get(self, path='', kind=''):
+        """Returns the cached arrays for a file and kind of read as a dict, or None if there is no usable entry."""
+        try:
+            entry = self._path(self.key(path=path, kind=kind))
+            with np.load(entry, allow_pickle=False) as z:
+                if str(z['version']) != self.version:
+                    return None
+                arrays = {k: z[k] for k in z.files if k != 'version'}
+            os.utime(entry) # mark as recently used
+            return arrays
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e: # unreadable or corrupt entry
+            fx.printmsg('cache: ignoring unreadable cache entry for %s (%s)' % (path, e))
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            return None
+
+    def put(self, path='', kind='', arrays={}):
+        """Stores arrays for a file and kind of read, then evicts old entries if the cache is over its size limit.
+        Failures (i.e. a read-only cache directory or a full disk) are reported and otherwise ignored. A partly
+        written entry is always removed."""
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            entry = self._path(self.key(path=path, kind=kind))
+        except OSError as e:
+            fx.printmsg('cache: could not write cache entry for %s (%s)' % (path, e))
+            return
+        tmp = '%s.%s.tmp' % (entry, uuid.uuid4().hex[:8])
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, version=np.array(self.version), **arrays)
+            os.replace(tmp, entry)
+        except BaseException as e:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            if not isinstance(e, OSError):
+                raise
+            fx.printmsg('cache: could not write cache entry for %s (%s)' % (path, e))
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache is no larger than `maxbytes`."""
+        entries = []
+        for e in os.scandir(self.dir):
+            if e.name.endswith('.npz'):
+                try:
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+                except OSError:
+                    pass
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxbytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """Removes every entry."""
+        if os.path.isdir(self.dir):
+            for e in os.scandir(self.dir):
+                if e.name.endswith('.npz'):
+                    os.remove(e.path)
+
+    def marks(self, path='', kind='', read=None):
+        """Returns DZX/DZT marks from the cache, or from `read()` (which is then cached).
+
+        Parameters
+        ----------
+        path : str
+            The DZX or DZT path.
+        kind : str
+            The kind of read and its parameters (i.e. `'dzt20000'` for a DZT read with threshold 20000).
+        read : function
+            Reads the marks if they are not cached.
+
+        Returns
+        -------
+        array.array
+            Scan numbers of each mark.
+        """
+        a = self.get(path=path, kind=kind)
+        if a is not None:
+            marks = array('q')
+            marks.frombytes(a['marks'].astype(np.int64).tobytes())
+            fx.printmsg('cache: read %s marks from cache' % len(marks))
+            mc.count('disk cache hits')
+            return marks
+        marks = read()
+        self.put(path=path, kind=kind, arrays={'marks': np.asarray(marks, dtype=np.int64)})
+        return marks
+
+    def gpx(self, path='', kind='', read=None):
+        """Returns GPX columns from the cache, or from `read()` (which is then cached).
+
+        Parameters
+        ----------
+        path : str
+            The GPX path.
+        kind : str
+            The kind of read (i.e. `'gpx'` or `'gpx+trk'`).
+        read : function
+            Reads the GPX if it is not cached, returning a `gpx2dzg.io.GPXData` instance.
+
+        Returns
+        -------
+        gpx2dzg.io.GPXData
+            The GPX data.
+        """
+        a = self.get(path=path, kind=kind)
+        if a is not None:
+            cols = lambda p: io.MarkTable(time=a[p + 'time'], lat=a[p + 'lat'], lon=a[p + 'lon'], ele=a[p + 'ele'])
+            g = io.GPXData(waypoints=cols('w'), tracks=cols('t') if 'ttime' in a else None)
+            fx.printmsg('cache: read %s gpx marks from cache' % len(g.waypoints))
+            mc.count('disk cache hits')
+            return g
+        g = read()
+        arrays = {}
+        for p, points in (('w', g.waypoints), ('t', g.tracks)):
+            if points is not None:
+                arrays.update({p + 'time': points.time, p + 'lat': points.lat, p + 'lon': points.lon,
+                               p + 'ele': points.ele})
+        self.put(path=path, kind=kind, arrays=arrays)
+        return g
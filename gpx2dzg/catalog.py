@@ -0,0 +1,361 @@
+import os, sys
+import getopt
+import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import gpx2dzg.functions as fx
+import gpx2dzg.io as io
+
+INDEX = '.gpx2dzg-catalog.json' # default index file name, in the archive directory
+VERSION = 2 # bump when the index format changes
+NOTIME = np.iinfo(np.int64).min
+
+catalog_help = u'''usage:
+gpx2dzg catalog /path/to/gpx/archive [--index /path/to/index.json] [-n 4]
+gpx2dzg catalog /path/to/gpx/archive --find /path/to/file.DZT [--utc-offset -4]
+
+options:
+   OPTION    |       ARGUMENT       |       FUNCTIONALITY
+--index      | file: /dir/c.json    | where to keep the index (default: .gpx2dzg-catalog.json in the archive directory)
+-n, --processes | int                | number of processes used to read new or changed GPX files (default: number of CPUs)
+--find       | file: /dir/f.DZT     | print the GPX covering a DZT's (or a DZX's identically named DZT's) acquisition time
+--utc-offset | hours                | the radar unit's clock offset from UTC (i.e. -4 for EDT). DZT times are local to the unit
+'''
+
+
+class IntervalTree(object):
+    """A static interval tree for finding which intervals overlap a point or range.
+
+    Intervals are sorted by start and stored as an implicit balanced binary tree (the middle of each range of the
+    sorted arrays is that range's root), with each node holding the largest end in its subtree. A query visits only
+    subtrees that can contain an overlap, so it takes `O(log n + k)` time for `k` results.
+
+    Parameters
+    ----------
+    intervals : list
+        A list of `(start, end, item)` tuples, with `start <= end`.
+    """
+    def __init__(self, intervals=[]):
+        intervals = sorted(intervals, key=lambda iv: iv[0])
+        self.starts = [iv[0] for iv in intervals]
+        self.ends = [iv[1] for iv in intervals]
+        self.items = [iv[2] for iv in intervals]
+        self.maxend = list(self.ends)
+        self._build(0, len(intervals))
+
+    def __len__(self):
+        return len(self.items)
+
+    def _build(self, lo=0, hi=0):
+        """Fills in `maxend` for the subtree over `[lo, hi)` and returns its largest end."""
+        if lo >= hi:
+            return NOTIME
+        mid = (lo + hi) // 2
+        self.maxend[mid] = max(self.ends[mid], self._build(lo, mid), self._build(mid + 1, hi))
+        return self.maxend[mid]
+
+    def query(self, start=0, end=None):
+        """Returns the items whose intervals overlap `[start, end]` (or contain `start` if `end` is None).
+
+        Parameters
+        ----------
+        start : int
+            The start of the range.
+        end : int
+            The end of the range.
+
+        Returns
+        -------
+        list
+            The overlapping items, in no particular order.
+        """
+        end = start if end is None else end
+        found, stack = [], [(0, len(self.items))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.maxend[mid] < start: # nothing in this subtree ends after the range starts
+                continue
+            stack.append((lo, mid))
+            if self.starts[mid] <= end: # otherwise, nothing to the right starts before the range ends
+                if self.ends[mid] >= start:
+                    found.append(self.items[mid])
+                stack.append((mid + 1, hi))
+        return found
+
+
+def describe(gpx=''):
+    """Reads a GPX and summarizes it for the catalog.
+
+    Parameters
+    ----------
+    gpx : str
+        The GPX path.
+
+    Returns
+    -------
+    dict
+        `'start'` and `'end'` (UTC int64 nanoseconds of the first and last timed waypoint or track point, or None
+        if there are none), `'wptstart'` and `'wptend'` (the same for waypoints only), `'waypoints'` and
+        `'trackpoints'` (counts), and `'bbox'` (`[min lat, min lon, max lat, max lon]` of all points, or None).
+        Track-only logs are described like any other, with no waypoint span.
+    """
+    g = io.readgpx(gpx=gpx, engine='stream', tracks=True, check=False)
+    pts = [g.waypoints] + ([g.tracks] if g.tracks is not None else [])
+    times = np.concatenate([p.time for p in pts])
+    times = times[times != NOTIME]
+    wpttimes = g.waypoints.time[g.waypoints.time != NOTIME]
+    lats, lons = np.concatenate([p.lat for p in pts]), np.concatenate([p.lon for p in pts])
+    return {
+        'start': int(times.min()) if len(times) else None,
+        'end': int(times.max()) if len(times) else None,
+        'wptstart': int(wpttimes.min()) if len(wpttimes) else None,
+        'wptend': int(wpttimes.max()) if len(wpttimes) else None,
+        'waypoints': len(g.waypoints),
+        'trackpoints': len(g.tracks) if g.tracks is not None else 0,
+        'bbox': [float(lats.min()), float(lons.min()), float(lats.max()), float(lons.max())] if len(lats) else None,
+    }
+
+
+def _describe(gpx=''):
+    """`describe()` for a process pool, returning errors as strings instead of raising them."""
+    try:
+        return describe(gpx=gpx)
+    except Exception as e:
+        return '%s: %s' % (type(e).__name__, e)
+
+
+def acquisition(dzx='', utcoffset=0.):
+    """Returns the UTC time span of a radar file, from its DZT header (`rhb_cdt` and the number of scans divided
+    by scans per second). For a DZX, the identically named DZT is read.
+
+    Parameters
+    ----------
+    dzx : str
+        The DZX or DZT path.
+    utcoffset : float
+        The offset in hours of the radar unit's clock from UTC (i.e. -4 for a unit set to EDT).
+
+    Returns
+    -------
+    tuple
+        `(start, end)` as UTC int64 nanoseconds, or None if there is no DZT or its header has no date.
+    """
+    dzt = dzx
+    if not dzx.lower().endswith('.dzt'):
+        dzt = next((os.path.splitext(dzx)[0] + ext for ext in ('.DZT', '.dzt')
+                    if os.path.exists(os.path.splitext(dzx)[0] + ext)), None)
+        if dzt is None:
+            return None
+    h = io.readheader(dzt=dzt)
+    if h['rhb_cdt'] is None:
+        return None
+    start = int(np.datetime64(h['rhb_cdt'], 'ns').astype(np.int64) - round(utcoffset * 3600e9))
+    seconds = h['nscans'] / h['rhf_sps'] if h['rhf_sps'] > 0 else 0.
+    return start, start + int(seconds * 1e9)
+
+
+class Catalog(object):
+    """An index of the GPX files in an archive: each file's time span, point counts, and bounding box, kept in a
+    JSON index file and queried through an `IntervalTree`, so the GPX recorded during a radar file can be found
+    without opening any GPX.
+
+    Parameters
+    ----------
+    archive : str
+        The archive directory, searched recursively for `.gpx` files.
+    index : str
+        The index file path. Defaults to `.gpx2dzg-catalog.json` in the archive directory.
+    """
+    def __init__(self, archive='', index=None):
+        self.archive = os.path.abspath(archive)
+        self.index = index or os.path.join(self.archive, INDEX)
+        self.entries = {} # path relative to the archive: entry (see describe(), plus 'size' and 'mtime')
+        self._tree = None
+        self.load()
+
+    def load(self):
+        """Reads the index file, if there is a readable one of this version."""
+        try:
+            with open(self.index, 'r') as f:
+                d = json.load(f)
+            if d.get('version') == VERSION:
+                self.entries = d.get('files', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            fx.printmsg('WARNING: could not read catalog index %s (rebuilding it): %s' % (self.index, e))
+        self._tree = None
+
+    def save(self):
+        """Writes the index file, replacing the old one in a single step. Failures (i.e. a read-only archive) are
+        reported and otherwise ignored."""
+        tmp = '%s.%s.tmp' % (self.index, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'version': VERSION, 'files': self.entries}, f, indent=1)
+            os.replace(tmp, self.index)
+        except OSError as e:
+            fx.printmsg('WARNING: could not write catalog index %s (use --index): %s' % (self.index, e))
+
+    def update(self, processes=None):
+        """Brings the index up to date with the archive: reads GPX files that are new or whose size or modification
+        time has changed, and forgets files that no longer exist. Unchanged files are not opened.
+
+        Parameters
+        ----------
+        processes : int
+            The number of processes to read GPX files with. Defaults to the number of CPUs.
+
+        Returns
+        -------
+        tuple
+            The numbers of files added or changed, removed, and that could not be read.
+        """
+        found = {}
+        for root, dirs, files in os.walk(self.archive):
+            for f in files:
+                if f.lower().endswith('.gpx'):
+                    path = os.path.join(root, f)
+                    st = os.stat(path)
+                    found[os.path.relpath(path, self.archive)] = (st.st_size, st.st_mtime_ns)
+        removed = [p for p in self.entries if p not in found]
+        for p in removed:
+            del self.entries[p]
+        todo = [p for p, (size, mtime) in found.items()
+                if (p not in self.entries) or (self.entries[p]['size'], self.entries[p]['mtime']) != (size, mtime)]
+        fx.printmsg('catalog: %s gpx files, %s new or changed, %s removed' % (len(found), len(todo), len(removed)))
+        paths = [os.path.join(self.archive, p) for p in sorted(todo)]
+        processes = processes or os.cpu_count() or 1
+        if (processes > 1) and (len(paths) > 1):
+            with ProcessPoolExecutor(max_workers=min(processes, len(paths)), initializer=fx.logger.setLevel,
+                                     initargs=(fx.logger.level,)) as pool:
+                described = list(pool.map(_describe, paths, chunksize=8))
+        else:
+            described = [_describe(p) for p in paths]
+        failed = 0
+        for p, d in zip(sorted(todo), described):
+            if isinstance(d, str):
+                fx.printmsg('WARNING: could not read %s (skipping): %s' % (p, d))
+                self.entries.pop(p, None)
+                failed += 1
+            else:
+                self.entries[p] = dict(d, size=found[p][0], mtime=found[p][1])
+        self._tree = None
+        self.save()
+        return len(todo) - failed, len(removed), failed
+
+    @property
+    def tree(self):
+        """IntervalTree: The waypoint time spans of every indexed GPX with timed waypoints, built when first needed.
+        Track points are left out, since only waypoints can be matched with marks."""
+        if self._tree is None:
+            self._tree = IntervalTree([(e['wptstart'], e['wptend'], p) for p, e in self.entries.items()
+                                       if e['wptstart'] is not None])
+        return self._tree
+
+    def find(self, start=0, end=None):
+        """Finds the GPX files whose waypoint time spans overlap a time range, best first.
+
+        Parameters
+        ----------
+        start : int
+            The start of the range, as UTC int64 nanoseconds.
+        end : int
+            The end of the range. Defaults to `start`.
+
+        Returns
+        -------
+        list
+            `(gpx path, overlap)` tuples, where overlap is the fraction of the range the GPX covers (1 for a point
+            inside its span). Sorted by overlap, then by the shortest waypoint span, so a log covering just the survey
+            comes before a multi-day one.
+        """
+        end = start if end is None else end
+        found = []
+        for p in self.tree.query(start, end):
+            e = self.entries[p]
+            overlap = (min(e['wptend'], end) - max(e['wptstart'], start)) / (end - start) if end > start else 1.
+            found.append((os.path.join(self.archive, p), overlap, e['wptend'] - e['wptstart']))
+        found.sort(key=lambda f: (-f[1], f[2]))
+        return [f[:2] for f in found]
+
+    def findfor(self, dzx='', utcoffset=0.):
+        """Finds the GPX best covering a radar file's acquisition time (see `acquisition()` and `find()`).
+
+        Parameters
+        ----------
+        dzx : str
+            The DZX or DZT path.
+        utcoffset : float
+            The offset in hours of the radar unit's clock from UTC.
+
+        Returns
+        -------
+        str
+            The GPX path, or None if no GPX overlaps the radar file or it has no acquisition time.
+        """
+        span = acquisition(dzx=dzx, utcoffset=utcoffset)
+        if span is None:
+            fx.printmsg('WARNING: no DZT acquisition time found for %s' % dzx)
+            return None
+        found = self.find(*span)
+        if len(found) == 0:
+            fx.printmsg('WARNING: no cataloged gpx overlaps %s (%s UTC)' % (
+                os.path.basename(dzx), np.datetime64(span[0], 'ns').astype('datetime64[s]')))
+            return None
+        gpx, overlap = found[0]
+        fx.printmsg('catalog: %s covers %.0f%% of %s' % (gpx, overlap * 100, os.path.basename(dzx)))
+        if len(found) > 1:
+            fx.printmsg('catalog: %s other gpx files also overlap it' % (len(found) - 1))
+        return gpx
+
+
+def main(argv=[]):
+    """The argument parsing function for `gpx2dzg catalog`.
+
+    Parameters
+    ----------
+    argv : list
+        The arguments following `catalog` on the command line.
+    """
+    index, processes, find, utcoffset = None, None, None, 0.
+    try:
+        optlist, args = getopt.gnu_getopt(argv, 'hn:', ['help', 'index=', 'processes=', 'find=', 'utc-offset='])
+    except getopt.GetoptError as e:
+        fx.printmsg('ERROR: invalid argument(s) supplied')
+        fx.printmsg('error text: %s' % e)
+        fx.printmsg(catalog_help)
+        sys.exit(2)
+    for opt, arg in optlist:
+        if opt in ('-h', '--help'):
+            fx.printmsg(catalog_help)
+            sys.exit()
+        try:
+            if opt in ('-n', '--processes'):
+                processes = int(arg)
+            if opt == '--utc-offset':
+                utcoffset = float(arg)
+        except ValueError as e:
+            fx.printmsg('ERROR: %s must be a number' % opt)
+            fx.printmsg('full error text: %s' % e)
+            sys.exit(2)
+        if opt == '--index':
+            index = os.path.expanduser(arg)
+        if opt == '--find':
+            find = os.path.expanduser(arg)
+    if len(args) != 1 or not os.path.isdir(os.path.expanduser(args[0])):
+        fx.printmsg('ERROR: specify one gpx archive directory')
+        fx.printmsg(catalog_help)
+        sys.exit(2)
+    c = Catalog(archive=os.path.expanduser(args[0]), index=index)
+    if find:
+        c.update(processes=processes) # only new or changed files are read
+        if c.findfor(dzx=find, utcoffset=utcoffset) is None:
+            sys.exit(1)
+        return
+    added, removed, failed = c.update(processes=processes)
+    fx.printmsg('catalog: indexed %s gpx files (%s read, %s removed, %s unreadable) in %s' % (
+        len(c.entries), added, removed, failed, c.index))
@@ -0,0 +1,164 @@
+import os
+import re
+import mmap
+import time
+from concurrent.futures import ProcessPoolExecutor
+import gpx2dzg.functions as fx
+import gpx2dzg.io as io
+import gpx2dzg.batch as bt
+
+# the first character of each scan number tells a mark (1-9) from a skipped zero or negative scan (0 or -)
+TARGETSCAN = re.compile(rb'<(?:[\w.-]+:)?scanSampChanProp>\s*(-|0|[1-9])')
+FILESCAN = re.compile(rb'<(?:[\w.-]+:)?scan>\s*(-|0|[1-9])')
+WPT = re.compile(rb'<(?:[\w.-]+:)?wpt[\s>/]')
+
+
+def _search(path='', pattern=None):
+    """Returns every match of `pattern` in a file (its first group, if it has one),
+    scanning a read-only memory map of the file instead of reading it into memory."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return pattern.findall(m)
+
+
+def countdzx(dzx=''):
+    """Counts the marks in a DZX without parsing it, by searching for scan number elements.
+    As with `gpx2dzg.io.readdzx()`, the zero point is counted, scans that are zero or negative are not,
+    and `TargetGroup` marks are used if there are any, otherwise `File` marks.
+
+    Parameters
+    ----------
+    dzx : str
+        The DZX path.
+
+    Returns
+    -------
+    int
+        The number of marks `gpx2dzg.io.readdzx()` would return.
+
+    Raises
+    ------
+    ValueError
+        If no marks are found.
+    """
+    for pattern in (TARGETSCAN, FILESCAN):
+        marks = sum(1 for c in _search(path=dzx, pattern=pattern) if c not in (b'-', b'0'))
+        if marks > 0:
+            return marks + 1
+    raise ValueError('no marks found under "TargetGroup" or "File"')
+
+
+def countdzt(dzt='', threshold=20000):
+    """Counts the marks in a DZT, reading only the mark sample of each scan (see `gpx2dzg.io.markscans()`).
+
+    Parameters
+    ----------
+    dzt : str
+        The DZT path.
+    threshold : int
+        The DZT mark threshold (see `gpx2dzg.io.readSIR3k()`).
+
+    Returns
+    -------
+    int
+        The number of marks `gpx2dzg.io.readSIR3k()` would return, including the start and end of the file.
+    """
+    return len(io.markscans(dzt=dzt, threshold=threshold)) + 2
+
+
+def countgpx(gpx=''):
+    """Counts the `<wpt>` elements in a GPX without parsing it, by searching for tags whose name is `wpt`, with or
+    without a namespace prefix (i.e. `<gpx:wpt>`). Extension tags that only start with `wpt`
+    (i.e. Garmin's `<wptx1:WaypointExtension>`) are not counted.
+
+    Parameters
+    ----------
+    gpx : str
+        The GPX path.
+
+    Returns
+    -------
+    int
+        The number of waypoints.
+    """
+    return len(_search(path=gpx, pattern=WPT))
+
+
+def _checkpair(pair, threshold=20000):
+    """Counts the marks in one `(dzx, gpx, drops)` pair, catching errors so that one bad file does not stop the check.
+    Drops are subtracted from the DZX/DZT count, ignoring the same drops `gpx2dzg.functions.drop()` would.
+
+    Returns
+    -------
+    tuple
+        `(dzx, gpx, status, dzxcount, gpxcount, detail)` where status is `'matched'`, `'mismatched'`, or `'failed'`.
+        Counts are None if the check failed.
+    """
+    dzx, gpx, drops = pair[:3]
+    try:
+        dzxcount = countdzt(dzt=dzx, threshold=threshold) if '.dzt' in dzx.lower() else countdzx(dzx=dzx)
+        gpxcount = countgpx(gpx=gpx)
+    except (OSError, ValueError) as e:
+        return (dzx, gpx, 'failed', None, None, '%s: %s' % (type(e).__name__, e))
+    n = dzxcount
+    dzxcount -= len({j for j in (i + n if i < 0 else i for i in drops) if 0 < j < n - 1})
+    return (dzx, gpx, 'matched' if dzxcount == gpxcount else 'mismatched', dzxcount, gpxcount, '')
+
+
+def run(batch='', processes=None, threshold=20000, pairs=None):
+    """Checks whether the DZX/DZT and GPX mark counts of every pair in a directory or manifest match, without
+    converting anything. Marks are counted by searching the raw bytes of each DZX and GPX and reading only the
+    mark sample of each DZT scan, with no XML parsing, radar array, or geodesy, across a process pool. Counts
+    are the same as a conversion would find (before automatic drops) for files written by GSSI units and GPS
+    receivers, but comments or unusual layouts can make them differ.
+
+    Parameters
+    ----------
+    batch : str
+        A directory to search for pairs (see `gpx2dzg.batch.findpairs()`) or a manifest file (see
+        `gpx2dzg.batch.readmanifest()`, whose drops are subtracted from the DZX/DZT counts).
+    processes : int
+        The number of worker processes. Defaults to the number of CPUs. If 1, pairs are checked in this process.
+    threshold : int
+        The DZT mark threshold (see `gpx2dzg.io.readSIR3k()`).
+    pairs : list
+        `(dzx, gpx, drops)` tuples to check instead of those in `batch`.
+
+    Returns
+    -------
+    dict
+        A summary with keys `'matched'`, `'mismatched'`, and `'failed'`, each containing a list of DZX/DZT paths,
+        and `'counts'`, a dict of `(dzxcount, gpxcount)` for each checked DZX/DZT path.
+    """
+    if pairs is None:
+        pairs = bt.findpairs(dir=batch) if os.path.isdir(batch) else bt.readmanifest(manifest=batch)
+    fx.printmsg('check: counting marks in %s DZX/DZT and GPX pairs' % len(pairs))
+    start = time.perf_counter()
+    processes = processes or os.cpu_count() or 1
+    if (processes > 1) and (len(pairs) > 1):
+        with ProcessPoolExecutor(max_workers=min(processes, len(pairs))) as pool:
+            results = list(pool.map(_checkpair, pairs, [threshold] * len(pairs),
+                                    chunksize=max(len(pairs) // (processes * 8), 1)))
+    else:
+        results = [_checkpair(pair, threshold=threshold) for pair in pairs]
+    elapsed = time.perf_counter() - start
+
+    summary = {'matched': [], 'mismatched': [], 'failed': [], 'counts': {}}
+    size = 0
+    fx.printmsg('check summary:', level=fx.SUMMARY)
+    fx.printmsg('    %-10s %9s %9s %7s  %s' % ('status', 'dzx/dzt', 'gpx', 'diff', 'file'), level=fx.SUMMARY)
+    for dzx, gpx, status, dzxcount, gpxcount, detail in results:
+        summary[status].append(dzx)
+        if status == 'failed':
+            fx.printmsg('    %-10s %9s %9s %7s  %s %s' % (status, '-', '-', '-', os.path.basename(dzx), detail), level=fx.SUMMARY)
+            continue
+        summary['counts'][dzx] = (dzxcount, gpxcount)
+        size += sum(os.path.getsize(p) for p in (dzx, gpx))
+        fx.printmsg('    %-10s %9s %9s %+7d  %s' % (status, dzxcount, gpxcount, dzxcount - gpxcount,
+                                                     os.path.basename(dzx)), level=fx.SUMMARY)
+    fx.printmsg('matched: %s, mismatched: %s, failed: %s' % (len(summary['matched']), len(summary['mismatched']),
+                                                             len(summary['failed'])), level=fx.SUMMARY)
+    fx.printmsg('check: read %.1f MB in %.3f s' % (size / 1e6, elapsed))
+    return summary
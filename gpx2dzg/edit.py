@@ -0,0 +1,251 @@
+import numpy as np
+import gpx2dzg.functions as fx
+import gpx2dzg.io as io
+import gpx2dzg.nmea as nmea
+import gpx2dzg.geoid as geoid
+import gpx2dzg.declination as declination
+from gpx2dzg.exceptions import MarkCountError, DZGWriteError
+
+
+class DropSession(object):
+    """Drop editing for one DZX/DZT and GPX pair, with results kept between edits.
+
+    Geoid height and declination depend only on each GPX waypoint, so they are looked up once for every waypoint
+    when first needed. Distance, speed, and course depend only on the pair of waypoints either side of a segment,
+    and each DZG block only on its mark, its waypoint, and that waypoint's neighbours, so these are memoized by
+    index. Dropping or restoring a mark then only recalculates the segments and blocks next to it, and
+    `preview()` and `write()` produce the same output as `gpx2dzg.io.write()` would for the current drops.
+
+    Drops are given as index locations in the original (undropped) marks, the same numbers shown on the sanity
+    check plot and used with `-r`. As with `gpx2dzg.functions.drop()`, the first and last marks cannot be dropped,
+    and negative indices count from the end.
+
+    Parameters
+    ----------
+    dzxmarks : list or gpx2dzg.io.MarkTable
+        Scan numbers of each DZX/DZT mark.
+    gpxmarks : gpx2dzg.io.GPXData or gpxpy.GPX
+        The GPX waypoints.
+
+    Attributes
+    ----------
+    dzx : gpx2dzg.io.MarkTable
+        The DZX/DZT marks, with the current drops.
+    gpx : gpx2dzg.io.MarkTable
+        The GPX waypoints, with the current drops.
+    mode : str
+        Distance calculation mode, `'karney'` or `'fast'` (see `gpx2dzg.functions.distances()`).
+    dec : gpx2dzg.declination.Declination
+        The declination service to use. Defaults to the process-wide service.
+    """
+    def __init__(self, dzxmarks=None, gpxmarks=None, mode='fast', dec=None):
+        self.scans = np.asarray(getattr(dzxmarks, 'scan', dzxmarks), dtype=np.int64)
+        self.times, self.lats, self.lons, self.elevs = fx.columns(gpxmarks)
+        self.elapsed = self.times.astype(np.int64) / 1e9
+        self.mode = mode
+        self.dec = dec or declination.service()
+        self.dzx = io.MarkTable(scan=self.scans)
+        self.gpx = io.MarkTable(time=self.times.astype(np.int64), lat=self.lats, lon=self.lons, ele=self.elevs)
+        self._ghs = None
+        self._decs = None
+        self._segments = {} # (waypoint, next waypoint): (distance, speed, course)
+        self._blocks = {} # (mark, waypoint, previous waypoint, next waypoint): DZG block
+        self._plot = None # gpx2dzg.plot.SanityPlot, kept between plot() calls
+
+    @property
+    def dzxnum(self):
+        """numpy.ndarray: Original index of each mark that is kept."""
+        return self.dzx.num
+
+    @property
+    def gpxnum(self):
+        """numpy.ndarray: Original index of each waypoint that is kept."""
+        return self.gpx.num
+
+    @property
+    def drops(self):
+        """list: Original indices of dropped DZX/DZT marks."""
+        return self.dzx.dropped
+
+    @property
+    def gpxdrops(self):
+        """list: Original indices of dropped GPX waypoints."""
+        return self.gpx.dropped
+
+    @property
+    def matched(self):
+        """bool: Whether the numbers of kept marks and waypoints are the same."""
+        return len(self.dzx) == len(self.gpx)
+
+    def _indices(self, indices=[], n=0):
+        """Converts negative indices to positive ones and leaves out (with a warning) the first and last marks
+        and anything out of range."""
+        out = []
+        for i in indices:
+            j = i + n if i < 0 else i
+            if 0 < j < n - 1:
+                out.append(j)
+            else:
+                fx.printmsg('WARNING: cannot drop the start point (0 or %s) or before, or the end point (%s or -1) or after. (ignoring [%s])' % (-n, n-1, i))
+        return out
+
+    def drop(self, dzx=[], gpx=[]):
+        """Drops DZX/DZT marks and GPX waypoints.
+
+        Parameters
+        ----------
+        dzx : list
+            Original indices of DZX/DZT marks to drop.
+        gpx : list
+            Original indices of GPX waypoints to drop.
+        """
+        self.dzx.dropnum(self._indices(dzx, self.dzx.total))
+        self.gpx.dropnum(self._indices(gpx, self.gpx.total))
+
+    def restore(self, dzx=[], gpx=[]):
+        """Restores dropped DZX/DZT marks and GPX waypoints.
+
+        Parameters
+        ----------
+        dzx : list
+            Original indices of DZX/DZT marks to restore.
+        gpx : list
+            Original indices of GPX waypoints to restore.
+        """
+        self.dzx.restore(self._indices(dzx, self.dzx.total))
+        self.gpx.restore(self._indices(gpx, self.gpx.total))
+
+    def gpxmarks(self):
+        """Returns the kept GPX waypoints as a `gpx2dzg.io.GPXData` instance (for `gpx2dzg.plot.sanityplot()`)."""
+        return io.GPXData(waypoints=self.gpx.copy())
+
+    def _segmentsfor(self, a=[], b=[]):
+        """Returns distance, speed, and course arrays for segments from waypoints `a` to `b`, calculating only
+        the segments not already known."""
+        pairs = list(zip(a.tolist(), b.tolist()))
+        new = [p for p in pairs if p not in self._segments]
+        if new:
+            i, j = np.array(new, dtype=np.int64).T
+            # interleave so that every other consecutive pair is a wanted segment
+            lats = np.column_stack((self.lats[i], self.lats[j])).ravel()
+            lons = np.column_stack((self.lons[i], self.lons[j])).ravel()
+            dist = fx.distances(lats=lats, lons=lons, mode=self.mode)[::2]
+            crs = fx.bearings(lats=lats, lons=lons)[::2]
+            dt = self.elapsed[j] - self.elapsed[i]
+            spd = np.zeros(len(new))
+            np.divide(dist, dt, out=spd, where=dt > 0)
+            self._segments.update(zip(new, zip(dist.tolist(), spd.tolist(), crs.tolist())))
+        segs = np.array([self._segments[p] for p in pairs], dtype=np.float64).reshape(-1, 3)
+        return segs[:, 0], segs[:, 1], segs[:, 2]
+
+    def kinematics(self):
+        """Returns distance, speed, speed over ground, and course for the kept waypoints,
+        in the same form as `gpx2dzg.functions.kinematics()`."""
+        g = self.gpxnum
+        dist, spd, crs = self._segmentsfor(g[:-1], g[1:])
+        n = len(g)
+        return {
+            'dist': np.concatenate(([0.], np.cumsum(dist))) if n > 0 else np.zeros(0),
+            'time': self.elapsed[g] - self.elapsed[g[0]] if n > 0 else np.zeros(0),
+            'spd': spd,
+            'sog': fx.ms2kt(speed=np.concatenate((spd[:1], spd))) if n > 1 else np.zeros(n),
+            'course': np.concatenate(([0.], crs)) if n > 1 else np.zeros(n),
+        }
+
+    def _lookups(self):
+        """Looks up geoid height and declination for every waypoint, the first time they are needed."""
+        if self._ghs is None:
+            geoid.load()
+            self._ghs = np.asarray(geoid.height(lats=self.lats, lons=self.lons), dtype=np.float64)
+            self._decs = np.asarray(self.dec.lookup(lats=self.lats, lons=self.lons, times=self.times),
+                                    dtype=np.float64)
+            self.dec.report()
+
+    def preview(self):
+        """Returns the DZG blocks for the current drops, formatting only the blocks that changed since the last call.
+
+        Returns
+        -------
+        list
+            One string per mark, the same as `gpx2dzg.io.write()` writes.
+
+        Raises
+        ------
+        gpx2dzg.exceptions.MarkCountError
+            If the numbers of kept marks and waypoints do not match.
+        """
+        d, g = self.dzxnum, self.gpxnum
+        if len(d) != len(g):
+            raise MarkCountError('%s dzx/dzt marks and %s gpx marks are kept' % (len(d), len(g)))
+        prev = np.concatenate(([-1], g[:-1]))
+        nxt = np.concatenate((g[1:2], np.full(len(g) - 1, -1, dtype=np.int64))) # only the first block uses the next
+        keys = list(zip(d.tolist(), g.tolist(), prev.tolist(), nxt.tolist()))
+        new = [r for r, key in enumerate(keys) if key not in self._blocks]
+        if new:
+            self._lookups()
+            k = self.kinematics()
+            rows, gi = np.array(new, dtype=np.int64), g[new]
+            blocks = nmea.blocks(scans=self.scans[d[rows]].tolist(), times=self.times[gi], lats=self.lats[gi],
+                                 lons=self.lons[gi], elevs=self.elevs[gi], geoidh=self._ghs[gi],
+                                 sogs=k['sog'][rows], courses=k['course'][rows], decs=self._decs[gi])
+            self._blocks.update(zip((keys[r] for r in new), blocks))
+        return [self._blocks[key] for key in keys]
+
+    def write(self, dzg=''):
+        """Writes a DZG for the current drops (see `gpx2dzg.io.DZGWriter`).
+
+        Parameters
+        ----------
+        dzg : str
+            The DZG path.
+
+        Raises
+        ------
+        gpx2dzg.exceptions.MarkCountError
+            If the numbers of kept marks and waypoints do not match.
+        gpx2dzg.exceptions.DZGWriteError
+            If the DZG cannot be written because of file permissions.
+        """
+        blocks = self.preview()
+        try:
+            with io.DZGWriter(dzg) as f:
+                f.write(''.join(blocks))
+        except PermissionError as e:
+            fx.writeerror(e=e)
+            raise DZGWriteError('could not write %s: %s' % (dzg, e)) from e
+        fx.printmsg('wrote %s positions to %s' % (len(blocks), dzg))
+
+    def plot(self, gpxname='GPX', dzxname='DZX', out=None):
+        """Shows the sanity check plot (see `gpx2dzg.plot.sanityplot()`) for the current drops, or saves it.
+        The figure is kept between calls, and after an edit only its marks, labels, and speed line are redrawn,
+        from the memoized segments (see `kinematics()`). The shown window does not block, so edits can be made
+        while it is open.
+
+        Parameters
+        ----------
+        gpxname : str
+            The name of the GPX file, for the text above its number lines.
+        dzxname : str
+            The name of the DZX/DZT file, for the text above its number line.
+        out : str
+            If given, the plot is saved to this image file (i.e. a `.png`) without a display, instead of being shown.
+
+        Returns
+        -------
+        matplotlib.figure.Figure
+            The sanity check plot.
+        """
+        import gpx2dzg.plot as plot
+        p = self._plot
+        if (p is None) or (p.headless and not out) or not (p.headless or plot.isopen(p.fig)):
+            p = self._plot = plot.SanityPlot(headless=bool(out))
+        k, d = self.kinematics(), self.dzxnum
+        p.draw(dist=k['dist'], spd=k['spd'], tm=k['time'], dzx=self.scans[d], dzxnum=d, gpxname=gpxname,
+               dzxname=dzxname)
+        if out:
+            p.save(out)
+        else:
+            import matplotlib.pyplot as plt
+            plt.show(block=False)
+            plt.pause(0.001) # let the window redraw
+        return p.fig
@@ -0,0 +1,26 @@
+class GPX2DZGError(Exception):
+    """The base class of errors raised by `gpx2dzg`."""
+
+
+class InputNotFoundError(GPX2DZGError, FileNotFoundError):
+    """An input DZX, DZT, or GPX file does not exist."""
+
+
+class DZXError(GPX2DZGError):
+    """A DZX file could not be parsed or contains no readable marks."""
+
+
+class DZTError(GPX2DZGError):
+    """A DZT file could not be read."""
+
+
+class GPXError(GPX2DZGError):
+    """A GPX file could not be parsed or contains no waypoints."""
+
+
+class DZGWriteError(GPX2DZGError):
+    """A DZG file could not be written."""
+
+
+class MarkCountError(GPX2DZGError, ValueError):
+    """The number of DZX/DZT marks does not match the number of GPX waypoints."""
@@ -0,0 +1,434 @@
+import os, sys
+import getopt
+import time
+import xml.etree.ElementTree as et
+from array import array
+import numpy as np
+import gpx2dzg.functions as fx
+import gpx2dzg.io as io
+import gpx2dzg.nmea as nmea
+import gpx2dzg.geoid as geoid
+import gpx2dzg.declination as declination
+from gpx2dzg.exceptions import GPX2DZGError, DZXError, DZTError, GPXError, DZGWriteError
+
+follow_help = u'''usage:
+gpx2dzg follow /path/to/file.DZX [-g /path/to/file.gpx] [--dzg /path/to/out.DZG] [-i 2] [-e 60]
+
+options:
+   OPTION    |       ARGUMENT       |       FUNCTIONALITY
+-g, --gpx    | file: /dir/f.gpx     | the gpx being recorded (default: the identically named gpx)
+--dzg        | file: /dir/f.DZG     | the DZG to write (default: as for gpx2dzg -w)
+-i, --interval | seconds            | how often to look for new marks and waypoints (default: 2)
+-e, --idle   | seconds              | finish once neither file has grown for this long. 0 follows until ctrl-c (default: 60)
+-t, -q       |  see gpx2dzg -h      | as for single conversions
+'''
+
+
+class XMLTail(object):
+    """Parses an XML file that is still being written, a piece at a time.
+
+    Each `read()` feeds the bytes appended since the last call to an incremental parser, up to the end of the last
+    occurrence of one of `ends` (the closing tag of a record), so a closing root tag that the recording program
+    rewrites after each record is never parsed. Elements are discarded once they are handled.
+
+    Parameters
+    ----------
+    path : str
+        The file to read.
+    """
+    ends = () # byte strings which end a complete record
+
+    def __init__(self, path=''):
+        self.path = path
+        self.offset = 0
+        self.parser = et.XMLPullParser(events=('start', 'end'))
+        self.stack, self.tags = [], []
+
+    def shrunk(self):
+        """Returns True if the file is now shorter than the part already read (i.e. it was replaced)."""
+        return os.path.exists(self.path) and (os.path.getsize(self.path) < self.offset)
+
+    def read(self):
+        """Parses the records appended since the last call. Does nothing if the file does not exist yet."""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        end = max((data.rfind(e) + len(e) for e in self.ends if e in data), default=0)
+        if end == 0:
+            return
+        self.parser.feed(data[:end])
+        self.offset += end
+        for event, elem in self.parser.read_events():
+            tag = elem.tag.rsplit('}', 1)[-1]
+            if event == 'start':
+                self.stack.append(elem)
+                self.tags.append(tag)
+                self.start(tag=tag)
+                continue
+            self.end(tag=tag, elem=elem)
+            self.stack.pop()
+            self.tags.pop()
+            if len(self.stack) > 0:
+                del self.stack[-1][-1] # this element was the parent's last child. discard it to keep memory use flat
+
+    def start(self, tag=''):
+        """Called when an element starts."""
+        pass
+
+    def end(self, tag='', elem=None):
+        """Called when an element ends, while `self.tags` still includes it."""
+        pass
+
+    def finish(self):
+        """Called once the file is complete."""
+        pass
+
+
+class DZXTail(XMLTail):
+    """Reads marks from a DZX that is still being written (see `gpx2dzg.io.readdzx()`). Marks are taken from
+    whichever layout (`TargetGroup` or `File`) the first mark is found in.
+
+    Attributes
+    ----------
+    marks : array.array
+        Scan numbers of each mark read so far, starting with zero.
+    """
+    ends = (b'WayPt>',)
+
+    def __init__(self, path=''):
+        super().__init__(path=path)
+        self.marks = array('q', [0])
+        self.kind = None
+
+    def read(self):
+        try:
+            super().read()
+        except (et.ParseError, ValueError, AttributeError) as e:
+            fx.printmsg('ERROR: could not parse DZX: %s' % e)
+            raise DZXError('could not parse %s: %s' % (self.path, e)) from e
+
+    def end(self, tag='', elem=None):
+        t = self.tags
+        if (len(t) == 4) and (t[1] == 'TargetGroup') and ('TargetWayPt' in t[2]) and ('scanSampChanProp' in t[3]):
+            kind, scan = 'TargetGroup', int(elem.text.split(',')[0])
+        elif (len(t) == 5) and (t[1] == 'File') and ('Profile' in t[2]) and ('WayPt' in t[3]) and ('scan' in t[4]):
+            kind, scan = 'File', int(elem.text)
+        else:
+            return
+        if (scan > 0) and (self.kind in (None, kind)): # the zero point is already there
+            self.kind = kind
+            self.marks.append(scan)
+
+
+class DZTTail(object):
+    """Reads marks from a DZT that is still being recorded (see `gpx2dzg.io.readSIR3k()`), reading the mark sample
+    of only the scans recorded since the last call. The end of the file is added as the last mark by `finish()`.
+
+    Parameters
+    ----------
+    path : str
+        The DZT to read.
+    threshold : int
+        The DZT mark threshold.
+
+    Attributes
+    ----------
+    marks : array.array
+        Scan numbers of each mark read so far, starting with zero.
+    """
+    def __init__(self, path='', threshold=20000):
+        self.path, self.threshold = path, threshold
+        self.marks = array('q', [0])
+        self.header = None
+        self.nscans = 0
+
+    def _end(self):
+        """Returns the byte offset of the end of the scans already read."""
+        h = self.header
+        return h['data_offset'] + self.nscans * h['rh_nsamp'] * max(h['rh_nchan'], 1) * h['dtype'].itemsize
+
+    def shrunk(self):
+        """Returns True if the file is now shorter than the part already read (i.e. it was replaced)."""
+        return (self.header is not None) and os.path.exists(self.path) and (os.path.getsize(self.path) < self._end())
+
+    def read(self):
+        """Reads the marks in scans recorded since the last call. Does nothing if there is no complete header yet."""
+        try:
+            header = io.readheader(dzt=self.path) # only the header bytes are read. nscans comes from the file size
+            if self.header is None:
+                self.header = header
+            self.marks.extend(io.markscans(dzt=self.path, header=header, threshold=self.threshold,
+                                           start=self.nscans).tolist())
+            self.nscans = header['nscans']
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            if self.header is None: # the header is not written yet
+                return
+            fx.printmsg('ERROR: could not read DZT: %s' % e)
+            raise DZTError('could not read %s: %s' % (self.path, e)) from e
+
+    def finish(self):
+        self.marks.append(self.nscans)
+
+
+class GPXTail(XMLTail):
+    """Reads waypoints from a GPX that is still being written (see `gpx2dzg.io.readgpx()`).
+
+    Attributes
+    ----------
+    times : array.array
+        UTC time of each waypoint read so far, as int64 nanoseconds.
+    lats, lons, eles : array.array
+        Latitude, longitude, and elevation of each waypoint read so far.
+    """
+    ends = (b'wpt>',)
+
+    def __init__(self, path=''):
+        super().__init__(path=path)
+        self.times, self.lats, self.lons, self.eles = array('q'), array('d'), array('d'), array('d')
+        self.pending = [] # time strings of new waypoints, converted together once a read is done
+        self.ele = self.time = None
+
+    def read(self):
+        try:
+            super().read()
+            times = io.gpxtimes(self.pending)
+            self.pending = []
+        except (et.ParseError, ValueError, TypeError) as e:
+            fx.printmsg('ERROR: could not parse GPX: %s' % e)
+            raise GPXError('could not parse %s: %s' % (self.path, e)) from e
+        io.checktimes(times=times, gpx=self.path)
+        self.times.extend(times.tolist())
+
+    def start(self, tag=''):
+        if tag in ('wpt', 'trkpt', 'rtept'):
+            self.ele = self.time = None # point times and elevations never carry over from elsewhere in the file
+
+    def end(self, tag='', elem=None):
+        if tag == 'ele':
+            self.ele = elem.text
+        elif tag == 'time':
+            self.time = elem.text
+        elif tag == 'wpt':
+            self.pending.append(self.time)
+            self.lats.append(float(elem.get('lat')))
+            self.lons.append(float(elem.get('lon')))
+            self.eles.append(float(self.ele) if self.ele else np.nan)
+
+
+class Follower(object):
+    """Keeps a DZG up to date while a DZX/DZT and its GPX are still being recorded.
+
+    Each `update()` parses only what was appended to each file since the last one, pairs new marks with new
+    waypoints in order, and appends a DZG block for each new pair. Speed over ground and course depend only on a
+    mark's waypoint and the one before it, so the last written waypoint is carried forward instead of recalculating
+    the track, and the work done by each update is proportional to the new data rather than the file size. The
+    first block is written once the second waypoint arrives (its speed is that of the first segment). Once both
+    files are complete, the DZG is the same as `gpx2dzg.io.write()` would produce from them.
+
+    Marks cannot be dropped while following, so a missed or extra mark shifts every later position. `finish()`
+    warns if the final mark counts do not match, in which case the finished files should be converted again.
+
+    If an input gets shorter (i.e. it was replaced), following starts again and the DZG is rewritten.
+
+    Parameters
+    ----------
+    dzx : str
+        The DZX or DZT being recorded.
+    gpx : str
+        The GPX being recorded. Defaults to the identically named GPX (see `gpx2dzg.functions.findgpx()`).
+    dzg : str
+        The DZG to write. Defaults to `gpx2dzg.functions.dzgpath()`.
+    threshold : int
+        The DZT mark threshold (see `gpx2dzg.io.readSIR3k()`).
+    mode : str
+        Distance calculation mode for speed over ground (see `gpx2dzg.functions.distances()`).
+    dec : gpx2dzg.declination.Declination
+        The declination service to use. Defaults to the process-wide service.
+    """
+    def __init__(self, dzx='', gpx=None, dzg=None, threshold=20000, mode='fast', dec=None):
+        self.dzx = dzx
+        self.gpx = gpx or fx.findgpx(dzx)
+        self.dzg = dzg or fx.dzgpath(dzx)
+        self.threshold = threshold
+        self.mode = mode
+        self.dec = dec or declination.service()
+        self.reset()
+
+    def reset(self):
+        """Forgets everything read and written, so that the next update starts the DZG again."""
+        if '.dzt' in self.dzx.lower():
+            self.radar = DZTTail(path=self.dzx, threshold=self.threshold)
+        else:
+            self.radar = DZXTail(path=self.dzx)
+        self.points = GPXTail(path=self.gpx)
+        self.written = 0
+        self.finished = False
+
+    def sizes(self):
+        """Returns the current size of each input (-1 if it does not exist yet)."""
+        return tuple(os.path.getsize(p) if os.path.exists(p) else -1 for p in (self.dzx, self.gpx))
+
+    def update(self, final=False):
+        """Reads new marks and waypoints and appends a DZG block for each new pair.
+
+        Parameters
+        ----------
+        final : bool
+            Whether the files are complete. A DZT's end is then added as its last mark, and a lone first
+            waypoint is written.
+
+        Returns
+        -------
+        int
+            The number of blocks appended.
+
+        Raises
+        ------
+        gpx2dzg.exceptions.GPX2DZGError
+            A subclass describing the problem if an input cannot be parsed or the DZG cannot be written.
+        """
+        if self.radar.shrunk() or self.points.shrunk():
+            fx.printmsg('WARNING: an input got shorter (it was replaced or rewritten). starting the DZG again')
+            self.reset()
+        self.radar.read()
+        self.points.read()
+        if final and not self.finished:
+            self.radar.finish()
+            self.finished = True
+        scans, p = self.radar.marks, self.points
+        n = min(len(scans), len(p.lats))
+        stop = n if (final or n > 1) else 0 # the first block needs the second waypoint
+        start = self.written
+        if stop <= start:
+            return 0
+        lo = max(start - 1, 0) # the last written waypoint, for the speed and course of the first new one
+        times = np.array(p.times[lo:stop], dtype=np.int64).view('datetime64[ns]')
+        lats, lons = np.array(p.lats[lo:stop]), np.array(p.lons[lo:stop])
+        k = fx.kinematics(lats=lats, lons=lons, times=times, mode=self.mode)
+        s = slice(start - lo, None) # the new rows
+        geoid.load()
+        ghs = geoid.height(lats=lats[s], lons=lons[s])
+        decs = self.dec.lookup(lats=lats[s], lons=lons[s], times=times[s])
+        blocks = nmea.blocks(scans=scans[start:stop].tolist(), times=times[s], lats=lats[s], lons=lons[s],
+                             elevs=np.array(p.eles[start:stop]), geoidh=ghs, sogs=k['sog'][s],
+                             courses=k['course'][s], decs=decs)
+        self._append(''.join(blocks))
+        self.written = stop
+        fx.printmsg('follow: wrote %s new positions to %s (%s in total)' % (len(blocks), self.dzg, self.written))
+        return len(blocks)
+
+    def _append(self, text=''):
+        """Appends text to the DZG (starting a new DZG if nothing has been written yet) and flushes it to disk."""
+        try:
+            with open(self.dzg, 'a' if self.written > 0 else 'w') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+        except PermissionError as e:
+            fx.writeerror(e=e)
+            raise DZGWriteError('could not write %s: %s' % (self.dzg, e)) from e
+
+    def finish(self):
+        """Writes the last blocks once both files are complete.
+
+        Returns
+        -------
+        bool
+            Whether the final mark counts match.
+        """
+        self.update(final=True)
+        dzxcount, gpxcount = len(self.radar.marks), len(self.points.lats)
+        if dzxcount != gpxcount:
+            fx.printmsg('WARNING: the finished files have %s dzx/dzt marks and %s gpx marks, so the DZG written while '
+                        'following may pair marks with the wrong waypoints. convert the finished files again with '
+                        '-r or -a' % (dzxcount, gpxcount))
+            return False
+        fx.printmsg('follow: finished %s with %s positions' % (self.dzg, self.written))
+        return True
+
+    def follow(self, interval=2., idle=60.):
+        """Updates the DZG every `interval` seconds until neither input has grown for `idle` seconds (or until
+        interrupted), then finishes it.
+
+        Parameters
+        ----------
+        interval : float
+            Seconds between updates.
+        idle : float
+            Seconds without growth after which the files are taken to be complete. 0 follows until interrupted.
+
+        Returns
+        -------
+        bool
+            Whether the final mark counts match (see `finish()`).
+        """
+        fx.printmsg('follow: following %s and %s, writing %s' % (self.dzx, self.gpx, self.dzg))
+        sizes, changed = None, time.monotonic()
+        try:
+            while True:
+                self.update()
+                if self.sizes() != sizes:
+                    sizes, changed = self.sizes(), time.monotonic()
+                elif (idle > 0) and (time.monotonic() - changed >= idle):
+                    fx.printmsg('follow: no new data for %s s. finishing' % idle)
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            fx.printmsg('follow: stopped. finishing')
+        return self.finish()
+
+
+def main(argv=[]):
+    """The argument parsing function for `gpx2dzg follow`.
+
+    Parameters
+    ----------
+    argv : list
+        The arguments following `follow` on the command line.
+    """
+    gpx, dzg, threshold, interval, idle = None, None, 20000, 2., 60.
+    try:
+        optlist, args = getopt.gnu_getopt(argv, 'hqg:t:i:e:', ['help', 'quiet', 'gpx=', 'dzg=', 'threshold=',
+                                                              'interval=', 'idle='])
+    except getopt.GetoptError as e:
+        fx.printmsg('ERROR: invalid argument(s) supplied')
+        fx.printmsg('error text: %s' % e)
+        fx.printmsg(follow_help)
+        sys.exit(2)
+    for opt, arg in optlist:
+        if opt in ('-h', '--help'):
+            fx.printmsg(follow_help)
+            sys.exit()
+        try:
+            if opt in ('-t', '--threshold'):
+                threshold = int(arg)
+            if opt in ('-i', '--interval'):
+                interval = float(arg)
+            if opt in ('-e', '--idle'):
+                idle = float(arg)
+        except ValueError as e:
+            fx.printmsg('ERROR: %s must be a number' % opt)
+            fx.printmsg('full error text: %s' % e)
+            sys.exit(2)
+        if opt in ('-g', '--gpx'):
+            gpx = os.path.expanduser(arg)
+        if opt == '--dzg':
+            dzg = os.path.expanduser(arg)
+        if opt in ('-q', '--quiet'):
+            fx.logger.setLevel(fx.SUMMARY)
+    if len(args) != 1:
+        fx.printmsg('ERROR: specify one DZX or DZT to follow')
+        fx.printmsg(follow_help)
+        sys.exit(2)
+    f = Follower(dzx=os.path.expanduser(args[0]), gpx=gpx, dzg=dzg, threshold=threshold)
+    try:
+        matched = f.follow(interval=interval, idle=idle)
+    except GPX2DZGError: # the error has already been printed
+        sys.exit(2)
+    if not matched:
+        sys.exit(1)
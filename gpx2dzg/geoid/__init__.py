@@ -0,0 +1,62 @@
+import os
+import threading
+import time
+import gpx2dzg.functions as fx
+
+PGM = os.path.join(os.path.dirname(__file__), 'egm96-15.pgm')
+
+_geoid = None
+_lock = threading.Lock()
+
+
+def load(pgm=PGM):
+    """Returns the geoid model for this process, loading it on first use.
+    The model (a bivariate spline interpolation of the 15-arcminute EGM96 grid) is expensive to build,
+    so it is kept for the life of the process and shared by every subsequent call.
+    Worker processes forked after the model is loaded inherit it; others load their own copy on first use.
+
+    Parameters
+    ----------
+    pgm : str
+        The path of the geoid grid to load. Only used the first time this is called in a process.
+
+    Returns
+    -------
+    pygeodesy.geoids.GeoidPGM
+        The geoid model.
+    """
+    global _geoid
+    if _geoid is None:
+        with _lock:
+            if _geoid is None:
+                import pygeodesy.geoids
+                start = time.perf_counter()
+                _geoid = pygeodesy.geoids.GeoidPGM(pgm)
+                fx.printmsg('loaded geoid model in %.3f s' % (time.perf_counter() - start))
+    return _geoid
+
+
+def height(lats=[], lons=[]):
+    """Looks up geoid heights for many points in one call to the geoid model.
+
+    Parameters
+    ----------
+    lats : list or numpy.ndarray
+        Latitudes in decimal degrees.
+    lons : list or numpy.ndarray
+        Longitudes in decimal degrees, the same length as `lats`.
+
+    Returns
+    -------
+    list
+        Geoid height (in meters above the WGS84 ellipsoid) for each point.
+    """
+    geoid = load()
+    if len(lats) == 0:
+        return []
+    start = time.perf_counter()
+    heights = geoid.height(lats=list(lats), lons=list(lons))
+    if not isinstance(heights, list): # some pygeodesy versions return a bare float for a single point
+        heights = [heights]
+    fx.printmsg('looked up %s geoid heights in %.3f s' % (len(lats), time.perf_counter() - start))
+    return heights
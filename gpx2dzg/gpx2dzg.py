@@ -2,11 +2,33 @@ import os, sys
 import getopt
 import gpx2dzg.functions as fx
 import gpx2dzg.help as help
-import gpx2dzg.io as io
-import gpx2dzg.plot as px
+import gpx2dzg.batch as batch
+import gpx2dzg.metrics as mc
+from gpx2dzg.session import Converter
+from gpx2dzg.exceptions import GPX2DZGError
 
-def convert(dzx='', gpx='', write=False, plot=False, drops=[]):
-    """The main conversion function in `gpx2dzg`.
+_converters = {}
+
+def converter(cache=False, pipeline=False):
+    """Returns the session used by `convert()`, creating it on first use (see `gpx2dzg.session.Converter`).
+
+    Parameters
+    ----------
+    cache : bool
+        Whether the session uses the on-disk input cache (see `gpx2dzg.cache.Cache`).
+    pipeline : bool
+        Whether the session reads its inputs at the same time on reader threads.
+    """
+    if (cache, pipeline) not in _converters:
+        from gpx2dzg.cache import Cache
+        # command line and batch runs read each file once, so only the disk cache is useful
+        _converters[cache, pipeline] = Converter(cachesize=0, diskcache=Cache() if cache else None, pipeline=pipeline)
+    return _converters[cache, pipeline]
+
+def convert(dzx='', gpx='', write=False, plot=False, drops=[], autoplot=True, threshold=20000, every=0,
+            autodrop=False, metrics=None, cache=False, plotout=None, pipeline=False):
+    """The main conversion function in `gpx2dzg`. Prints errors and exits with status 2 if an input cannot be
+    read or the DZG cannot be written. To handle errors instead, use `gpx2dzg.session.Converter`.
 
     Parameters
     ----------
@@ -20,73 +42,103 @@ def convert(dzx='', gpx='', write=False, plot=False, drops=[]):
         Tells `gpx2dzg` whether to force the creation of a sanity check plot.
     drops : list
         List of integers. Tells `gpx2dzg` to drop mark values at this list of DZX/DZT integer index locations.
+    autoplot : bool
+        Tells `gpx2dzg` whether to create a sanity check plot when mark counts do not match. Set to False for unattended runs.
+    threshold : int
+        DZT only. Scans whose mark sample value is greater than this are read as marks.
+    every : int
+        If greater than zero, write a position every this many scans (interpolated from the GPX track if it has one)
+        instead of only at marks.
+    autodrop : bool
+        If mark counts do not match, apply the drops proposed by `gpx2dzg.align.propose()` (on either side) as long as
+        its confidence is at least `gpx2dzg.session.MINCONFIDENCE`. Otherwise the proposal is only printed.
+    metrics : function
+        If given, called with a `gpx2dzg.metrics.Metrics` instance containing stage timers and counters
+        (marks, drops, skipped marks, positions written) once the conversion is finished.
+    cache : bool
+        Whether to use the on-disk cache of parsed inputs, so that rerunning with different drops does not parse
+        the same files again (see `gpx2dzg.cache.Cache`). The command line turns this on unless `--no-cache` is given.
+    plotout : str
+        If given, sanity check plots are saved to this image file (i.e. a `.png`) instead of being shown,
+        so plotting works without a display.
+    pipeline : bool
+        Read the DZX/DZT and GPX and load the geoid model at the same time instead of one after the other,
+        which helps when inputs are on a slow (i.e. network) file system.
 
     Returns
     -------
     bool
         True if mark counts match, False otherwise.
     """
-    if os.path.exists(dzx) == False:
-        fx.printmsg('ERROR: specified dzx/dzt file does not exist. exiting.')
-        sys.exit(2)
-    if os.path.exists(gpx) == False:
-        fx.printmsg('ERROR: specified gpx file does not exist. exiting.')
+    try:
+        result = converter(cache=cache, pipeline=pipeline).convert(dzx=dzx, gpx=gpx, write=write, drops=drops, every=every, autodrop=autodrop,
+                                     threshold=threshold)
+    except GPX2DZGError: # the error has already been printed
         sys.exit(2)
-    fx.printmsg('dzx file: %s' % dzx)
-    fx.printmsg('gpx file: %s' % gpx)
-
-    dzxmarks, gpxmarks = [], []
-
-    if '.dzx' in dzx.lower():
-        dzxmarks = io.readdzx(dzx=dzx)
-        fx.printmsg('found %s dzx marks' % len(dzxmarks))
-    elif '.dzt' in dzx.lower():
-        dzxmarks = io.readSIR3k(dzt=dzx)
-        fx.printmsg('found %s dzt marks' % len(dzxmarks))
-
-    gpxmarks = io.readgpx(gpx=gpx)
-    fx.printmsg('found %s gpx marks' % len(gpxmarks.waypoints))
-
-    origdzxnum = list(range(0,len(dzxmarks)))
-    if len(drops) > 0:
-        fx.drop(marks=dzxmarks, drops=drops)
-        fx.drop(marks=origdzxnum, drops=drops)
-
-    if len(gpxmarks.waypoints) == len(dzxmarks):
-        fx.printmsg('mark counts match!')
-        if write:
-            fx.printmsg('outputting to DZG now (same directory and name as the DZX/DZT)')
-            fx.printmsg('if a DZG already exists, another will be written with "-gpx2dzg" in the name.')
-            dzg = os.path.splitext(dzx)[0] + '.DZG'
-            if os.path.exists(dzg):
-                dzg = os.path.splitext(dzx)[0] + '-gpx2dzg.DZG'
-            fx.printmsg('output file: %s' % dzg)
-            io.write(dzg=dzg, dzxmarks=dzxmarks, gpxmarks=gpxmarks)
-        else:
-            fx.printmsg('no DZG write specified. skipping...')
-        success = True
-    else:
-        fx.printmsg('mark counts do not match. foregoing write and generating sanity check plot.')
-        plot = True
-        success = False
 
+    if (not result.matched) and autoplot:
+        fx.printmsg('generating sanity check plot.')
+        plot = True
     if plot:
-        px.sanityplot(dzx=dzxmarks, dzxnum=origdzxnum, dzxname=dzx, gpx=gpxmarks, gpxname=gpx)
+        import gpx2dzg.plot as px # matplotlib is only loaded when plotting
+        with mc.collect(result.metrics), mc.stage('plot'):
+            px.sanityplot(dzx=result.dzxmarks, dzxnum=result.dzxnum, dzxname=dzx, gpx=result.gpxmarks, gpxname=gpx,
+                          out=plotout)
+
+    if metrics is not None:
+        metrics(result.metrics)
+    return result.matched
 
-    return success
+def printmetrics(report=None):
+    """Returns a `convert()` metrics callback which prints metrics as a line of JSON (`report='json'`)
+    or as a table (`report='text'`), or None if `report` is None."""
+    if report == 'json':
+        return lambda m: print(m.json()) # printed directly so that it can be parsed from standard output
+    if report == 'text':
+        return lambda m: m.report()
+    return None
 
 def main():
     """The argument parsing function for command line calls. Takes no parameters, but reads command line flags and arguments.
 
-    Passes arguments to the `convert()` function.
+    Passes arguments to the `convert()` function, or to `gpx2dzg.batch.run()` in batch mode
+    (or `gpx2dzg.check.run()` with `--check`).
+    `gpx2dzg watch DIR [OPTIONS]` runs `gpx2dzg.watch.main()`, `gpx2dzg catalog DIR [OPTIONS]` runs
+    `gpx2dzg.catalog.main()`, and `gpx2dzg follow FILE [OPTIONS]` runs `gpx2dzg.follow.main()` instead.
     """
-    dzx, gpx = None, None
+    if sys.argv[1:2] == ['watch']:
+        import gpx2dzg.watch as watch
+        watch.main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['catalog']:
+        import gpx2dzg.catalog as catalog
+        catalog.main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['follow']:
+        import gpx2dzg.follow as follow
+        follow.main(sys.argv[2:])
+        return
+    dzx, gpx, batchin = None, None, None
     plot, write = False, False
     drops = []
+    processes = None
+    threshold = 20000
+    every = 0
+    autodrop = False
+    report = None
+    cache = True
+    plotout = None
+    archive = None
+    utcoffset = 0.
+    pipeline = False
+    check = False
 
     try:
         opts, args = getopt.getopt(sys.argv[1:],
-                                   'hwpr:d:g:', ['help', 'write', 'plot', 'drop=' 'dzx=', 'gpx='])
+                                   'hwpaqr:d:g:b:n:t:s:m:', ['help', 'write', 'plot', 'auto-drop', 'quiet', 'drop=', 'dzx=',
+                                                              'gpx=', 'batch=', 'processes=', 'threshold=', 'scans=',
+                                                              'metrics=', 'no-cache', 'plot-out=', 'catalog=',
+                                                              'utc-offset=', 'pipeline', 'check'])
     except getopt.GetoptError as e:
         fx.printmsg('ERROR: invalid argument(s) supplied')
         fx.printmsg('error text: %s' % e)
@@ -110,22 +162,122 @@ def main():
         if opt in ('-r', '--drop'):
             if arg:
                 try:
-                    drops = list(int(i) for i in list(arg.strip('(){}[]').split(',')))
+                    drops = fx.parsedrops(arg)
                 except Exception as e:
                     fx.printmsg('ERROR: list of drops is likely formatted incorrectly. try "-r [1,2,4,-2]"')
                     fx.printmsg('full error text: %s' % e)
                     sys.exit(2)
 
+        if opt in ('-b', '--batch'): # directory or manifest of pairs
+            if arg:
+                batchin = os.path.expanduser(arg)
+        if opt in ('-n', '--processes'):
+            try:
+                processes = int(arg)
+            except ValueError as e:
+                fx.printmsg('ERROR: number of processes must be an integer. try "-n 4"')
+                fx.printmsg('full error text: %s' % e)
+                sys.exit(2)
+
+        if opt in ('-t', '--threshold'): # dzt mark threshold
+            try:
+                threshold = int(arg)
+            except ValueError as e:
+                fx.printmsg('ERROR: mark threshold must be an integer. try "-t 20000"')
+                fx.printmsg('full error text: %s' % e)
+                sys.exit(2)
+        if opt in ('-s', '--scans'): # dense output
+            try:
+                every = int(arg)
+            except ValueError as e:
+                fx.printmsg('ERROR: scan interval must be an integer. try "-s 10"')
+                fx.printmsg('full error text: %s' % e)
+                sys.exit(2)
         if opt in ('-p', '--plot'): # plot
             plot = True
+        if opt == '--catalog': # gpx archive to search by time when there is no identically named gpx
+            if arg:
+                archive = os.path.expanduser(arg)
+        if opt == '--utc-offset': # radar unit clock offset, for catalog lookups
+            try:
+                utcoffset = float(arg)
+            except ValueError as e:
+                fx.printmsg('ERROR: UTC offset must be a number of hours. try "--utc-offset -4"')
+                fx.printmsg('full error text: %s' % e)
+                sys.exit(2)
+        if opt == '--plot-out': # save plots to a file (or a directory in batch mode) instead of showing them
+            if arg:
+                plotout = os.path.expanduser(arg)
         if opt in ('-w', '--write'): # write a dzg
             write = True
-    if dzx and gpx:
-        convert(dzx=dzx, gpx=gpx, plot=plot, write=write, drops=drops)
+        if opt in ('-a', '--auto-drop'): # apply proposed drops when mark counts do not match
+            autodrop = True
+        if opt == '--no-cache': # always parse inputs
+            cache = False
+        if opt == '--pipeline': # read inputs concurrently
+            pipeline = True
+        if opt == '--check': # count marks only
+            check = True
+        if opt in ('-q', '--quiet'): # warnings, errors, summaries, and metrics only
+            fx.logger.setLevel(fx.SUMMARY)
+        if opt in ('-m', '--metrics'): # stage timers and counters
+            if arg not in ('json', 'text'):
+                fx.printmsg('ERROR: metrics format must be "json" or "text". try "-m json"')
+                sys.exit(2)
+            report = arg
+    if check:
+        import gpx2dzg.check as ck
+        if batchin:
+            if gpx:
+                fx.printmsg('WARNING: -g is ignored with --check. each DZX/DZT is checked against its own gpx')
+            summary = ck.run(batch=batchin, processes=processes, threshold=threshold)
+        elif dzx:
+            summary = ck.run(pairs=[(dzx, gpx or fx.findgpx(dzx), drops)], processes=1, threshold=threshold)
+        else:
+            fx.printmsg('ERROR: no input files specified')
+            sys.exit(2)
+        if len(summary['mismatched']) + len(summary['failed']) > 0:
+            sys.exit(1)
+        return
+    cat = None
+    if archive:
+        import gpx2dzg.catalog as catalog
+        cat = catalog.Catalog(archive=archive)
+        cat.update(processes=processes)
+    if batchin:
+        if plot:
+            fx.printmsg('WARNING: plots are not shown in batch mode. ignoring -p (use --plot-out DIR to save plots of mismatched pairs)')
+        if dzx or drops:
+            fx.printmsg('WARNING: -d and -r are ignored in batch mode. use a manifest to specify per-line drops')
+        if gpx: # project mode: one gpx log for every line
+            import gpx2dzg.project as project
+            if autodrop:
+                fx.printmsg('WARNING: -a is ignored in project mode. waypoints are split by mark count, so use a manifest to specify per-line drops')
+            if archive:
+                fx.printmsg('WARNING: --catalog is ignored in project mode. every line uses the gpx given with -g')
+            try:
+                summary = project.run(batch=batchin, gpx=gpx, write=write, processes=processes, threshold=threshold,
+                                      every=every, metrics=report, cache=cache, plotdir=plotout,
+                                      pipeline=pipeline)
+            except GPX2DZGError: # the error has already been printed
+                sys.exit(2)
+        else:
+            summary = batch.run(batch=batchin, write=write, processes=processes, threshold=threshold, every=every,
+                                autodrop=autodrop, metrics=report, cache=cache, plotdir=plotout, catalog=cat,
+                                utcoffset=utcoffset, pipeline=pipeline)
+        if len(summary['failed']) > 0:
+            sys.exit(1)
+    elif dzx and gpx:
+        convert(dzx=dzx, gpx=gpx, plot=plot, write=write, drops=drops, threshold=threshold, every=every,
+                autodrop=autodrop, metrics=printmetrics(report), cache=cache, plotout=plotout, pipeline=pipeline)
     elif dzx:
         fx.printmsg('only DZX input specified. gpx2dzg will search for an identically named GPX...')
-        gpx = os.path.splitext(dzx)[0] + '.gpx'
-        convert(dzx=dzx, gpx=gpx, plot=plot, write=write, drops=drops)
+        gpx = fx.findgpx(dzx)
+        if (not os.path.exists(gpx)) and (cat is not None):
+            fx.printmsg('no identically named gpx. searching the catalog by acquisition time...')
+            gpx = cat.findfor(dzx=dzx, utcoffset=utcoffset) or gpx
+        convert(dzx=dzx, gpx=gpx, plot=plot, write=write, drops=drops, threshold=threshold, every=every,
+                autodrop=autodrop, metrics=printmetrics(report), cache=cache, plotout=plotout, pipeline=pipeline)
     else:
         fx.printmsg('ERROR: no input files specified')
         sys.exit(2)
@@ -15,15 +15,33 @@ help_text = u'''Help text:
 
 usage:
 gpx2dzg -d input.DZX -g input.gpx [OPTIONS]
+gpx2dzg -b /dir/or/manifest.txt [-n 4] [-w]
+gpx2dzg -b /dir/or/manifest.txt -g day.gpx [-n 4] [-w]   (project mode: one gpx log for every line)
+gpx2dzg watch /dir [-w] [-n 4] (see gpx2dzg watch -h)
+gpx2dzg catalog /gpx/archive [--find f.DZT] (see gpx2dzg catalog -h)
+gpx2dzg follow f.DZT [-g f.gpx] (see gpx2dzg follow -h)
 
 required flags:
     FLAG     |       ARGUMENT       |       FUNCTIONALITY
 -d, --dzx    | file: /dir/f.DZX|DZT | specify an input DZX or DZT file
 -g, --gpx    | file: /dir/f.gpx     | specify an input gpx file
+-b, --batch  | dir or manifest file | convert every DZX/DZT and identically named gpx in a directory, or each line of a manifest
 
 options:
    OPTION    |       ARGUMENT       |       FUNCTIONALITY
 -r, --drop   | int or list of ints  | drop the indices specified from the list of DZX/DZT marks (can be negative, ex: 2,3,-2)
+-a, --auto-drop | n/a                | if mark counts do not match, apply the drops (DZX/DZT or gpx) proposed by automatic mark alignment
 -p, --plot   |  n/a                 | if set, show a troubleshooting plot comparing distance per GPX mark versus scan number per DZX mark
+--catalog    | dir: /gpx/archive    | if there is no identically named gpx, use the cataloged gpx recorded during the DZT (see gpx2dzg catalog -h)
+--utc-offset | hours                | with --catalog, the radar unit's clock offset from UTC (i.e. -4 for EDT)
+--plot-out   | file or dir          | save plots to an image file instead of showing them (batch mode: a PNG per mismatched pair in this dir)
 -w, --write  |  n/a                 | if set, write a DZG file in the same directory as the DZX/DZT
+-n, --processes | int                | number of worker processes to use in batch mode (default: number of CPUs)
+-t, --threshold | int                | DZT only: mark sample values above this are read as marks (default: 20000)
+-s, --scans  | int                  | with -w, write a position every N scans (interpolated from the gpx track) instead of only at marks
+-m, --metrics | json or text        | print stage timings and counts (marks, drops, skipped marks, positions written) when done
+-q, --quiet  |  n/a                 | only print warnings, errors, summaries, and metrics
+--no-cache   |  n/a                 | always parse inputs instead of reusing marks cached by an earlier run
+--pipeline   |  n/a                 | read the DZX/DZT and gpx (and load the geoid model) at the same time, for inputs on slow network shares
+--check      |  n/a                 | only count marks (with -b, for every pair, in parallel) and print a table of counts and mismatches
 ''' % (__version__, u'\U0001F12F', author, year, affil)
\ No newline at end of file
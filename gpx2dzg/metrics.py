@@ -0,0 +1,108 @@
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import gpx2dzg.functions as fx
+
+_active = ContextVar('gpx2dzg_metrics', default=None)
+
+
+class Metrics(object):
+    """Stage timers and counters for one conversion.
+
+    Attributes
+    ----------
+    timers : collections.OrderedDict
+        Seconds spent in each stage, in the order stages were first entered. Stages entered more than once
+        (i.e. once per chunk) are summed. Time in a stage nested inside another (i.e. `'geoid'` inside `'write'`)
+        counts toward both.
+    counters : collections.OrderedDict
+        Counts of things like marks read, drops, and skipped marks.
+    """
+    def __init__(self):
+        self.timers = OrderedDict()
+        self.counters = OrderedDict()
+
+    @contextmanager
+    def stage(self, name=''):
+        """Times the code inside a `with` block as stage `name`."""
+        t = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.timers[name] = self.timers.get(name, 0.) + time.perf_counter() - t
+
+    def count(self, name='', n=1):
+        """Adds `n` to counter `name`."""
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def asdict(self):
+        """Returns timers (in seconds) and counters as a dict of plain dicts."""
+        return {'timers': dict(self.timers), 'counters': dict(self.counters)}
+
+    def json(self):
+        """Returns timers and counters as a JSON string."""
+        return json.dumps(self.asdict())
+
+    def report(self):
+        """Prints timers and counters."""
+        report(metrics=self.asdict())
+
+
+@contextmanager
+def collect(metrics=None):
+    """Makes `metrics` (or a new `Metrics` instance) the collector for `stage()` and `count()` calls made
+    inside a `with` block in the same thread or task.
+
+    Parameters
+    ----------
+    metrics : Metrics
+        The collector to use. A new one is created if None.
+
+    Returns
+    -------
+    Metrics
+        The active collector (as the target of `with ... as m`).
+    """
+    metrics = metrics or Metrics()
+    token = _active.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def stage(name=''):
+    """Times the code inside a `with` block as stage `name` of the active collector, if there is one."""
+    m = _active.get()
+    if m is None:
+        yield None
+    else:
+        with m.stage(name):
+            yield m
+
+
+def count(name='', n=1):
+    """Adds `n` to counter `name` of the active collector, if there is one."""
+    m = _active.get()
+    if m is not None:
+        m.count(name, n)
+
+
+def report(metrics={}, title='metrics:'):
+    """Prints timers and counters from `Metrics.asdict()` as a table.
+
+    Parameters
+    ----------
+    metrics : dict
+        A dict with `'timers'` and `'counters'` keys.
+    title : str
+        The line to print above the table.
+    """
+    fx.printmsg(title, level=fx.SUMMARY)
+    for name, seconds in metrics['timers'].items():
+        fx.printmsg('    %-22s %10.4f s' % (name, seconds), level=fx.SUMMARY)
+    for name, n in metrics['counters'].items():
+        fx.printmsg('    %-22s %10s' % (name, n), level=fx.SUMMARY)
@@ -0,0 +1,111 @@
+import numpy as np
+
+GGA = 'GPGGA,%s,%s,%s,%s,%s,7,00,1.0,%s,%s,,'
+RMC = 'GPRMC,%s,A,%s,%s,%s,%s,%s,%s,%s,%s,%s'
+BLOCK = '$GSSIS,%s,-1\n$%s*%02X\n$%s*%02X\n\n\n'
+
+
+def ddm(dd):
+    """Array version of `gpx2dzg.functions.dd2ddm()`. Converts decimal degrees to degrees and decimal minutes,
+    using the same arithmetic so that formatted values are identical.
+
+    Parameters
+    ----------
+    dd : numpy.ndarray
+        Decimal degree values to convert.
+
+    Returns
+    -------
+    tuple
+        Arrays of degrees and decimal minutes.
+    """
+    is_positive = dd >= 0
+    dd = np.abs(dd)
+    minutes, seconds = np.divmod(dd*3600, 60)
+    degrees, minutes = np.divmod(minutes, 60)
+    degrees = np.where(is_positive, degrees, -degrees)
+    minutes = minutes + seconds/60.
+    return degrees, minutes
+
+
+def checksums(sentences=[]):
+    """Calculates NMEA checksums (the XOR of every character between `$` and `*`) for many sentences at once.
+
+    Parameters
+    ----------
+    sentences : list
+        Sentence bodies, without the leading `$` or trailing `*`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Checksum of each sentence.
+    """
+    if len(sentences) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    buf = np.frombuffer(''.join(sentences).encode('ascii'), dtype=np.uint8)
+    lengths = np.fromiter(map(len, sentences), dtype=np.int64, count=len(sentences))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.bitwise_xor.reduceat(buf, starts)
+
+
+def blocks(scans=[], times=[], lats=[], lons=[], elevs=[], geoidh=[], sogs=[], courses=[], decs=[]):
+    """Formats one DZG block (a `$GSSIS` line followed by `$GPGGA` and `$GPRMC` sentences) for each mark.
+    All arguments are columns of equal length, one row per mark.
+
+    Parameters
+    ----------
+    scans : list
+        Scan number of each mark.
+    times : numpy.ndarray
+        UTC time of each mark, as `datetime64`.
+    lats : numpy.ndarray
+        Latitudes in decimal degrees.
+    lons : numpy.ndarray
+        Longitudes in decimal degrees.
+    elevs : numpy.ndarray
+        Elevations in meters.
+    geoidh : numpy.ndarray
+        Geoid heights in meters.
+    sogs : numpy.ndarray
+        Speed over ground in knots.
+    courses : numpy.ndarray
+        Course over ground in degrees.
+    decs : numpy.ndarray
+        Magnetic declination in degrees (negative is west).
+
+    Returns
+    -------
+    list
+        One string per mark, ready to be written to a DZG.
+    """
+    n = len(scans)
+    if n == 0:
+        return []
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    decs = np.asarray(decs, dtype=np.float64)
+
+    t = np.asarray(times).astype('datetime64[s]')
+    day = t.astype('datetime64[D]')
+    month = day.astype('datetime64[M]')
+    year = month.astype('datetime64[Y]').astype(np.int64) + 1970
+    sod = (t - day).astype(np.int64)
+    hms = ['%02d%02d%02d' % r for r in zip((sod // 3600).tolist(), (sod // 60 % 60).tolist(), (sod % 60).tolist())]
+    dmy = ['%02d%02d%02d' % r for r in zip((year % 100).tolist(), (month.astype(np.int64) % 12 + 1).tolist(),
+                                           ((day - month).astype(np.int64) + 1).tolist())]
+
+    lat = ['%02d%09.6f' % r for r in zip(*(a.tolist() for a in ddm(np.abs(lats))))]
+    lon = ['%03d%09.6f' % r for r in zip(*(a.tolist() for a in ddm(np.abs(lons))))]
+    latd = np.where(lats >= 0, 'N', 'S').tolist()
+    lond = np.where(lons >= 0, 'E', 'W').tolist()
+    elev = ['%.2f' % e for e in np.asarray(elevs, dtype=np.float64).tolist()]
+    gh = ['%.1f' % h for h in np.asarray(geoidh, dtype=np.float64).tolist()]
+    kt = ['%05.1f' % k for k in np.asarray(sogs, dtype=np.float64).tolist()]
+    crs = ['%05.1f' % c for c in np.asarray(courses, dtype=np.float64).tolist()]
+    var = ['%05.1f' % v for v in np.abs(decs).tolist()]
+    vard = np.where(decs >= 0, 'E', 'W').tolist()
+
+    gga = [GGA % r for r in zip(hms, lat, latd, lon, lond, elev, gh)]
+    rmc = [RMC % r for r in zip(hms, lat, latd, lon, lond, kt, crs, dmy, var, vard)]
+    cs = checksums(gga + rmc).tolist()
+    return [BLOCK % r for r in zip(list(scans), gga, cs[:n], rmc, cs[n:])]
@@ -1,9 +1,11 @@
-import matplotlib.pyplot as plt
+import numpy as np
+import matplotlib
 import matplotlib.ticker as ticker
-from geopy.distance import geodesic
-import math
 import gpx2dzg.functions as fx
 
+LABELSIZE = 6 # label font size in points
+CHARWIDTH = 0.6 # approximate width of a label character, as a fraction of the font size
+
 
 def setup(ax, xmax=5):
     """Gets the axis ready for number line style plotting.
@@ -30,74 +32,260 @@ def setup(ax, xmax=5):
     ax.patch.set_alpha(0.0)
 
 
-def sanityplot(gpx=None, gpxname='GPX', dzx=None, dzxnum=None, dzxname='DZX'):
+def visible(x=[], xmax=1, pixels=1000):
+    """Returns the index of the first point in each pixel column of a number line, so that points which would be
+    drawn on top of each other are only drawn once.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        Point positions.
+    xmax : float
+        The position at the right end of the number line.
+    pixels : int
+        The width of the number line in pixels.
+
+    Returns
+    -------
+    numpy.ndarray
+        Indices of the points to draw, in increasing order.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if len(x) == 0:
+        return np.zeros(0, dtype=np.int64)
+    col = np.floor(x / (xmax or 1) * pixels)
+    return np.sort(np.unique(col, return_index=True)[1])
+
+
+def labelled(x=[], labels=[], xmax=1, width=720.):
+    """Chooses which points to label so that labels do not overlap. Labels are placed from left to right,
+    skipping any that would overlap the previous one.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        Positions of the candidate points, in increasing order.
+    labels : list
+        The label text of each point.
+    xmax : float
+        The position at the right end of the number line.
+    width : float
+        The width of the number line in points.
+
+    Returns
+    -------
+    list
+        Indices (into `x`) of the points to label.
+    """
+    pos = (np.asarray(x, dtype=np.float64) / (xmax or 1) * width).tolist()
+    keep, edge = [], -np.inf
+    for i, (p, label) in enumerate(zip(pos, labels)):
+        half = len(label) * LABELSIZE * CHARWIDTH / 2
+        if p - half >= edge:
+            keep.append(i)
+            edge = p + half + LABELSIZE * CHARWIDTH # one character of space between labels
+    return keep
+
+
+def numberline(ax, data=[], labels=None, xmax=1, width=720., dpi=100, marks=None):
+    """Draws marks on a number line as a single collection, labelling as many as fit.
+
+    Parameters
+    ----------
+    ax : matplotlib axis instance
+        The plot axis to draw on (see `setup()`).
+    data : numpy.ndarray
+        Mark positions, in increasing order.
+    labels : list
+        Label of each mark. Defaults to the mark's index.
+    xmax : float
+        The position at the right end of the number line.
+    width : float
+        The width of the number line in points.
+    dpi : float
+        The resolution the figure will be drawn at.
+    marks : matplotlib.collections.PathCollection
+        A collection from an earlier call to move to the new positions, instead of drawing a new one.
+
+    Returns
+    -------
+    matplotlib.collections.PathCollection
+        The marks.
+    list
+        The label annotations.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    idx = visible(x=data, xmax=xmax, pixels=max(int(width / 72. * dpi), 1))
+    colors = matplotlib.rcParams['axes.prop_cycle'].by_key()['color']
+    c = [colors[i % len(colors)] for i in idx.tolist()]
+    if marks is None:
+        marks = ax.scatter(data[idx], np.full(len(idx), 0.1), c=c)
+    else:
+        marks.set_offsets(np.column_stack((data[idx], np.full(len(idx), 0.1))))
+        marks.set_facecolor(c)
+    text = [str(labels[i] if labels is not None else i) for i in idx.tolist()]
+    notes = []
+    for j in labelled(x=data[idx], labels=text, xmax=xmax, width=width):
+        notes.append(ax.annotate(text[j], xy=(data[idx[j]], 0.1), xytext=(-2*len(text[j]), 4),
+                                 textcoords='offset points', fontsize=LABELSIZE,
+                                 annotation_clip=False)) # marks are always inside the axis
+    return marks, notes
+
+
+def isopen(fig=None):
+    """Returns whether a pyplot figure's window is still open."""
+    import matplotlib.pyplot as plt
+    return plt.fignum_exists(fig.number)
+
+
+class SanityPlot(object):
+    """The figure behind `sanityplot()`, kept so that it can be redrawn for new marks without being built again.
+    `draw()` moves each number line's marks, replaces its labels and text, and rescales its axis, and the layout
+    is only worked out the first time.
+
+    Parameters
+    ----------
+    headless : bool
+        If True, the figure is drawn with the Agg renderer and can only be saved, not shown.
+    dpi : float
+        The resolution of saved images (if headless).
+
+    Attributes
+    ----------
+    fig : matplotlib.figure.Figure
+        The figure.
+    """
+    def __init__(self, headless=False, dpi=150):
+        if headless:
+            from matplotlib.figure import Figure # no display needed
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            self.fig = Figure(figsize=(10, 5))
+            FigureCanvasAgg(self.fig)
+        else:
+            import matplotlib.pyplot as plt
+            self.fig = plt.figure(figsize=(10, 5))
+            dpi = self.fig.dpi
+        self.headless, self.dpi = headless, dpi
+        self.fig.set_facecolor('white')
+        label = ['distance (m)', 'time (s)',  'scan number', 'time (s)']
+        title = ['Sanity check plot: GPX and DZT marks', '', '']
+        self.lines = [] # [axis, text, marks, labels] for each number line
+        for n in range(3):
+            ax = self.fig.add_subplot(4, 1, n + 1)
+            setup(ax)
+            ax.xaxis.set_major_locator(ticker.LinearLocator(3))
+            ax.xaxis.set_minor_locator(ticker.LinearLocator(31))
+            ax.set_xlabel(label[n])
+            ax.set_title(title[n])
+            self.lines.append([ax, ax.text(0.0, 0.6, '', fontsize=10, transform=ax.transAxes), None, []])
+
+        # this is messy but effective
+        ax = self.fig.add_subplot(4, 1, 4)
+        ax.xaxis.set_ticks_position('bottom')
+        ax.tick_params(which='major', width=1.00)
+        ax.tick_params(which='major', length=5)
+        ax.tick_params(which='minor', width=0.75)
+        ax.tick_params(which='minor', length=2.5)
+        ax.set_xlabel(label[3])
+        ax.xaxis.set_major_locator(ticker.LinearLocator(3))
+        ax.xaxis.set_minor_locator(ticker.LinearLocator(31))
+        ax.text(0.0, 1.1, "Speed between gpx marks (m/s)",
+                fontsize=10, transform=ax.transAxes)
+        self.speedax = ax
+        self.speed = None
+        self.laid = False
+
+    def draw(self, dist=[], spd=[], tm=[], dzx=[], dzxnum=None, gpxname='GPX', dzxname='DZX'):
+        """Draws (or redraws) the plot for new marks.
+
+        Parameters
+        ----------
+        dist : numpy.ndarray
+            Distance of each GPX waypoint from the first (see `gpx2dzg.functions.distance_speed_time()`).
+        spd : numpy.ndarray
+            Speed between each pair of GPX waypoints.
+        tm : numpy.ndarray
+            Seconds elapsed since the first GPX waypoint.
+        dzx : list
+            Scan number of each DZX mark.
+        dzxnum : list
+            Labels for the DZX marks (see `sanityplot()`).
+        gpxname : str
+            The name of the GPX file, for the text above its number lines.
+        dzxname : str
+            The name of the DZX file, for the text above its number line.
+        """
+        name = [gpxname, gpxname, dzxname]
+        units = ['m/mark', 's/mark', 'scans/mark']
+        for n, (data, labels) in enumerate([(dist, None), (tm, None), (dzx, dzxnum)]):
+            ax, text, marks, notes = self.lines[n]
+            data = np.asarray(data, dtype=np.float64)
+            ax.set_xlim(0, data[-1])
+            text.set_text("%s marks - count: %s, mean: %.2f %s" % (name[n], len(data), data[-1]/len(data), units[n]))
+            for note in notes:
+                note.remove()
+            width = ax.get_position().width * self.fig.get_figwidth() * 72.
+            self.lines[n][2:] = numberline(ax, data=data, labels=labels, xmax=data[-1], width=width, dpi=self.dpi,
+                                           marks=marks)
+
+        ux = (tm[:-1] + tm[1:]) / 2 # midpoint in time of each speed segment
+        self.speedax.set_xlim(0, max(tm))
+        self.speedax.set_ylim(min(spd)*0.9, max(spd)*1.1)
+        if self.speed is None:
+            self.speed, = self.speedax.plot(ux, spd, linewidth=1.5)
+        else:
+            self.speed.set_data(ux, spd)
+
+        if not self.laid:
+            self.fig.tight_layout()
+            if hasattr(self.fig, 'set_layout_engine'): # the layout is fixed now, so saving need not draw twice
+                self.fig.set_layout_engine(None)
+            self.laid = True
+
+    def save(self, out=''):
+        """Saves the plot to an image file (i.e. a `.png`)."""
+        self.fig.savefig(out, dpi=self.dpi)
+        fx.printmsg('saved sanity check plot to %s' % out)
+
+
+def sanityplot(gpx=None, gpxname='GPX', dzx=None, dzxnum=None, dzxname='DZX', out=None, dpi=150):
     """Creates two number line plots for comparison of mark location and scan number.
 
+    Each number line is drawn as one collection, with marks that would fall on the same pixel drawn once and
+    labels thinned to those that fit, so drawing time does not grow with the number of marks.
+
     Parameters
     ----------
-    gpx : gpxpy.GPX
+    gpx : gpxpy.GPX, gpx2dzg.io.GPXData, or gpx2dzg.io.MarkTable
         The list of GPX waypoints to plot.
     gpxname : str
         The name of the GPX file being read. This will be used as axis label text.
-    dzx : list
+    dzx : list or gpx2dzg.io.MarkTable
         The list of DZX marks to plot. Each item in the list is a scan number at which a mark was recorded.
-    origdzxnum : list
+    dzxnum : list
         A list of the original DZX marks to use as labels, intended to make removing with `-r <num>` easier.
-    gpxname : str
+        Defaults to the original mark numbers of a `MarkTable`.
+    dzxname : str
         The name of the DZX file being read. This will be used as axis label text.
+    out : str
+        If given, the plot is saved to this image file (i.e. a `.png`) without a display, instead of being shown.
+    dpi : float
+        The resolution of the saved image.
 
     Returns
     -------
-    plot instance
-        Creates a matplotlib figure with two axes showing number lines with mark locations plotted on each.
+    matplotlib.figure.Figure
+        A figure with axes showing number lines with mark locations plotted on each, and speed between GPX marks.
     """
-    n = 1
-    name = [gpxname, gpxname, dzxname]
-    label = ['distance (m)', 'time (s)',  'scan number', 'time (s)']
-    units = ['m/mark', 's/mark', 'scans/mark', 'm/s']
-    title = ['Sanity check plot: GPX and DZT marks', '', '']
     dist, spd, tm = fx.distance_speed_time(gpx)
-    fig = plt.figure(figsize=(10, 5))
-    fig.set_facecolor('white')
-    for data in [dist, tm, dzx]:
-        ax = plt.subplot(4, 1, n)
-        setup(ax, xmax=data[-1])
-        ax.xaxis.set_major_locator(ticker.LinearLocator(3))
-        ax.xaxis.set_minor_locator(ticker.LinearLocator(31))
-        ax.text(0.0, 0.6, "%s marks - count: %s, mean: %.2f %s" % (name[n-1], len(data), data[-1]/len(data), units[n-1]),
-                fontsize=10, transform=ax.transAxes)
-        plt.xlabel(label[n-1])
-        plt.title(title[n-1])
-        i = 0
-        for x in data:
-            ax.scatter(x,0.1)
-            if n < 3:
-                ax.annotate(str(i), xy=(x,0.1), xytext=(-2*(len(str(i))), 4), textcoords='offset points', fontsize=6)
-            else:
-                ax.annotate(str(dzxnum[i]), xy=(x,0.1), xytext=(-2*(len(str(i))), 4), textcoords='offset points', fontsize=6)
-            i += 1
-        n += 1
-
-    # this is messy but effective
-    ax = plt.subplot(4, 1, n)
-    ax.xaxis.set_ticks_position('bottom')
-    ax.tick_params(which='major', width=1.00)
-    ax.tick_params(which='major', length=5)
-    ax.tick_params(which='minor', width=0.75)
-    ax.tick_params(which='minor', length=2.5)
-    ax.set_xlim(0, max(tm))
-    ax.set_ylim(min(spd)*0.9, max(spd)*1.1)
-    plt.xlabel(label[n-1])
-    ax.xaxis.set_major_locator(ticker.LinearLocator(3))
-    ax.xaxis.set_minor_locator(ticker.LinearLocator(31))
-    ax.text(0.0, 1.1, "Speed between gpx marks (m/s)",
-            fontsize=10, transform=ax.transAxes)
-    n = 0
-    ux = []
-    for u in spd:
-        ux.append(fx.mean([tm[n], tm[n+1]]))
-        n += 1
-    plt.plot(ux, spd, linewidth=1.5)
-
-    plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    if hasattr(dzx, 'scan'): # a MarkTable
+        dzxnum = dzx.num if dzxnum is None else dzxnum
+        dzx = dzx.scan
+    p = SanityPlot(headless=bool(out), dpi=dpi)
+    p.draw(dist=dist, spd=spd, tm=tm, dzx=dzx, dzxnum=dzxnum, gpxname=gpxname, dzxname=dzxname)
+    if out:
+        p.save(out)
+    else:
+        import matplotlib.pyplot as plt
+        plt.show()
+    return p.fig
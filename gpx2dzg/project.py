@@ -0,0 +1,238 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import gpx2dzg.functions as fx
+import gpx2dzg.io as io
+import gpx2dzg.batch as bt
+import gpx2dzg.metrics as mc
+from gpx2dzg.exceptions import GPX2DZGError, InputNotFoundError
+
+
+def sortwaypoints(gpxmarks=None):
+    """Returns GPX data with waypoints (and track points) in time order.
+
+    Parameters
+    ----------
+    gpxmarks : gpx2dzg.io.GPXData
+        The GPX data.
+
+    Returns
+    -------
+    gpx2dzg.io.GPXData
+        The GPX data, sorted by time. Points with the same time keep their file order.
+    """
+    def tsort(points):
+        if (points is None) or np.all(points.time[:-1] <= points.time[1:]):
+            return points
+        order = np.argsort(points.time, kind='stable')
+        return io.MarkTable(time=points.time[order], lat=points.lat[order], lon=points.lon[order], ele=points.ele[order])
+    w = tsort(gpxmarks.waypoints)
+    if w is not gpxmarks.waypoints:
+        fx.printmsg('WARNING: gpx waypoints are not in time order. sorting them by time')
+    return io.GPXData(waypoints=w, tracks=tsort(gpxmarks.tracks))
+
+
+def slices(counts=[]):
+    """Returns the `(start, stop)` waypoint index range of each line, given each line's mark count,
+    assigning waypoints to lines in order.
+
+    Parameters
+    ----------
+    counts : list
+        The number of marks in each line.
+
+    Returns
+    -------
+    list
+        One `(start, stop)` tuple per line.
+    """
+    ends = np.cumsum(np.asarray(counts, dtype=np.int64)).tolist()
+    return list(zip([0] + ends[:-1], ends))
+
+
+def subset(gpxmarks=None, start=0, stop=0):
+    """Returns the waypoints in `[start, stop)`, along with the track points from the one before the first
+    waypoint's time to the one after the last waypoint's time (for dense output).
+
+    Parameters
+    ----------
+    gpxmarks : gpx2dzg.io.GPXData
+        Time-sorted GPX data (see `sortwaypoints()`).
+    start : int
+        The index of the first waypoint.
+    stop : int
+        One more than the index of the last waypoint.
+
+    Returns
+    -------
+    gpx2dzg.io.GPXData
+        The subset.
+    """
+    w = gpxmarks.waypoints
+    sub = io.MarkTable(time=w.time[start:stop], lat=w.lat[start:stop], lon=w.lon[start:stop], ele=w.ele[start:stop])
+    t = gpxmarks.tracks
+    if (t is not None) and (len(sub) > 0):
+        lo = max(int(np.searchsorted(t.time, sub.time[0], side='left')) - 1, 0)
+        hi = int(np.searchsorted(t.time, sub.time[-1], side='right')) + 1
+        t = io.MarkTable(time=t.time[lo:hi], lat=t.lat[lo:hi], lon=t.lon[lo:hi], ele=t.ele[lo:hi])
+    return io.GPXData(waypoints=sub, tracks=t)
+
+
+def _readmarks(dzx='', threshold=20000, cache=False):
+    """Reads one line's marks for `readmarks()` in a process pool, returning errors as strings instead of raising them."""
+    import gpx2dzg.gpx2dzg as g2d
+    try:
+        return np.asarray(g2d.converter(cache=cache).readmarks(dzx=dzx, threshold=threshold), dtype=np.int64)
+    except (GPX2DZGError, OSError) as e:
+        return str(e)
+
+
+def readmarks(lines=[], threshold=20000, processes=None, cache=False):
+    """Reads the marks of each line across a process pool. The marks are then passed to the conversions, so each
+    DZX/DZT is only read once.
+
+    Parameters
+    ----------
+    lines : list
+        A list of `(dzx, gpx, drops)` tuples.
+    threshold : int
+        The DZT mark threshold (see `gpx2dzg.io.readSIR3k()`).
+    processes : int
+        The number of worker processes. Defaults to the number of CPUs. If 1, marks are read in this process.
+    cache : bool
+        Whether to use the on-disk cache of parsed inputs (see `gpx2dzg.cache.Cache`).
+
+    Returns
+    -------
+    list
+        The scan numbers of each line's marks, or None for lines whose marks could not be read.
+    """
+    paths = [line[0] for line in lines]
+    processes = processes or os.cpu_count() or 1
+    start = time.perf_counter()
+    if (processes > 1) and (len(paths) > 1):
+        with ProcessPoolExecutor(max_workers=min(processes, len(paths)), initializer=fx.logger.setLevel,
+                                 initargs=(fx.logger.level,)) as pool:
+            marks = list(pool.map(_readmarks, paths, [threshold] * len(paths), [cache] * len(paths)))
+    else:
+        marks = [_readmarks(dzx=p, threshold=threshold, cache=cache) for p in paths]
+    for i, (p, mk) in enumerate(zip(paths, marks)):
+        if isinstance(mk, str):
+            fx.printmsg('ERROR: could not read %s: %s' % (p, mk))
+            marks[i] = None
+    fx.printmsg('project: read marks of %s lines in %.3f s' % (len(paths), time.perf_counter() - start))
+    return marks
+
+
+def plan(lines=[], gpxmarks=None, marks=[]):
+    """Works out which waypoints belong to each line.
+
+    Parameters
+    ----------
+    lines : list
+        A list of `(dzx, gpx, drops)` tuples in survey order (the GPX path of each is ignored).
+    gpxmarks : gpx2dzg.io.GPXData
+        Time-sorted GPX data for the whole project (see `sortwaypoints()`).
+    marks : list
+        The scan numbers of each line's marks, or None for lines whose marks could not be read (see `readmarks()`).
+
+    Returns
+    -------
+    list
+        One `(start, stop)` waypoint index range per line, or None for lines whose marks could not be read.
+    bool
+        Whether the total number of marks (after drops) equals the number of waypoints.
+    """
+    counts, failed = [], set()
+    for i, ((dzx, gpx, drops), mk) in enumerate(zip(lines, marks)):
+        if mk is None:
+            failed.add(i)
+            counts.append(0)
+        else:
+            counts.append(len(fx.drop(marks=mk.tolist(), drops=list(drops))) if drops else len(mk))
+    ranges = slices(counts)
+    times = gpxmarks.waypoints.time.view('datetime64[ns]').astype('datetime64[s]')
+    fx.printmsg('project plan:')
+    for i, ((dzx, gpx, drops), (start, stop)) in enumerate(zip(lines, ranges)):
+        span = '%s - %s' % (times[start], times[stop-1]) if start < stop <= len(times) else 'past end of gpx'
+        fx.printmsg('    %-24s %6s marks  gpx marks %s-%s  %s' % (os.path.basename(dzx), counts[i], start, stop-1, span))
+    total = sum(counts)
+    matched = (total == len(gpxmarks.waypoints)) and not failed
+    if total != len(gpxmarks.waypoints):
+        fx.printmsg('WARNING: lines have %s marks in total, but the gpx has %s waypoints. look for a line whose gpx '
+                    'time span overlaps the next line\'s, or a long gap inside a line' % (total, len(gpxmarks.waypoints)))
+    return [None if i in failed else r for i, r in enumerate(ranges)], matched
+
+
+def run(batch='', gpx='', write=False, processes=None, threshold=20000, every=0, metrics=None, cache=False,
+        plotdir=None, pipeline=False):
+    """Converts a project: many DZX/DZT lines recorded against one GPX log. The GPX is parsed once and its
+    waypoints sorted by time. Each line's marks are read across a process pool, then each line (in file name or
+    manifest order) is given the next waypoints, as many as it has marks (after drops). Lines are then converted
+    across a process pool, each with its marks and only its own waypoints (and track points), so no input is
+    parsed twice.
+
+    If the lines' total mark count does not match the number of waypoints, the split cannot be trusted, so the
+    plan is printed and nothing is written.
+
+    Parameters
+    ----------
+    batch : str
+        A directory of DZX/DZT files (see `gpx2dzg.batch.findpairs()`) or a manifest (see
+        `gpx2dzg.batch.readmanifest()`, whose GPX column is ignored and whose drops are applied).
+    gpx : str
+        The project's GPX log.
+    write : bool
+        Whether to write a DZG for each line.
+    processes : int
+        The number of worker processes. Defaults to the number of CPUs.
+    threshold : int
+        The DZT mark threshold (see `gpx2dzg.io.readSIR3k()`).
+    every : int
+        If greater than zero, write a position every this many scans (see `gpx2dzg.io.writedense()`).
+    metrics : str
+        `'json'` or `'text'` to print each line's metrics (see `gpx2dzg.batch.run()`).
+    cache : bool
+        Whether to use the on-disk cache of parsed inputs (see `gpx2dzg.cache.Cache`).
+    plotdir : str
+        If given, save a sanity check plot of each mismatched line to this directory.
+    pipeline : bool
+        Whether each conversion reads its marks while the geoid model loads (see `gpx2dzg.session.Converter`).
+
+    Returns
+    -------
+    dict
+        A summary in the same form as `gpx2dzg.batch.run()`.
+
+    Raises
+    ------
+    gpx2dzg.exceptions.GPX2DZGError
+        A subclass describing the problem if the GPX cannot be found or read.
+    """
+    import gpx2dzg.gpx2dzg as g2d
+    lines = bt.findpairs(dir=batch) if os.path.isdir(batch) else bt.readmanifest(manifest=batch)
+    fx.printmsg('project: found %s DZX/DZT files sharing gpx %s' % (len(lines), gpx))
+    if not os.path.exists(gpx):
+        fx.printmsg('ERROR: specified gpx file does not exist.')
+        raise InputNotFoundError('gpx file does not exist: %s' % gpx)
+    with mc.collect() as m:
+        g = sortwaypoints(g2d.converter(cache=cache).readgpx(gpx=gpx, tracks=(every > 0)))
+    fx.printmsg('project: read %s gpx marks in %.3f s' % (len(g.waypoints), m.timers.get('read gpx', 0.)))
+    marks = readmarks(lines=lines, threshold=threshold, processes=processes, cache=cache)
+    ranges, matched = plan(lines=lines, gpxmarks=g, marks=marks)
+
+    jobs, results = [], {}
+    for i, ((dzx, _, drops), r) in enumerate(zip(lines, ranges)):
+        if r is None:
+            results[i] = (dzx, gpx, 'failed', 'could not read marks', None)
+        elif not matched:
+            results[i] = (dzx, gpx, 'mismatched', 'project mark counts do not match', None)
+        else:
+            jobs.append((i, (dzx, gpx, drops, subset(g, *r), marks[i])))
+    if jobs:
+        done = bt.convertpairs(pairs=[j for _, j in jobs], write=write, processes=processes, threshold=threshold,
+                               every=every, cache=cache, plotdir=plotdir, pipeline=pipeline)
+        results.update(zip([i for i, _ in jobs], done))
+    return bt.summarize(results=[results[i] for i in range(len(lines))], metrics=metrics)
+
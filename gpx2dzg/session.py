@@ -0,0 +1,355 @@
+import os
+import threading
+import contextvars
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import gpx2dzg.functions as fx
+import gpx2dzg.io as io
+import gpx2dzg.align as align
+import gpx2dzg.geoid as geoid
+import gpx2dzg.declination as declination
+import gpx2dzg.metrics as mc
+from gpx2dzg.exceptions import InputNotFoundError, DZTError, GPXError
+
+MINCONFIDENCE = 0.7 # automatic drops are only applied to alignments at least this confident
+READERS = 8 # reader threads per pipelined session (each conversion uses up to three at once)
+
+
+class Result(object):
+    """The outcome of `Converter.convert()`.
+
+    Attributes
+    ----------
+    dzx : str
+        The DZX/DZT path.
+    gpx : str
+        The GPX path.
+    matched : bool
+        Whether mark counts matched (after drops).
+    dzg : str
+        The path of the DZG written, or None if none was written.
+    dzxmarks : gpx2dzg.io.MarkTable
+        The DZX/DZT marks, with drops masked (`dzxmarks.scan` holds the scan numbers of the marks used).
+    dzxnum : list
+        The original index of each mark used.
+    gpxmarks : gpx2dzg.io.GPXData
+        The GPX waypoints, with drops masked.
+    dzxcount : int
+        The number of DZX/DZT marks read, before drops.
+    gpxcount : int
+        The number of GPX waypoints read, before drops.
+    drops : list
+        Original indices of the DZX/DZT marks dropped (given and automatic).
+    gpxdrops : list
+        Original indices of the GPX waypoints dropped automatically.
+    proposal : gpx2dzg.align.Proposal
+        The alignment proposal, if mark counts did not match before alignment, otherwise None.
+    metrics : gpx2dzg.metrics.Metrics
+        Stage timers and counters.
+    warnings : list
+        Warning and error messages printed during the conversion (whether or not they were shown).
+    """
+    __slots__ = ('dzx', 'gpx', 'matched', 'dzg', 'dzxmarks', 'dzxnum', 'gpxmarks', 'dzxcount', 'gpxcount',
+                 'drops', 'gpxdrops', 'proposal', 'metrics', 'warnings')
+
+    def __init__(self, dzx='', gpx=''):
+        self.dzx, self.gpx = dzx, gpx
+        self.matched, self.dzg = False, None
+        self.dzxmarks, self.dzxnum, self.gpxmarks = None, [], None
+        self.dzxcount, self.gpxcount = 0, 0
+        self.drops, self.gpxdrops = [], []
+        self.proposal, self.metrics = None, None
+        self.warnings = []
+
+    def __repr__(self):
+        return 'Result(dzx=%r, matched=%s, dzg=%r, drops=%s, gpxdrops=%s)' % (
+            self.dzx, self.matched, self.dzg, self.drops, self.gpxdrops)
+
+
+class Converter(object):
+    """A conversion session for long-running processes which convert many files.
+
+    The session owns the expensive shared resources: the geoid model (loaded once, on the first write), a
+    declination service, and a small cache of parsed inputs keyed by path, size, and modification time, so a file
+    converted again (i.e. with different drops) is not parsed again. Errors raise subclasses of
+    `gpx2dzg.exceptions.GPX2DZGError` instead of exiting. Sessions may be shared between threads.
+
+    Parameters
+    ----------
+    threshold : int
+        The DZT mark threshold (see `gpx2dzg.io.readSIR3k()`).
+    mode : str
+        Distance calculation mode for speed over ground (see `gpx2dzg.functions.distances()`).
+    dec : gpx2dzg.declination.Declination
+        The declination service to use. Defaults to the process-wide service.
+    cachesize : int
+        The number of parsed inputs to keep in memory. 0 disables the in-memory cache.
+    diskcache : gpx2dzg.cache.Cache
+        If given, parsed inputs not found in memory are looked for in (and added to) this on-disk cache,
+        so that they are not parsed again by later processes.
+    pipeline : bool
+        Read the DZX/DZT and the GPX, and load the geoid model (if a DZG will be written), at the same time on a
+        pool of reader threads. Where reads are slow because of latency (i.e. on a network share), this makes the
+        wait for a conversion's inputs close to the slowest of them instead of their sum.
+    """
+    def __init__(self, threshold=20000, mode='fast', dec=None, cachesize=16, diskcache=None, pipeline=False):
+        self.threshold = threshold
+        self.mode = mode
+        self.dec = dec or declination.service()
+        self.cachesize = cachesize
+        self.diskcache = diskcache
+        self.pipeline = pipeline
+        self.cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._readers = None
+
+    def _cached(self, path='', kind='', read=None):
+        """Returns the parsed contents of a file, from the in-memory cache if the file has not changed since it was read."""
+        st = os.stat(path)
+        key = (os.path.abspath(path), kind, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                mc.count('input cache hits')
+                return self.cache[key]
+        value = read()
+        if self.cachesize > 0:
+            with self._lock:
+                self.cache[key] = value
+                while len(self.cache) > self.cachesize:
+                    self.cache.popitem(last=False)
+        return value
+
+    def readmarks(self, dzx='', threshold=None):
+        """Reads DZX or DZT marks (see `gpx2dzg.io.readdzx()` and `gpx2dzg.io.readSIR3k()`).
+
+        Parameters
+        ----------
+        dzx : str
+            The DZX or DZT path.
+        threshold : int
+            The DZT mark threshold. Defaults to the session's threshold.
+
+        Returns
+        -------
+        array.array
+            Scan numbers of each mark. The array is a copy, so it may be modified.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        if '.dzt' in dzx.lower():
+            def read():
+                try:
+                    return array('q', io.readSIR3k(dzt=dzx, threshold=threshold))
+                except (OSError, ValueError) as e:
+                    fx.printmsg('ERROR: could not read DZT: %s' % e)
+                    raise DZTError('could not read %s: %s' % (dzx, e)) from e
+            stage, kind = 'read dzt', 'dzt%s' % threshold
+        else:
+            read = lambda: io.readdzx(dzx=dzx)
+            stage, kind = 'read dzx', 'dzx'
+        if self.diskcache is not None:
+            read = lambda read=read: self.diskcache.marks(path=dzx, kind=kind, read=read)
+        with mc.stage(stage):
+            marks = self._cached(path=dzx, kind=kind, read=read)
+        return array('q', marks)
+
+    def readgpx(self, gpx='', tracks=False):
+        """Reads GPX waypoints, and optionally track points (see `gpx2dzg.io.readgpx()`).
+
+        Parameters
+        ----------
+        gpx : str
+            The GPX path.
+        tracks : bool
+            Whether to read track points.
+
+        Returns
+        -------
+        gpx2dzg.io.GPXData
+            The GPX data. Its `waypoints` may be dropped from without affecting cached data.
+        """
+        def read():
+            g = io.readgpx(gpx=gpx, engine='stream', tracks=tracks)
+            if len(g.waypoints) == 0:
+                raise GPXError('could not read waypoints from %s' % gpx)
+            return g
+        kind = 'gpx+trk' if tracks else 'gpx'
+        if self.diskcache is not None:
+            read = lambda read=read: self.diskcache.gpx(path=gpx, kind=kind, read=read)
+        with mc.stage('read gpx'):
+            g = self._cached(path=gpx, kind=kind, read=read)
+        return io.GPXData(waypoints=g.waypoints.copy(), tracks=g.tracks)
+
+    def readers(self):
+        """Returns the session's reader thread pool (used when `pipeline=True`), creating it on first use."""
+        with self._lock:
+            if self._readers is None:
+                self._readers = ThreadPoolExecutor(max_workers=READERS, thread_name_prefix='gpx2dzg-read')
+            return self._readers
+
+    def _read(self, r, threshold=None, tracks=False, warm=False, gpxmarks=None, marks=None):
+        """Reads the DZX/DZT marks (unless `marks` is given) and the GPX (unless `gpxmarks` is given) for `r`, one
+        after the other or, in a pipelined session, at the same time. If `warm` is True, the geoid model is also loaded
+        in the background so that it is ready (or nearly) by the time the DZG is written."""
+        if not self.pipeline:
+            marks = self.readmarks(dzx=r.dzx, threshold=threshold) if marks is None else marks
+            return marks, self.readgpx(gpx=r.gpx, tracks=tracks) if gpxmarks is None else gpxmarks
+        pool = self.readers()
+        # each read runs in a copy of this context, so its timers, counters, and warnings go to this conversion
+        submit = lambda f, **kwargs: pool.submit(contextvars.copy_context().run, f, **kwargs)
+        if warm:
+            submit(geoid.load) # not waited for. io.write() waits for the model if it is still loading
+        gpxread = submit(self.readgpx, gpx=r.gpx, tracks=tracks) if gpxmarks is None else None
+        if marks is None:
+            marks = submit(self.readmarks, dzx=r.dzx, threshold=threshold).result()
+        return marks, gpxmarks if gpxread is None else gpxread.result()
+
+    def convert(self, dzx='', gpx=None, write=False, drops=[], every=0, autodrop=False, dzg=None, threshold=None,
+                gpxmarks=None, marks=None):
+        """Matches DZX/DZT marks with GPX waypoints and optionally writes a DZG.
+
+        Parameters
+        ----------
+        dzx : str
+            The DZX or DZT path.
+        gpx : str
+            The GPX path. If None, an identically named GPX is used (see `gpx2dzg.functions.findgpx()`).
+        write : bool
+            Whether to write a DZG if mark counts match.
+        drops : list
+            DZX/DZT mark indices to drop (see `gpx2dzg.functions.drop()`).
+        every : int
+            If greater than zero, write a position every this many scans (see `gpx2dzg.io.writedense()`).
+        autodrop : bool
+            If mark counts do not match, apply the drops proposed by `gpx2dzg.align.propose()` as long as its
+            confidence is at least `MINCONFIDENCE`.
+        dzg : str
+            The DZG path. Defaults to the DZX/DZT path with a `.DZG` extension, or with `-gpx2dzg.DZG` if that exists.
+        threshold : int
+            The DZT mark threshold. Defaults to the session's threshold.
+        gpxmarks : gpx2dzg.io.GPXData
+            Already-read GPX data to use instead of reading `gpx` (i.e. this line's part of a longer GPX log,
+            see `gpx2dzg.project`). `gpx` is then only used in messages.
+        marks : numpy.ndarray
+            Already-read scan numbers of the DZX/DZT marks to use instead of reading `dzx` (i.e. marks read while
+            planning a project).
+
+        Returns
+        -------
+        Result
+            The outcome of the conversion.
+
+        Raises
+        ------
+        gpx2dzg.exceptions.GPX2DZGError
+            A subclass describing the problem if an input cannot be found or read, or the DZG cannot be written.
+        """
+        gpx = gpx or fx.findgpx(dzx)
+        for path, kind in ((dzx, 'dzx/dzt'), (gpx, 'gpx')):
+            if (not os.path.exists(path)) and ((kind == 'dzx/dzt') or (gpxmarks is None)):
+                fx.printmsg('ERROR: specified %s file does not exist.' % kind)
+                raise InputNotFoundError('%s file does not exist: %s' % (kind, path))
+        r = Result(dzx=dzx, gpx=gpx)
+        token = fx.capture.set(r.warnings)
+        try:
+            with mc.collect() as r.metrics:
+                self._convert(r, write=write, drops=drops, every=every, autodrop=autodrop, dzg=dzg, threshold=threshold,
+                              gpxmarks=gpxmarks, marks=marks)
+        finally:
+            fx.capture.reset(token)
+        return r
+
+    def edit(self, dzx='', gpx=None, threshold=None):
+        """Reads a DZX/DZT and GPX pair for interactive drop editing.
+
+        Parameters
+        ----------
+        dzx : str
+            The DZX or DZT path.
+        gpx : str
+            The GPX path. If None, an identically named GPX is used (see `gpx2dzg.functions.findgpx()`).
+        threshold : int
+            The DZT mark threshold. Defaults to the session's threshold.
+
+        Returns
+        -------
+        gpx2dzg.edit.DropSession
+            An editing session with no drops, using this session's distance mode and declination service.
+
+        Raises
+        ------
+        gpx2dzg.exceptions.GPX2DZGError
+            A subclass describing the problem if an input cannot be found or read.
+        """
+        from gpx2dzg.edit import DropSession
+        gpx = gpx or fx.findgpx(dzx)
+        for path, kind in ((dzx, 'dzx/dzt'), (gpx, 'gpx')):
+            if not os.path.exists(path):
+                fx.printmsg('ERROR: specified %s file does not exist.' % kind)
+                raise InputNotFoundError('%s file does not exist: %s' % (kind, path))
+        return DropSession(dzxmarks=self.readmarks(dzx=dzx, threshold=threshold), gpxmarks=self.readgpx(gpx=gpx),
+                           mode=self.mode, dec=self.dec)
+
+    def _convert(self, r, write=False, drops=[], every=0, autodrop=False, dzg=None, threshold=None, gpxmarks=None,
+                 marks=None):
+        """The body of `convert()`, which fills in `r`."""
+        fx.printmsg('dzx file: %s' % r.dzx)
+        fx.printmsg('gpx file: %s' % r.gpx)
+
+        given = gpxmarks is not None
+        marks, gpxmarks = self._read(r, threshold=threshold, tracks=(every > 0), warm=write, gpxmarks=gpxmarks,
+                                     marks=marks)
+        dzxmarks = io.MarkTable(scan=marks)
+        fx.printmsg('found %s %s marks' % (len(dzxmarks), 'dzt' if '.dzt' in r.dzx.lower() else 'dzx'))
+        mc.count('dzx marks', len(dzxmarks))
+        if given: # a new mask, since drops change it
+            gpxmarks = io.GPXData(waypoints=gpxmarks.waypoints.copy(), tracks=gpxmarks.tracks)
+        fx.printmsg('found %s gpx marks' % len(gpxmarks.waypoints))
+        mc.count('gpx marks', len(gpxmarks.waypoints))
+        r.dzxcount, r.gpxcount = len(dzxmarks), len(gpxmarks.waypoints)
+
+        if len(drops) > 0:
+            fx.drop(marks=dzxmarks, drops=list(drops))
+            mc.count('drops', r.dzxcount - len(dzxmarks))
+
+        if (len(gpxmarks.waypoints) != len(dzxmarks)) and (len(dzxmarks) > 1) and (len(gpxmarks.waypoints) > 1):
+            with mc.stage('align'):
+                r.proposal = p = align.propose(dzxmarks=dzxmarks, gpxmarks=gpxmarks)
+            fx.printmsg('alignment against gpx %s proposes dropping dzx/dzt marks %s and gpx marks %s (confidence %.2f)' %
+                        (p.metric, dzxmarks.num[p.dzxdrops].tolist(), p.gpxdrops, p.confidence))
+            if autodrop and (p.confidence >= MINCONFIDENCE):
+                fx.printmsg('applying proposed drops')
+                align.apply(proposal=p, dzxmarks=dzxmarks, gpxmarks=gpxmarks)
+                mc.count('auto drops dzx', len(p.dzxdrops))
+                mc.count('auto drops gpx', len(p.gpxdrops))
+            elif autodrop:
+                fx.printmsg('WARNING: alignment confidence is below %.2f. not applying proposed drops' % MINCONFIDENCE)
+            elif len(p.gpxdrops) == 0:
+                fx.printmsg('to apply, rerun with -a, or with -r %s' % ','.join(
+                    str(i) for i in sorted(set(dzxmarks.dropped) | set(dzxmarks.num[p.dzxdrops].tolist()))))
+            else:
+                fx.printmsg('to apply, rerun with -a')
+
+        r.dzxmarks, r.dzxnum, r.gpxmarks = dzxmarks, dzxmarks.num.tolist(), gpxmarks
+        r.drops, r.gpxdrops = dzxmarks.dropped, gpxmarks.waypoints.dropped
+        r.matched = len(gpxmarks.waypoints) == len(dzxmarks)
+
+        if not r.matched:
+            fx.printmsg('mark counts do not match. foregoing write.')
+            return
+        fx.printmsg('mark counts match!')
+        if not write:
+            fx.printmsg('no DZG write specified. skipping...')
+            return
+        if dzg is None:
+            fx.printmsg('outputting to DZG now (same directory and name as the DZX/DZT)')
+            fx.printmsg('if a DZG already exists, another will be written with "-gpx2dzg" in the name.')
+            dzg = fx.dzgpath(r.dzx)
+        fx.printmsg('output file: %s' % dzg)
+        with mc.stage('write'):
+            if every > 0:
+                io.writedense(dzg=dzg, dzxmarks=dzxmarks, gpxmarks=gpxmarks, every=every, mode=self.mode, dec=self.dec)
+            else:
+                io.write(dzg=dzg, dzxmarks=dzxmarks, gpxmarks=gpxmarks, mode=self.mode, dec=self.dec)
+        r.dzg = dzg
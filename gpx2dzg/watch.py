@@ -0,0 +1,270 @@
+import os, sys
+import getopt
+import json
+import time
+import signal
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor
+import gpx2dzg.functions as fx
+import gpx2dzg.batch as batch
+
+STATE = '.gpx2dzg-watch.json' # default state file name, in the watched directory
+
+watch_help = u'''usage:
+gpx2dzg watch /path/to/dir [-w] [-n 4] [-i 5] [-e 10] [--state /path/to/state.json] [--once] [--cache]
+
+options:
+   OPTION    |       ARGUMENT       |       FUNCTIONALITY
+-w, --write  |  n/a                 | write a DZG for each pair with matching mark counts
+-n, --processes | int                | number of worker processes (default: number of CPUs)
+-i, --interval | seconds            | how often to look for new or changed files (default: 5)
+-e, --settle | seconds              | how long a pair must go unchanged before it is converted (default: 10)
+--state      | file: /dir/s.json    | where to record converted pairs (default: .gpx2dzg-watch.json in the watched directory)
+--once       |  n/a                 | exit once every settled pair has been converted, instead of watching forever
+--cache      |  n/a                 | keep parsed inputs in the disk cache (off by default, since each pair is only read once)
+--no-cache   |  n/a                 | do not use the disk cache (the default in watch mode)
+-t, -s, -a, -q |  see gpx2dzg -h     | as for single conversions
+'''
+
+
+def readstate(state=''):
+    """Reads a watch state file.
+
+    Parameters
+    ----------
+    state : str
+        The state file path.
+
+    Returns
+    -------
+    dict
+        The pairs already converted, keyed by absolute DZX/DZT path. Each value is a dict with keys `'sig'`
+        (the file signature when converted, see `signature()`), `'status'`, `'detail'`, and `'time'`.
+        Empty if the file does not exist or cannot be read.
+    """
+    try:
+        with open(state, 'r') as f:
+            return json.load(f).get('pairs', {})
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        fx.printmsg('WARNING: could not read watch state file %s (starting fresh): %s' % (state, e))
+        return {}
+
+
+def writestate(state='', pairs={}):
+    """Writes a watch state file, replacing the old one in a single step so that an interrupted write does not lose it.
+
+    Parameters
+    ----------
+    state : str
+        The state file path.
+    pairs : dict
+        The pairs already converted (see `readstate()`).
+    """
+    tmp = '%s.%s.tmp' % (state, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'pairs': pairs}, f, indent=1)
+    os.replace(tmp, state)
+
+
+def signature(dzx='', gpx=''):
+    """Returns the sizes and modification times of a pair of files, which change whenever either file does.
+
+    Returns
+    -------
+    list
+        `[dzx size, dzx mtime (ns), gpx size, gpx mtime (ns)]`, or None if either file does not exist.
+    """
+    try:
+        a, b = os.stat(dzx), os.stat(gpx)
+    except OSError:
+        return None
+    return [a.st_size, a.st_mtime_ns, b.st_size, b.st_mtime_ns]
+
+
+def scan(dir=''):
+    """Finds pairs in a directory (see `gpx2dzg.batch.findpairs()`) whose GPX exists.
+
+    Returns
+    -------
+    list
+        A list of `(dzx, gpx, sig)` tuples with absolute paths.
+    """
+    pairs = []
+    for dzx, gpx, drops in batch.findpairs(dir=dir):
+        sig = signature(dzx, gpx)
+        if sig is not None:
+            pairs.append((os.path.abspath(dzx), os.path.abspath(gpx), sig))
+    return pairs
+
+
+async def _watch(dir='', write=False, processes=None, threshold=20000, every=0, autodrop=False,
+                 interval=5., settle=10., state=None, once=False, cache=False):
+    """The event loop behind `watch()`. A poller finds settled pairs and puts them on a bounded queue, which
+    `processes` workers take from and hand to a process pool. When every worker is busy and the queue is full,
+    the poller waits, so pairs are never picked up faster than they can be converted."""
+    loop = asyncio.get_running_loop()
+    done = readstate(state)
+    queue = asyncio.Queue(maxsize=processes)
+    pending = {} # dzx: (sig, time first seen with that sig)
+    inflight = set()
+    stop = asyncio.Event()
+    saving = asyncio.Lock() # one state file write at a time, so the newest state is always the one kept
+    convert = functools.partial(batch._convertpair, write=write, threshold=threshold, every=every, autodrop=autodrop,
+                                cache=cache)
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set) # finish the conversions in progress, then exit
+    except (NotImplementedError, AttributeError): # not available on windows
+        pass
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=fx.logger.setLevel,
+                             initargs=(fx.logger.level,)) as pool:
+        async def worker():
+            while True:
+                dzx, gpx, sig = await queue.get()
+                try:
+                    try:
+                        r = await loop.run_in_executor(pool, convert, (dzx, gpx, []))
+                        status, detail = r[2], r[3]
+                    except Exception as e: # i.e. a worker process died
+                        status, detail = 'failed', '%s: %s' % (type(e).__name__, e)
+                    fx.printmsg('watch: %-10s %s %s' % (status, os.path.basename(dzx), detail))
+                    done[dzx] = {'sig': sig, 'status': status, 'detail': detail, 'time': time.time()}
+                    async with saving: # the state file may be on the same slow share as the inputs
+                        await loop.run_in_executor(None, writestate, state, dict(done))
+                finally:
+                    inflight.discard(dzx)
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(processes)]
+        try:
+            while not stop.is_set():
+                now = loop.time()
+                found = await loop.run_in_executor(None, scan, dir) # directory listing can be slow on network shares
+                for dzx in set(pending) - set(p[0] for p in found): # files were removed
+                    del pending[dzx]
+                for dzx, gpx, sig in found:
+                    if (dzx in inflight) or ((dzx in done) and (done[dzx]['sig'] == sig)):
+                        pending.pop(dzx, None)
+                        continue
+                    if (dzx not in pending) or (pending[dzx][0] != sig):
+                        pending[dzx] = (sig, now) # new or changed. wait for it to settle
+                        continue
+                    if now - pending[dzx][1] >= settle:
+                        del pending[dzx]
+                        inflight.add(dzx)
+                        await queue.put((dzx, gpx, sig)) # waits here while the queue is full
+                if once and (len(pending) == 0) and (len(inflight) == 0):
+                    break
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+            await queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+def watch(dir='', write=False, processes=None, threshold=20000, every=0, autodrop=False, interval=5., settle=10.,
+          state=None, once=False, cache=False):
+    """Watches a directory for new or changed DZX/DZT and GPX pairs and converts each one once it has settled.
+
+    Pairs are found the same way as in batch mode (see `gpx2dzg.batch.findpairs()`). A pair is converted once
+    neither file's size or modification time has changed for `settle` seconds, so files still being copied are
+    left alone. Each pair's signature is recorded in a state file when it is converted, so a restarted watcher
+    does not convert it again unless one of its files changes.
+
+    Parameters
+    ----------
+    dir : str
+        The directory to watch.
+    write : bool
+        Whether to write a DZG for each pair with matching mark counts.
+    processes : int
+        The number of worker processes. Defaults to the number of CPUs.
+    threshold : int
+        The DZT mark threshold (see `gpx2dzg.io.readSIR3k()`).
+    every : int
+        If greater than zero, write a position every this many scans (see `gpx2dzg.io.writedense()`).
+    autodrop : bool
+        Whether to apply proposed drops to pairs whose mark counts do not match.
+    interval : float
+        Seconds between directory scans.
+    settle : float
+        Seconds a pair must go unchanged before it is converted.
+    state : str
+        The state file path. Defaults to `.gpx2dzg-watch.json` in the watched directory.
+    once : bool
+        Return once every pair has been converted instead of watching forever.
+    cache : bool
+        Whether to use the on-disk cache of parsed inputs (see `gpx2dzg.cache.Cache`). Off by default, since a
+        watcher reads each pair once and a changed pair misses the cache anyway.
+    """
+    state = state or os.path.join(dir, STATE)
+    processes = processes or os.cpu_count() or 1
+    fx.printmsg('watch: watching %s (every %s s, settle time %s s, %s workers, state in %s)' %
+                (dir, interval, settle, processes, state))
+    asyncio.run(_watch(dir=dir, write=write, processes=processes, threshold=threshold, every=every,
+                       autodrop=autodrop, interval=interval, settle=settle, state=state, once=once,
+                       cache=cache))
+
+
+def main(argv=[]):
+    """The argument parsing function for `gpx2dzg watch`.
+
+    Parameters
+    ----------
+    argv : list
+        The arguments following `watch` on the command line.
+    """
+    opts = {'write': False, 'processes': None, 'threshold': 20000, 'every': 0, 'autodrop': False,
+            'interval': 5., 'settle': 10., 'state': None, 'once': False, 'cache': False}
+    try:
+        optlist, args = getopt.gnu_getopt(argv, 'hwaqn:t:s:i:e:', ['help', 'write', 'auto-drop', 'quiet', 'once',
+                                                                  'processes=', 'threshold=', 'scans=', 'interval=',
+                                                                  'settle=', 'state=', 'cache', 'no-cache'])
+    except getopt.GetoptError as e:
+        fx.printmsg('ERROR: invalid argument(s) supplied')
+        fx.printmsg('error text: %s' % e)
+        fx.printmsg(watch_help)
+        sys.exit(2)
+    numbers = {'-n': ('processes', int), '--processes': ('processes', int), '-t': ('threshold', int),
+               '--threshold': ('threshold', int), '-s': ('every', int), '--scans': ('every', int),
+               '-i': ('interval', float), '--interval': ('interval', float), '-e': ('settle', float),
+               '--settle': ('settle', float)}
+    for opt, arg in optlist:
+        if opt in ('-h', '--help'):
+            fx.printmsg(watch_help)
+            sys.exit()
+        if opt in numbers:
+            name, kind = numbers[opt]
+            try:
+                opts[name] = kind(arg)
+            except ValueError as e:
+                fx.printmsg('ERROR: %s must be a number' % opt)
+                fx.printmsg('full error text: %s' % e)
+                sys.exit(2)
+        if opt in ('-w', '--write'):
+            opts['write'] = True
+        if opt in ('-a', '--auto-drop'):
+            opts['autodrop'] = True
+        if opt in ('-q', '--quiet'):
+            fx.logger.setLevel(fx.SUMMARY)
+        if opt == '--once':
+            opts['once'] = True
+        if opt in ('--cache', '--no-cache'):
+            opts['cache'] = (opt == '--cache')
+        if opt == '--state':
+            opts['state'] = os.path.expanduser(arg)
+    if len(args) != 1 or not os.path.isdir(os.path.expanduser(args[0])):
+        fx.printmsg('ERROR: specify one directory to watch')
+        fx.printmsg(watch_help)
+        sys.exit(2)
+    try:
+        watch(dir=os.path.expanduser(args[0]), **opts)
+    except KeyboardInterrupt:
+        fx.printmsg('watch: stopped')
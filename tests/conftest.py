@@ -0,0 +1,19 @@
+import logging
+import pytest
+import gpx2dzg.functions as fx
+import gpx2dzg.bench as bench
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    """Keeps progress messages out of test output."""
+    level = fx.logger.level
+    fx.logger.setLevel(logging.WARNING)
+    yield
+    fx.logger.setLevel(level)
+
+
+@pytest.fixture(scope='session')
+def line(tmp_path_factory):
+    """A matching set of generated inputs with 300 marks (see `gpx2dzg.bench.generate()`)."""
+    return bench.generate(dir=str(tmp_path_factory.mktemp('line')), n=300)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+import gpx2dzg.align as align
+import gpx2dzg.io as io
+from gpx2dzg.session import MINCONFIDENCE
+
+N = 200
+
+
+def positions(n=N, seed=0):
+    """Distance along a line at each of `n` marks, with uneven spacing as when marks are placed by hand."""
+    rng = np.random.default_rng(seed)
+    return np.concatenate(([0.], np.cumsum(rng.uniform(5., 15., n - 1))))
+
+
+def scans(p=[], seed=1):
+    """Scan numbers of marks at distances `p`, recorded with a survey wheel (with a little jitter)."""
+    rng = np.random.default_rng(seed)
+    return np.round(np.asarray(p) * 20 + rng.uniform(-2, 2, len(p))).astype(np.int64)
+
+
+def extra(s=[], after=[]):
+    """Adds a mark halfway between mark `i` and the next for each `i` in `after`, and returns the new marks and
+    the indices of the added marks in them."""
+    s = list(s)
+    added = []
+    for k, i in enumerate(sorted(after)):
+        j = i + 1 + k
+        s.insert(j, (s[j - 1] + s[j]) // 2)
+        added.append(j)
+    return np.array(s, dtype=np.int64), added
+
+
+def test_equal_counts():
+    p = positions()
+    xdrops, ydrops, confidence, cost = align.sequence(x=scans(p), y=p)
+    assert (xdrops, ydrops) == ([], [])
+    assert confidence >= MINCONFIDENCE
+
+
+@pytest.mark.parametrize('after', [[57], [40, 141]])
+def test_extra_dzx_marks(after):
+    p = positions()
+    x, added = extra(scans(p), after=after)
+    xdrops, ydrops, confidence, cost = align.sequence(x=x, y=p)
+    assert list(xdrops) == added
+    assert list(ydrops) == []
+    assert confidence >= MINCONFIDENCE
+
+
+@pytest.mark.parametrize('missing', [[90], [33, 160]])
+def test_missing_dzx_marks(missing):
+    p = positions()
+    x = np.delete(scans(p), missing)
+    xdrops, ydrops, confidence, cost = align.sequence(x=x, y=p)
+    assert list(xdrops) == []
+    assert list(ydrops) == missing
+    assert confidence >= MINCONFIDENCE
+
+
+def test_first_and_last_are_kept():
+    p = positions()
+    x, added = extra(scans(p), after=[0, N - 2])
+    xdrops, ydrops, confidence, cost = align.sequence(x=x, y=p)
+    assert 0 not in xdrops and len(x) - 1 not in xdrops
+    assert len(x) - len(xdrops) == len(p) - len(ydrops)
+
+
+def gpxdata(p=[]):
+    """Waypoints walking north at a steady 1 m/s, `p` meters from the start."""
+    p = np.asarray(p)
+    return io.GPXData(waypoints=io.MarkTable(time=1559397600000000000 + np.round(p * 1e9).astype(np.int64),
+                                             lat=44.9 + p / 111132., lon=np.full(len(p), -68.67),
+                                             ele=np.zeros(len(p))))
+
+
+def test_propose_and_apply():
+    p = positions()
+    x, added = extra(scans(np.delete(p, [120])), after=[30])
+    dzx, gpx = io.MarkTable(scan=x), gpxdata(p)
+    proposal = align.propose(dzxmarks=dzx, gpxmarks=gpx)
+    assert list(proposal.dzxdrops) == added
+    assert list(proposal.gpxdrops) == [120]
+    assert proposal.confidence >= MINCONFIDENCE
+    align.apply(proposal, dzxmarks=dzx, gpxmarks=gpx)
+    assert len(dzx) == len(gpx.waypoints) == N - 1
+    assert dzx.dropped == added
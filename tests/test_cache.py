@@ -0,0 +1,78 @@
+import os
+import errno
+import shutil
+import filecmp
+import numpy as np
+import pytest
+import gpx2dzg.gpx2dzg as g2d
+import gpx2dzg.io as io
+from gpx2dzg.cache import Cache
+from gpx2dzg.session import Converter
+
+
+def copy(line={}, dir=''):
+    """Copies a DZX and its GPX to `dir`, so they can be changed."""
+    for k in ('dzx', 'gpx'):
+        shutil.copy(line[k], dir)
+    return os.path.join(dir, os.path.basename(line['dzx'])), os.path.join(dir, os.path.basename(line['gpx']))
+
+
+def test_convert_leaves_cache_off(line, tmp_path, monkeypatch):
+    monkeypatch.setenv('GPX2DZG_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setattr(g2d, '_converters', {})
+    dzx, gpx = copy(line, str(tmp_path))
+    g2d.convert(dzx=dzx, gpx=gpx, write=True, autoplot=False)
+    assert not os.path.exists(tmp_path / 'cache')
+    g2d.convert(dzx=dzx, gpx=gpx, write=True, autoplot=False, cache=True)
+    assert len(os.listdir(tmp_path / 'cache')) == 2
+
+
+def test_hit_gives_same_output(line, tmp_path):
+    c = Converter(cachesize=0, diskcache=Cache(dir=str(tmp_path / 'cache')))
+    dzgs = []
+    for i in range(2):
+        dzgs.append(str(tmp_path / ('%s.DZG' % i)))
+        r = c.convert(dzx=line['dzx'], gpx=line['gpx'], write=True, dzg=dzgs[-1])
+        assert r.metrics.counters.get('disk cache hits', 0) == 2 * i
+    assert filecmp.cmp(dzgs[0], dzgs[1], shallow=False)
+
+
+def test_changed_file_is_read_again(line, tmp_path):
+    dzx, gpx = copy(line, str(tmp_path))
+    cache = Cache(dir=str(tmp_path / 'cache'))
+    read = lambda: io.readdzx(dzx=dzx)
+    assert list(cache.marks(path=dzx, kind='dzx', read=read)) == list(read())
+    assert cache.get(path=dzx, kind='dzx') is not None
+    with open(dzx, 'a') as f:
+        f.write('\n')
+    assert cache.get(path=dzx, kind='dzx') is None
+
+
+def test_hash_keys_hit_copies(line, tmp_path):
+    dzx, gpx = copy(line, str(tmp_path))
+    cache = Cache(dir=str(tmp_path / 'cache'), hash=True)
+    cache.gpx(path=line['gpx'], kind='gpx', read=lambda: io.readgpx(gpx=line['gpx'], engine='stream'))
+    a = cache.get(path=gpx, kind='gpx')
+    assert a is not None
+    assert np.array_equal(a['wtime'], io.readgpx(gpx=gpx, engine='stream').waypoints.time)
+
+
+def test_evicts_least_recently_used(line, tmp_path):
+    cache = Cache(dir=str(tmp_path / 'cache'), maxbytes=1)
+    cache.marks(path=line['dzx'], kind='dzx', read=lambda: io.readdzx(dzx=line['dzx']))
+    assert os.listdir(tmp_path / 'cache') == []
+
+
+@pytest.mark.parametrize('error', [OSError(errno.ENOSPC, 'No space left on device'), KeyboardInterrupt()])
+def test_failed_put_leaves_no_temporary_file(line, tmp_path, monkeypatch, error):
+    cache = Cache(dir=str(tmp_path / 'cache'))
+    def savez(f, **arrays):
+        f.write(b'PK partial')
+        raise error
+    monkeypatch.setattr(np, 'savez', savez)
+    if isinstance(error, OSError):
+        cache.put(path=line['dzx'], kind='dzx', arrays={'scan': np.arange(3)}) # reported, not raised
+    else:
+        with pytest.raises(KeyboardInterrupt):
+            cache.put(path=line['dzx'], kind='dzx', arrays={'scan': np.arange(3)})
+    assert os.listdir(str(tmp_path / 'cache')) == []
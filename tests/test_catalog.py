@@ -0,0 +1,87 @@
+import os
+import numpy as np
+import gpx2dzg.catalog as catalog
+import gpx2dzg.functions as fx
+
+HOUR = 3600 * 10**9
+
+
+def test_intervaltree_matches_brute_force():
+    rng = np.random.default_rng(0)
+    starts = rng.integers(0, 1000, 300)
+    ivs = [(int(s), int(s + l), i) for i, (s, l) in enumerate(zip(starts, rng.integers(0, 50, 300)))]
+    tree = catalog.IntervalTree(ivs)
+    assert len(tree) == len(ivs)
+    for a, b in zip(rng.integers(-10, 1060, 200).tolist(), rng.integers(0, 30, 200).tolist()):
+        assert sorted(tree.query(a)) == sorted(i for s, e, i in ivs if s <= a <= e)
+        assert sorted(tree.query(a, a + b)) == sorted(i for s, e, i in ivs if s <= a + b and a <= e)
+    assert catalog.IntervalTree([]).query(5) == []
+
+
+def gpx(path='', start='2019-06-01T14:00:00', n=10, step=60, trk=False):
+    times = np.datetime_as_string(np.datetime64(start) + np.arange(n) * np.timedelta64(step, 's')) + 'Z'
+    row = '  <trkpt lat="%.5f" lon="-68.67"><time>%s</time></trkpt>\n' if trk else \
+          '  <wpt lat="%.5f" lon="-68.67"><time>%s</time></wpt>\n'
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1">\n')
+        f.write('<trk><trkseg>\n' if trk else '')
+        f.write(''.join(row % (44.9 + i * 1e-4, t) for i, t in enumerate(times)))
+        f.write('</trkseg></trk>\n' if trk else '')
+        f.write('</gpx>\n')
+
+
+def test_update_is_incremental(tmp_path):
+    archive = tmp_path / 'gps'
+    (archive / 'june').mkdir(parents=True)
+    gpx(str(archive / 'june' / 'a.gpx'), start='2019-06-01T14:00:00')
+    gpx(str(archive / 'june' / 'b.gpx'), start='2019-06-02T14:00:00')
+    c = catalog.Catalog(archive=str(archive))
+    assert c.update(processes=1) == (2, 0, 0)
+    c = catalog.Catalog(archive=str(archive)) # read back from the index
+    assert c.update(processes=1) == (0, 0, 0)
+    gpx(str(archive / 'june' / 'b.gpx'), start='2019-06-02T14:00:00', n=20)
+    os.remove(archive / 'june' / 'a.gpx')
+    assert c.update(processes=1) == (1, 1, 0)
+    assert c.entries[os.path.join('june', 'b.gpx')]['waypoints'] == 20
+
+
+def test_find_prefers_best_cover(tmp_path):
+    archive = tmp_path / 'gps'
+    archive.mkdir()
+    gpx(str(archive / 'survey.gpx'), start='2019-06-01T14:00:00', n=61) # one hour
+    gpx(str(archive / 'week.gpx'), start='2019-05-30T00:00:00', n=8, step=86400) # a week, one point a day
+    gpx(str(archive / 'other.gpx'), start='2019-06-03T14:00:00')
+    c = catalog.Catalog(archive=str(archive))
+    c.update(processes=1)
+    t = int(np.datetime64('2019-06-01T14:30:00', 'ns').astype(np.int64))
+    found = c.find(t, t + HOUR // 4)
+    assert [os.path.basename(p) for p, o in found] == ['survey.gpx', 'week.gpx']
+    assert [o for p, o in found] == [1., 1.]
+    found = c.find(t, t + HOUR) # runs past the end of the survey log
+    assert os.path.basename(found[0][0]) == 'week.gpx'
+    assert found[1][1] == 0.5
+    assert c.find(0) == []
+
+
+def test_track_only_logs_are_not_found(tmp_path):
+    archive = tmp_path / 'gps'
+    archive.mkdir()
+    gpx(str(archive / 'day.gpx'), start='2019-06-01T08:00:00', n=12 * 60, trk=True) # a day of track, no waypoints
+    gpx(str(archive / 'survey.gpx'), start='2019-06-01T14:00:00', n=61, step=30) # half of the survey
+    (archive / 'broken.gpx').write_text('<gpx><wpt lat="44.9"')
+    c = catalog.Catalog(archive=str(archive))
+    warnings = []
+    token = fx.capture.set(warnings)
+    try:
+        assert c.update(processes=1) == (2, 0, 1)
+    finally:
+        fx.capture.reset(token)
+    assert [w for w in warnings if 'ERROR' in w or 'github' in w] == [] # no read error reports, only a warning
+    assert len(warnings) == 1 and 'broken.gpx' in warnings[0]
+    day = c.entries['day.gpx']
+    assert (day['waypoints'], day['trackpoints'], day['wptstart']) == (0, 12 * 60, None)
+    assert day['start'] is not None
+    t = int(np.datetime64('2019-06-01T14:00:00', 'ns').astype(np.int64))
+    found = c.find(t, t + HOUR)
+    assert [os.path.basename(p) for p, o in found] == ['survey.gpx']
+    assert found[0][1] == 0.5
@@ -0,0 +1,81 @@
+import os
+import shutil
+import numpy as np
+import pytest
+import gpx2dzg.bench as bench
+import gpx2dzg.check as check
+import gpx2dzg.io as io
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.mark.parametrize('kind', ['dzx', 'dzxfile'])
+def test_countdzx(line, kind):
+    assert check.countdzx(dzx=line[kind]) == len(io.readdzx(dzx=line[kind])) == 300
+
+
+@pytest.mark.parametrize('schema', ['TargetGroup', 'File'])
+def test_countdzx_skips_zero_and_negative_scans(tmp_path, schema):
+    dzx = str(tmp_path / 'skips.DZX')
+    bench.gendzx(path=dzx, scans=np.array([0, -20, 100, 0, 200, 300]), schema=schema)
+    assert check.countdzx(dzx=dzx) == len(io.readdzx(dzx=dzx)) == 4
+
+
+def test_countdzx_without_marks(tmp_path):
+    dzx = str(tmp_path / 'empty.DZX')
+    bench.gendzx(path=dzx, scans=np.array([0]))
+    with pytest.raises(ValueError):
+        check.countdzx(dzx=dzx)
+
+
+def test_countdzt(line):
+    assert check.countdzt(dzt=line['dzt']) == len(io.readSIR3k(dzt=line['dzt'])) == 300
+
+
+@pytest.mark.parametrize('gpx', ['bench', 'nw.gpx', 'zero.gpx'])
+def test_countgpx(line, gpx):
+    gpx = line['gpx'] if gpx == 'bench' else os.path.join(DATA, gpx)
+    assert check.countgpx(gpx=gpx) == len(io.readgpx(gpx=gpx, engine='stream').waypoints)
+
+
+def test_countgpx_with_namespace_prefix(line, tmp_path):
+    gpx = str(tmp_path / 'prefixed.gpx')
+    with open(line['gpx']) as f:
+        text = f.read()
+    with open(gpx, 'w') as f:
+        f.write(text.replace('<gpx ', '<gpx:gpx xmlns:gpx="http://www.topografix.com/GPX/1/1" ')
+                    .replace('</gpx>', '</gpx:gpx>').replace('<wpt', '<gpx:wpt').replace('</wpt>', '</gpx:wpt>'))
+    assert check.countgpx(gpx=gpx) == 300
+
+
+def test_countgpx_with_garmin_extensions(tmp_path):
+    gpx = str(tmp_path / 'garmin.gpx')
+    wpt = ('  <wpt lat="44.9%d" lon="-68.6"><time>2019-06-01T14:00:0%dZ</time><name>%03d</name>\n'
+           '    <extensions><wptx1:WaypointExtension><wptx1:DisplayMode>SymbolAndName</wptx1:DisplayMode>'
+           '</wptx1:WaypointExtension></extensions>\n  </wpt>\n')
+    with open(gpx, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<gpx xmlns="http://www.topografix.com/GPX/1/1" '
+                'xmlns:wptx1="http://www.garmin.com/xmlschemas/WaypointExtension/v1" version="1.1" creator="test">\n')
+        f.write(''.join(wpt % (i, i, i) for i in range(2)))
+        f.write('</gpx>\n')
+    assert check.countgpx(gpx=gpx) == len(io.readgpx(gpx=gpx, engine='stream').waypoints) == 2
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_run(line, tmp_path, processes):
+    for kind, name in (('dzx', 'A.DZX'), ('dzt', 'B.DZT'), ('gpx', 'A.gpx'), ('gpx', 'B.gpx')):
+        shutil.copy(line[kind], str(tmp_path / name))
+    bench.gengpx(path=str(tmp_path / 'C.gpx'), n=299)
+    shutil.copy(line['dzx'], str(tmp_path / 'C.DZX'))
+    manifest = str(tmp_path / 'manifest.txt')
+    with open(manifest, 'w') as f:
+        f.write('A.DZX - 10,-1\n' # the end point can not be dropped, so only one is counted
+                'B.DZT\n'
+                'C.DZX\n'
+                'D.DZX C.gpx\n')
+    summary = check.run(batch=manifest, processes=processes)
+    path = lambda name: str(tmp_path / name)
+    assert summary['matched'] == [path('B.DZT')]
+    assert summary['mismatched'] == [path('A.DZX'), path('C.DZX')]
+    assert summary['failed'] == [path('D.DZX')]
+    assert summary['counts'] == {path('A.DZX'): (299, 300), path('B.DZT'): (300, 300), path('C.DZX'): (300, 299)}
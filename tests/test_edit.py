@@ -0,0 +1,30 @@
+import filecmp
+import pytest
+import gpx2dzg.io as io
+from gpx2dzg.session import Converter
+
+
+@pytest.fixture
+def session(line):
+    return Converter(diskcache=None).edit(dzx=line['dzx'], gpx=line['gpx'])
+
+
+def test_write_matches_io_write(session, tmp_path):
+    for drops in ([10, 200], [200], []):
+        session.restore(dzx=session.drops, gpx=session.gpxdrops)
+        session.drop(dzx=drops, gpx=[i + 1 for i in drops])
+        edited, written = str(tmp_path / 'edited.DZG'), str(tmp_path / 'written.DZG')
+        session.write(edited)
+        io.write(dzg=written, dzxmarks=session.dzx.copy(), gpxmarks=session.gpxmarks())
+        assert filecmp.cmp(edited, written, shallow=False)
+
+
+def test_plot_is_redrawn_in_place(session, tmp_path):
+    out = str(tmp_path / 'plot.png')
+    fig = session.plot(out=out)
+    marks = session._plot.lines[2][2]
+    session.drop(dzx=[10, 20])
+    assert session.plot(out=out) is fig
+    assert session._plot.lines[2][2] is marks
+    assert 'count: 298' in session._plot.lines[2][1].get_text()
+    assert len(marks.get_offsets()) <= 298
@@ -0,0 +1,85 @@
+"""Simulates recording by growing copies of generated files in random chunks (cutting records and scans anywhere)
+while a `Follower` updates after each chunk, and checks that the finished DZG is the same as `io.write()` makes."""
+import os
+import filecmp
+import numpy as np
+import pytest
+import gpx2dzg.bench as bench
+import gpx2dzg.io as io
+import gpx2dzg.follow as follow
+from gpx2dzg.exceptions import GPXError
+
+N = 300
+
+
+@pytest.fixture(params=['TargetGroup', 'File', 'DZT'])
+def recorded(request, tmp_path):
+    """Complete inputs of each kind, and the DZG `io.write()` makes from them."""
+    scans = np.arange(N, dtype=np.int64) * bench.SPACING
+    gpx = str(tmp_path / 'done.gpx')
+    bench.gengpx(path=gpx, n=N)
+    if request.param == 'DZT':
+        radar = str(tmp_path / 'done.DZT')
+        bench.gendzt(path=radar, nscans=int(scans[-1]), marks=scans[1:-1])
+        marks = io.readSIR3k(dzt=radar)
+    else:
+        radar = str(tmp_path / 'done.DZX')
+        bench.gendzx(path=radar, scans=scans, schema=request.param)
+        marks = io.readdzx(dzx=radar)
+    dzg = str(tmp_path / 'done.DZG')
+    io.write(dzg=dzg, dzxmarks=marks, gpxmarks=io.readgpx(gpx=gpx, engine='stream'))
+    return radar, gpx, dzg
+
+
+def grow(radar='', gpx='', live='', seed=0, restart=False):
+    """Grows copies of `radar` and `gpx` in `live` in random chunks, updating a `Follower` after each one.
+    The GPX is closed after every chunk, as loggers do. If `restart`, the radar file is replaced with a shorter
+    one halfway through. Returns the path of the finished DZG."""
+    with open(radar, 'rb') as f:
+        r = f.read()
+    with open(gpx, 'rb') as f:
+        g = f.read()
+    body, tail = g[:g.rindex(b'</gpx>')], g[g.rindex(b'</gpx>'):]
+    liveradar = os.path.join(live, 'LINE' + os.path.splitext(radar)[1])
+    livegpx = os.path.join(live, 'LINE.gpx')
+    f = follow.Follower(dzx=liveradar, gpx=livegpx)
+    rng = np.random.default_rng(seed)
+    ri = gi = 0
+    while (ri < len(r)) or (gi < len(body)):
+        ri = min(len(r), ri + int(rng.integers(1, len(r) // 8)))
+        gi = min(len(body), gi + int(rng.integers(1, len(body) // 8)))
+        if restart and (ri > len(r) // 2):
+            ri, restart = len(r) // 4, False
+        with open(liveradar, 'wb') as o:
+            o.write(r[:ri])
+        with open(livegpx, 'wb') as o:
+            o.write(body[:gi] + tail)
+        f.update()
+    assert f.finish()
+    return f.dzg
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_follow_matches_write(recorded, tmp_path, seed):
+    radar, gpx, dzg = recorded
+    live = tmp_path / ('live%s' % seed)
+    live.mkdir()
+    assert filecmp.cmp(grow(radar=radar, gpx=gpx, live=str(live), seed=seed), dzg, shallow=False)
+
+
+def test_restart_when_replaced(recorded, tmp_path):
+    radar, gpx, dzg = recorded
+    live = tmp_path / 'live'
+    live.mkdir()
+    assert filecmp.cmp(grow(radar=radar, gpx=gpx, live=str(live), restart=True), dzg, shallow=False)
+
+
+def test_timeless_waypoint(tmp_path):
+    gpx = str(tmp_path / 'LINE.gpx')
+    bench.gengpx(path=gpx, n=3)
+    with open(gpx) as f:
+        text = f.read()
+    with open(gpx, 'w') as f:
+        f.write(text.replace('<time>', '<desc>', 1).replace('</time>', '</desc>', 1))
+    with pytest.raises(GPXError):
+        follow.GPXTail(path=gpx).read()
@@ -0,0 +1,78 @@
+import filecmp
+import numpy as np
+import pytest
+import gpx2dzg.functions as fx
+import gpx2dzg.io as io
+
+N = 10
+
+
+@pytest.fixture
+def table():
+    return io.MarkTable(scan=np.arange(N) * 100)
+
+
+def test_drop_masks_rows(table):
+    table.drop([2, 5])
+    assert len(table) == N - 2
+    assert table.total == N
+    assert table.dropped == [2, 5]
+    assert table.num.tolist() == [0, 1, 3, 4, 6, 7, 8, 9]
+    assert table.scan.tolist() == [0, 100, 300, 400, 600, 700, 800, 900]
+
+
+def test_drop_is_positional_among_kept_rows(table):
+    table.drop([2])
+    table.drop([2]) # now original row 3
+    assert table.dropped == [2, 3]
+
+
+def test_dropnum_and_restore(table):
+    table.dropnum([4, 7])
+    assert table.dropped == [4, 7]
+    table.restore([4])
+    assert table.dropped == [7]
+    table.restore([7])
+    assert table.dropped == []
+    assert table.scan.tolist() == (np.arange(N) * 100).tolist()
+
+
+def test_copy_has_its_own_mask(table):
+    t = table.copy()
+    t.drop([1])
+    assert table.dropped == []
+    assert t.dropped == [1]
+    assert t._scan is table._scan
+
+
+def test_join_matches_kept_rows(table):
+    lats, lons = np.linspace(40., 41., N), np.linspace(-75., -74., N)
+    gpx = io.MarkTable(time=np.arange(N) * 10**9, lat=lats, lon=lons, ele=np.zeros(N))
+    table.drop([3])
+    gpx.drop([6])
+    m = io.MarkTable.join(table, gpx)
+    assert len(m) == N - 1
+    assert m.scan.tolist() == table.scan.tolist()
+    assert m.lat.tolist() == np.delete(lats, 6).tolist()
+    assert m.time.tolist() == np.delete(np.arange(N) * 10**9, 6).tolist()
+
+
+@pytest.mark.parametrize('drops', [[3], [3, -2], [0, 4, -1], [12]])
+def test_drop_matches_list_drops(table, drops):
+    marks = table.scan.tolist()
+    fx.drop(marks=table, drops=list(drops))
+    fx.drop(marks=marks, drops=list(drops))
+    assert table.scan.tolist() == marks
+
+
+def test_masked_write_matches_list_write(line, tmp_path):
+    marks = list(io.readdzx(dzx=line['dzx']))
+    dzxmarks = io.MarkTable(scan=marks)
+    gpxmarks = io.MarkTable(*fx.columns(io.readgpx(gpx=line['gpx'], engine='stream')))
+    fx.drop(marks=dzxmarks, drops=[10, 200])
+    fx.drop(marks=marks, drops=[10, 200])
+    gpxmarks.drop([20, 150])
+    masked, listed = str(tmp_path / 'masked.DZG'), str(tmp_path / 'listed.DZG')
+    io.write(dzg=masked, dzxmarks=dzxmarks, gpxmarks=gpxmarks)
+    io.write(dzg=listed, dzxmarks=marks, gpxmarks=gpxmarks)
+    assert filecmp.cmp(masked, listed, shallow=False)
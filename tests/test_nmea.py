@@ -0,0 +1,57 @@
+"""Checks DZG output against golden files written by the original `pynmea2` writer (`gpx2dzg.io.write()` as of
+version 0.1.0) for short lines in each hemisphere, including one crossing the equator and the prime meridian.
+The original writer took declination for the day it was run, so the golden files were written with the model
+epoch pinned to the survey date (2019-06-01), which is what `Declination(tolerance=0)` evaluates at each point.
+Waypoint times are whole seconds, since the original writer dropped the sub-second part of time differences.
+"""
+import os
+import filecmp
+import numpy as np
+import pytest
+import gpx2dzg.functions as fx
+import gpx2dzg.io as io
+import gpx2dzg.nmea as nmea
+import gpx2dzg.geoid as geoid
+from gpx2dzg.declination import Declination
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+LINES = ['nw', 'sw', 'se', 'zero']
+
+
+def read(name=''):
+    stem = os.path.join(DATA, name)
+    dzxmarks = io.readdzx(dzx=stem + '.DZX')
+    gpxmarks = io.readgpx(gpx=stem + '.gpx', engine='stream')
+    with open(stem + '.DZG') as f:
+        golden = f.read()
+    return dzxmarks, gpxmarks, golden
+
+
+@pytest.mark.parametrize('name', LINES)
+def test_blocks(name):
+    dzxmarks, gpxmarks, golden = read(name)
+    times, lats, lons, elevs = fx.columns(gpxmarks)
+    k = fx.kinematics(lats=lats, lons=lons, times=times)
+    geoid.load()
+    out = nmea.blocks(scans=dzxmarks, times=times, lats=lats, lons=lons, elevs=elevs,
+                      geoidh=geoid.height(lats=lats, lons=lons), sogs=k['sog'], courses=k['course'],
+                      decs=Declination(tolerance=0, maxsize=0).lookup(lats=lats, lons=lons, times=times))
+    assert ''.join(out) == golden
+
+
+@pytest.mark.parametrize('name', LINES)
+def test_write(name, tmp_path):
+    dzxmarks, gpxmarks, golden = read(name)
+    dzg = str(tmp_path / (name + '.DZG'))
+    io.write(dzg=dzg, dzxmarks=dzxmarks, gpxmarks=gpxmarks, dec=Declination(tolerance=0, maxsize=0))
+    assert filecmp.cmp(dzg, os.path.join(DATA, name + '.DZG'), shallow=False)
+
+
+def test_hemispheres():
+    lats, lons = [], []
+    for name in LINES:
+        g = read(name)[1]
+        lats.append(fx.columns(g)[1])
+        lons.append(fx.columns(g)[2])
+    lats, lons = np.concatenate(lats), np.concatenate(lons)
+    assert (lats > 0).any() and (lats < 0).any() and (lons > 0).any() and (lons < 0).any()
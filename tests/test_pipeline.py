@@ -0,0 +1,44 @@
+import filecmp
+import threading
+import pytest
+import gpx2dzg.functions as fx
+from gpx2dzg.session import Converter
+
+
+def convert(paths={}, kind='dzx', dzg='', pipeline=False, **kwargs):
+    c = Converter(diskcache=None, pipeline=pipeline)
+    return c.convert(dzx=paths[kind], gpx=paths['gpx'], write=True, dzg=dzg, **kwargs)
+
+
+@pytest.mark.parametrize('kind', ['dzx', 'dzt'])
+@pytest.mark.parametrize('kwargs', [{}, {'drops': [40], 'autodrop': True}, {'every': 50}])
+def test_same_output(line, tmp_path, kind, kwargs):
+    serial, piped = str(tmp_path / 'serial.DZG'), str(tmp_path / 'piped.DZG')
+    r = convert(line, kind=kind, dzg=serial, **kwargs)
+    p = convert(line, kind=kind, dzg=piped, pipeline=True, **kwargs)
+    assert r.matched and p.matched
+    assert filecmp.cmp(serial, piped, shallow=False)
+    assert (p.drops, p.gpxdrops) == (r.drops, r.gpxdrops)
+    counters = lambda m: {k: v for k, v in m.counters.items() if k != 'declination evaluations'} # shared, so cached
+    assert counters(p.metrics) == counters(r.metrics)
+    assert set(p.metrics.timers) == set(r.metrics.timers)
+
+
+def test_reads_overlap(line, monkeypatch):
+    both = threading.Barrier(2, timeout=10) # only passes once the dzx and gpx reads are running at the same time
+    readmarks, readgpx = Converter.readmarks, Converter.readgpx
+    monkeypatch.setattr(Converter, 'readmarks', lambda self, **kw: (both.wait(), readmarks(self, **kw))[1])
+    monkeypatch.setattr(Converter, 'readgpx', lambda self, **kw: (both.wait(), readgpx(self, **kw))[1])
+    assert Converter(diskcache=None, pipeline=True).convert(dzx=line['dzx'], gpx=line['gpx']).matched
+
+
+def test_warnings_reach_result(line, monkeypatch):
+    readgpx = Converter.readgpx
+    def warn(self, **kw):
+        fx.printmsg('WARNING: read on %s' % threading.current_thread().name)
+        return readgpx(self, **kw)
+    monkeypatch.setattr(Converter, 'readgpx', warn)
+    r = Converter(diskcache=None, pipeline=True).convert(dzx=line['dzx'], gpx=line['gpx'])
+    assert len(r.warnings) == 1
+    assert 'gpx2dzg-read' in r.warnings[0]
+    assert 'read gpx' in r.metrics.timers
@@ -0,0 +1,30 @@
+import os
+import numpy as np
+import gpx2dzg.io as io
+import gpx2dzg.plot as plot
+
+
+def test_visible_keeps_first_point_per_pixel():
+    x = np.array([0., 0.1, 0.4, 1.2, 1.3, 9.9])
+    assert plot.visible(x=x, xmax=10, pixels=10).tolist() == [0, 3, 5]
+    assert len(plot.visible(x=[], xmax=10)) == 0
+
+
+def test_labelled_skips_overlaps():
+    x = np.arange(100.)
+    keep = plot.labelled(x=x, labels=[str(i) for i in range(100)], xmax=100, width=100.)
+    assert keep[0] == 0
+    assert 0 < len(keep) < 100
+    gaps = np.diff(x[keep]) # 100 points wide, so one unit of x is one point
+    assert (gaps >= 2 * plot.LABELSIZE * plot.CHARWIDTH).all()
+
+
+def test_saves_without_display(line, tmp_path):
+    out = str(tmp_path / 'plot.png')
+    dzx = io.MarkTable(scan=np.asarray(io.readdzx(dzx=line['dzx'])))
+    dzx.dropnum([5])
+    fig = plot.sanityplot(gpx=io.readgpx(gpx=line['gpx'], engine='stream'), dzx=dzx, out=out)
+    assert os.path.getsize(out) > 0
+    assert fig.canvas.manager is None # not a pyplot figure
+    labels = [int(t.get_text()) for t in fig.axes[2].texts if t.get_text().isdigit()]
+    assert labels and set(labels) <= set(dzx.num.tolist()) # original mark numbers
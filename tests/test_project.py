@@ -0,0 +1,84 @@
+import os
+import filecmp
+import numpy as np
+import pytest
+import gpx2dzg.bench as bench
+import gpx2dzg.io as io
+import gpx2dzg.project as project
+
+COUNTS = [100, 80, 120]
+
+
+@pytest.fixture
+def survey(tmp_path):
+    """Three lines recorded one after another with one GPX log for the day."""
+    lines = tmp_path / 'lines'
+    lines.mkdir()
+    day = str(tmp_path / 'day.gpx')
+    bench.gengpx(path=day, n=sum(COUNTS))
+    for i, n in enumerate(COUNTS):
+        bench.gendzx(path=str(lines / ('FILE____%03d.DZX' % (i + 1))), scans=np.arange(n, dtype=np.int64) * bench.SPACING)
+    return str(lines), day
+
+
+def expected(dzx='', gpx=None, start=0, stop=0, dzg=''):
+    w = gpx.waypoints
+    sub = io.MarkTable(time=w.time[start:stop], lat=w.lat[start:stop], lon=w.lon[start:stop], ele=w.ele[start:stop])
+    io.write(dzg=dzg, dzxmarks=io.readdzx(dzx=dzx), gpxmarks=io.GPXData(waypoints=sub))
+
+
+def test_lines_get_their_own_waypoints(survey, tmp_path):
+    lines, day = survey
+    summary = project.run(batch=lines, gpx=day, write=True, processes=1)
+    assert len(summary['written']) == len(COUNTS)
+    g = io.readgpx(gpx=day, engine='stream')
+    for dzx, (start, stop) in zip(sorted(summary['written']), project.slices(COUNTS)):
+        dzg = str(tmp_path / 'expected.DZG')
+        expected(dzx=dzx, gpx=g, start=start, stop=stop, dzg=dzg)
+        assert filecmp.cmp(os.path.splitext(dzx)[0] + '.DZG', dzg, shallow=False)
+
+
+def test_manifest_drops_count(survey):
+    lines, day = survey
+    bench.gendzx(path=os.path.join(lines, 'FILE____002.DZX'),
+                 scans=np.arange(COUNTS[1] + 1, dtype=np.int64) * bench.SPACING) # one extra mark
+    manifest = os.path.join(lines, 'manifest.txt')
+    with open(manifest, 'w') as f:
+        f.write('FILE____001.DZX\nFILE____002.DZX - 40\nFILE____003.DZX\n')
+    summary = project.run(batch=manifest, gpx=day, write=False, processes=1)
+    assert len(summary['matched']) == len(COUNTS)
+
+
+def test_mismatch_writes_nothing(survey):
+    lines, day = survey
+    os.remove(os.path.join(lines, 'FILE____003.DZX'))
+    summary = project.run(batch=lines, gpx=day, write=True, processes=1)
+    assert len(summary['mismatched']) == len(COUNTS) - 1
+    assert not [f for f in os.listdir(lines) if f.endswith('.DZG')]
+
+
+def test_marks_are_read_once(survey, monkeypatch):
+    lines, day = survey
+    reads = []
+    readdzx = io.readdzx
+    monkeypatch.setattr(io, 'readdzx', lambda dzx='': (reads.append(os.path.basename(dzx)), readdzx(dzx=dzx))[1])
+    summary = project.run(batch=lines, gpx=day, write=True, processes=1)
+    assert len(summary['written']) == len(COUNTS)
+    assert sorted(reads) == ['FILE____%03d.DZX' % (i + 1) for i in range(len(COUNTS))]
+
+
+def test_unreadable_line_fails(survey):
+    lines, day = survey
+    with open(os.path.join(lines, 'FILE____002.DZX'), 'w') as f:
+        f.write('<DZX><TargetGroup>')
+    summary = project.run(batch=lines, gpx=day, write=True, processes=2)
+    assert summary['failed'] == [os.path.join(lines, 'FILE____002.DZX')]
+    assert len(summary['mismatched']) == len(COUNTS) - 1
+
+
+def test_sortwaypoints():
+    t = np.array([3, 1, 2, 1], dtype=np.int64)
+    w = io.MarkTable(time=t, lat=np.arange(4.), lon=np.arange(4.), ele=np.zeros(4))
+    s = project.sortwaypoints(io.GPXData(waypoints=w)).waypoints
+    assert s.time.tolist() == [1, 1, 2, 3]
+    assert s.lat.tolist() == [1., 3., 2., 0.] # equal times keep their file order
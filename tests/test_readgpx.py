@@ -0,0 +1,33 @@
+import re
+import pytest
+import gpx2dzg.gpx2dzg as g2d
+import gpx2dzg.io as io
+from gpx2dzg.exceptions import GPXError
+from gpx2dzg.session import Converter
+
+
+@pytest.fixture
+def timeless(line, tmp_path):
+    """The generated GPX with the time of its third waypoint removed."""
+    with open(line['gpx']) as f:
+        text = f.read()
+    wpts = [m.start() for m in re.finditer('<wpt', text)]
+    third = text[wpts[2]:wpts[3]]
+    gpx = str(tmp_path / 'timeless.gpx')
+    with open(gpx, 'w') as f:
+        f.write(text.replace(third, re.sub('<time>[^<]*</time>', '', third)))
+    return gpx
+
+
+def test_timeless_waypoints_are_rejected(timeless):
+    with pytest.raises(GPXError):
+        io.readgpx(gpx=timeless, engine='stream')
+    assert len(io.readgpx(gpx=timeless, engine='stream', check=False).waypoints) == 300
+
+
+def test_timeless_waypoints_fail_conversion(line, timeless, tmp_path):
+    with pytest.raises(GPXError):
+        Converter(diskcache=None).convert(dzx=line['dzx'], gpx=timeless, write=True, dzg=str(tmp_path / 'out.DZG'))
+    with pytest.raises(SystemExit) as e: # an error message instead of a traceback
+        g2d.convert(dzx=line['dzx'], gpx=timeless, write=True, autoplot=False)
+    assert e.value.code == 2
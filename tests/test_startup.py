@@ -0,0 +1,35 @@
+"""Checks that the command line starts without importing heavy dependencies, which are only imported by the
+code paths that need them."""
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ['matplotlib', 'gpxpy', 'readgssi', 'pygeodesy', 'geomag', 'geopy', 'pkg_resources']
+MAXSECONDS = 1.5 # cumulative import time of gpx2dzg.gpx2dzg, about 0.15 s on a laptop
+
+
+def run(*args):
+    return subprocess.run([sys.executable] + list(args), cwd=ROOT, capture_output=True, text=True, check=True)
+
+
+def loaded(code=''):
+    """Returns the heavy modules in `sys.modules` after running `code` in a new interpreter."""
+    out = run('-c', code + '\nimport sys\nprint("loaded:", *(m for m in %r if m in sys.modules))' % HEAVY).stdout
+    return out.splitlines()[-1].split()[1:]
+
+
+def test_import_is_light():
+    assert loaded('import gpx2dzg.gpx2dzg') == []
+
+
+def test_help_is_light():
+    assert loaded('import sys\nsys.argv = ["gpx2dzg", "-h"]\nimport gpx2dzg.gpx2dzg as g\n'
+                  'try:\n    g.main()\nexcept SystemExit:\n    pass') == []
+
+
+def test_import_time():
+    lines = run('-X', 'importtime', '-c', 'import gpx2dzg.gpx2dzg').stderr.splitlines()
+    cumulative = [int(l.split('|')[1]) for l in lines if l.split('|')[-1].strip() == 'gpx2dzg.gpx2dzg']
+    assert len(cumulative) == 1
+    assert cumulative[0] / 1e6 < MAXSECONDS
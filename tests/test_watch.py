@@ -0,0 +1,58 @@
+import os
+import shutil
+import time
+import pytest
+import gpx2dzg.watch as watch
+
+PAIRS = [('A.DZX', 'dzx'), ('B.DZT', 'dzt'), ('C.DZX', 'dzxfile')]
+
+
+@pytest.fixture
+def folder(line, tmp_path, monkeypatch):
+    """A synced folder holding three pairs, with the disk cache pointed at a directory that should never be made."""
+    monkeypatch.setenv('GPX2DZG_CACHE', str(tmp_path / 'cache'))
+    d = tmp_path / 'sync'
+    d.mkdir()
+    for name, kind in PAIRS:
+        shutil.copy(line[kind], str(d / name))
+        shutil.copy(line['gpx'], str(d / (os.path.splitext(name)[0] + '.gpx')))
+    return str(d)
+
+
+def run(folder='', **kwargs):
+    watch.watch(dir=folder, write=True, once=True, interval=0.05, **dict({'settle': 0., 'processes': 2}, **kwargs))
+    return watch.readstate(os.path.join(folder, watch.STATE))
+
+
+def test_converts_settled_pairs(folder, tmp_path):
+    start = time.time()
+    done = run(folder, settle=0.5, processes=1) # one worker, so the queue fills and the poller has to wait
+    assert sorted(os.path.basename(p) for p in done) == [name for name, kind in PAIRS]
+    assert all(d['status'] == 'written' for d in done.values())
+    assert all(d['time'] - start >= 0.5 for d in done.values())
+    for name, kind in PAIRS:
+        assert os.path.exists(os.path.join(folder, os.path.splitext(name)[0] + '.DZG'))
+    assert not os.path.exists(str(tmp_path / 'cache'))
+
+
+def test_restart_only_converts_changed_pairs(folder):
+    first = run(folder)
+    assert run(folder) == first # nothing has changed, so nothing is converted again
+    changed = os.path.join(folder, 'B.gpx')
+    st = os.stat(changed)
+    os.utime(changed, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    second = run(folder)
+    again = [os.path.basename(p) for p in second if second[p] != first[p]]
+    assert again == ['B.DZT']
+    assert second[os.path.join(folder, 'B.DZT')]['sig'] == watch.signature(os.path.join(folder, 'B.DZT'), changed)
+
+
+def test_unreadable_state_starts_fresh(folder):
+    with open(os.path.join(folder, watch.STATE), 'w') as f:
+        f.write('{"pairs": ')
+    assert len(run(folder)) == len(PAIRS)
+
+
+def test_cache_flag(folder, tmp_path):
+    run(folder, cache=True)
+    assert os.path.exists(str(tmp_path / 'cache'))